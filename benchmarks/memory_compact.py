@@ -0,0 +1,127 @@
+"""
+Memory used by a generated config with many parameters, with and without ConfigBase.COMPACT.
+
+    python benchmarks/memory_compact.py --params 20000
+
+Each mode is measured in new processes: one times the build and another one traces its memory with tracemalloc,
+which makes it several times slower (minutes for 100000 parameters). "retained" is the memory allocated while building the config that is
+still in use afterwards, and "peak" the maximum during the build. Part of the retained memory is not related to the
+columnar annotations: "source" is the source code of set_parameters that inspect leaves in linecache, which compact
+mode drops. "annotations" is the memory of the annotation containers alone (the cached one and the one of the
+config, if it is a different object): dictionaries of dictionaries by default, an AnnotationTable in compact mode.
+"""
+import argparse
+import gc
+import importlib
+import json
+import linecache
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+
+
+def write_config_module(dirname, n_params):
+    lines = ["from typing import List",
+             "from configfile.configbase import ConfigBase",
+             "",
+             "class GeneratedConfig(ConfigBase):",
+             "    COMPACT = False",
+             "",
+             "    def set_parameters(self):"]
+    for i in range(n_params):
+        if i % 2:
+            lines.append(f"        self.layer{i}_lr: float = 0.1")
+        else:
+            lines.append(f"        self.layer{i}_units: List[int] = [64, 64]")
+    lines += ["",
+              "class CompactGeneratedConfig(GeneratedConfig):",
+              "    COMPACT = True",
+              ""]
+    with open(os.path.join(dirname, "generated_config.py"), "w") as f:
+        f.write("\n".join(lines))
+
+
+def annotations_size(annotations):
+    """
+    Bytes taken by the containers of the annotations. The names and the types are not counted, since they are
+    shared with the rest of the config
+    """
+    from configfile.utils import AnnotationTable
+    if isinstance(annotations, AnnotationTable):
+        return sum(sys.getsizeof(x) for x in (annotations, annotations._names, annotations._dtypes,
+                                              annotations._flags))
+    return sys.getsizeof(annotations) + sum(sys.getsizeof(x) for x in annotations.values() if x is not None)
+
+
+def measure(dirname, compact, traced):
+    sys.path[:0] = [_ROOT, dirname]
+    module = importlib.import_module("generated_config")
+    from configfile import utils
+    config_class = module.CompactGeneratedConfig if compact else module.GeneratedConfig
+    gc.collect()
+    if not traced:
+        start = time.perf_counter()
+        config_class.new_instance("generated")
+        return {"seconds": time.perf_counter() - start}
+    tracemalloc.start()
+    conf = config_class.new_instance("generated")
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    linecache.clearcache()
+    gc.collect()
+    without_source, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert conf.layer1_lr == 0.1
+
+    annotations = conf.config_classname_2_annotations_prefix[conf.name][0]
+    cache = utils._annotation_tables_cache if compact else utils._annotations_cache
+    cached = cache[config_class.set_parameters.__code__]
+    annotations_bytes = annotations_size(cached)
+    if annotations is not cached:  # Only the outer dictionary is copied for each config
+        annotations_bytes += sys.getsizeof(annotations)
+    return {"retained": retained, "peak": peak, "source": retained - without_source, "annotations": annotations_bytes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--params", type=int, default=20000, help="Number of parameters of the config")
+    parser.add_argument("--_measure", choices=["default", "compact"], help=argparse.SUPPRESS)
+    parser.add_argument("--_traced", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--_dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._measure:
+        print(json.dumps(measure(args._dir, args._measure == "compact", args._traced)))
+        return
+
+    with tempfile.TemporaryDirectory() as dirname:
+        write_config_module(dirname, args.params)
+        results = {}
+        for mode in ("default", "compact"):
+            results[mode] = {}
+            for traced in ([], ["--_traced"]):
+                out = subprocess.run([sys.executable, __file__, "--_measure", mode, "--_dir", dirname] + traced,
+                                     check=True, capture_output=True, text=True).stdout
+                results[mode].update(json.loads(out))
+
+    print(f"{args.params} parameters")
+    print(f"{'mode':<10}{'retained MB':>14}{'source MB':>12}{'annotations MB':>17}{'peak MB':>12}{'seconds':>10}")
+    for mode, result in results.items():
+        print(f"{mode:<10}{result['retained'] / 1e6:>14.1f}{result['source'] / 1e6:>12.1f}"
+              f"{result['annotations'] / 1e6:>17.2f}{result['peak'] / 1e6:>12.1f}{result['seconds']:>10.1f}")
+    default, compact = results["default"], results["compact"]
+    saved = 1 - compact["retained"] / default["retained"]
+    saved_without_source = 1 - (compact["retained"] - compact["source"]) / (default["retained"] - default["source"])
+    saved_annotations = 1 - compact["annotations"] / default["annotations"]
+    print(f"compact mode retains {100 * saved:.0f}% less memory ({100 * saved_without_source:.0f}% less without "
+          f"counting the source code). The AnnotationTable takes {100 * saved_annotations:.0f}% less memory than "
+          f"the annotation dictionaries")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,3 +4,4 @@ with open(os.path.abspath(os.path.join(__file__, os.path.pardir, "version.txt"))
     __version__ = f.read().strip()
 
 from configfile.configbase import ConfigBase
+from configfile.configbase_experimental import ConfigBaseDict
@@ -0,0 +1,298 @@
+"""
+Append-only binary log of the changes of a storage, to know every value that a config took during a run.
+
+    log = conf.record_changes("run.cfglog")  # Logs the current values and then every change
+    ...
+    log.close()
+    replay("run.cfglog", until=timestamp)  # {param_name: value} at that time
+
+The file starts with a header, followed by records of a fixed-size header
+(timestamp: float64, event: uint8, key length: uint16, source length: uint16, value length: uint32) and the utf-8
+key, the utf-8 source and the json encoded value. Records are kept in memory and written (and fsynced) in batches
+by a background thread, so recording a change does not do any I/O. The pending records of the logs that are still
+open are written at exit. A truncated record at the end of the file (e.g. after a crash) is ignored. Compacted logs
+start with a "checkpoint" record with the time of the compaction, before which the state is not known anymore.
+
+The source of each change ("defaults", "yaml", "env", "cli", "update"...) is taken from the change_source context.
+"""
+import atexit
+import contextlib
+import contextvars
+import os
+import struct
+import threading
+import time
+import weakref
+from collections import namedtuple
+
+from configfile.envVarUtils import get_codec
+from configfile.storages import _copy_value
+
+_MAGIC = b"CFGLOG1\n"
+_RECORD_HEADER = struct.Struct("<dBHHI")
+_EVENTS = ("put", "delete", "checkpoint")
+_EVENT_CODES = {event: code for code, event in enumerate(_EVENTS)}
+
+ChangeRecord = namedtuple("ChangeRecord", ["timestamp", "event", "key", "value", "source"])
+
+CHANGE_SOURCE = contextvars.ContextVar("configfile_change_source", default="update")
+
+
+@contextlib.contextmanager
+def change_source(source: str):
+    """
+    Context manager that tags the changes done within it as coming from source
+    """
+    token = CHANGE_SOURCE.set(source)
+    try:
+        yield
+    finally:
+        CHANGE_SOURCE.reset(token)
+
+
+def _encode_record(codec, timestamp, event, key, value, source):
+    key = key.encode("utf-8")
+    source = source.encode("utf-8")
+    value = b"" if event != "put" else codec.dumps(value).encode("utf-8")
+    return _RECORD_HEADER.pack(timestamp, _EVENT_CODES[event], len(key), len(source), len(value)) + key + source \
+        + value
+
+
+def iter_records(path, codec=None):
+    """
+    Yields the ChangeRecords of the log file at path, in order
+    """
+    codec = get_codec(codec)
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(_MAGIC):
+        raise ValueError(f"Error, {path} is not a configfile change log")
+    offset = len(_MAGIC)
+    while offset + _RECORD_HEADER.size <= len(data):
+        timestamp, event, keyLen, sourceLen, valueLen = _RECORD_HEADER.unpack_from(data, offset)
+        offset += _RECORD_HEADER.size
+        end = offset + keyLen + sourceLen + valueLen
+        if end > len(data):
+            break
+        key = data[offset: offset + keyLen].decode("utf-8")
+        source = data[offset + keyLen: offset + keyLen + sourceLen].decode("utf-8")
+        event = _EVENTS[event]
+        value = None if event != "put" else codec.loads(data[offset + keyLen + sourceLen: end].decode("utf-8"))
+        offset = end
+        yield ChangeRecord(timestamp, event, key, value, source)
+
+
+def replay(path, until=None, codec=None):
+    """
+    Rebuilds the state recorded in the log file at path.
+
+    :param until: A timestamp (as given by time.time()). Only the changes done until then are applied. None for all.
+                  Raises ValueError if it is earlier than the last compaction of the log, that dropped that state
+    :return: A dictionary {param_name: value}
+    """
+    state = {}
+    for record in iter_records(path, codec):
+        if until is not None and record.timestamp > until:
+            if record.event == "checkpoint":
+                raise ValueError(f"Error, the log {path} was compacted at {record.timestamp}, so its state at "
+                                 f"{until} is not available")
+            break
+        if record.event == "put":
+            state[record.key] = record.value
+        elif record.event == "delete":
+            state.pop(record.key, None)
+    return state
+
+
+_OPEN_LOGS = weakref.WeakSet()
+
+
+@atexit.register
+def _close_open_logs():
+    for log in list(_OPEN_LOGS):
+        log.close()
+
+
+def _flush_loop(logRef, wakeup):
+    """
+    Target of the flusher thread of a ChangeLog. It only keeps a weak reference to the log, and stops once the log
+    is closed or collected
+    """
+    timeout = None
+    while True:
+        wakeup.wait(timeout)
+        wakeup.clear()
+        log = logRef()
+        if log is None:
+            return
+        running, timeout = log._flush_due()
+        del log
+        if not running:
+            return
+
+
+class ChangeLog():
+    """
+    Records the changes of a storage into an append-only log file. Use ConfigBase.record_changes to build it, or
+    attach it to any storage
+    """
+
+    def __init__(self, path, codec=None, flush_bytes: int = 1 << 16, flush_interval: float = 1.0,
+                 fsync: bool = True, compact_every=None):
+        """
+        :param path: The log file. New records are appended to it if it already exists
+        :param codec: The JsonCodec, or its name, used to encode the values. None for the default one
+        :param flush_bytes: The pending records are written once they take more than flush_bytes
+        :param flush_interval: The pending records are written at most flush_interval seconds after the previous
+                               write
+        :param fsync: If True, the file is fsynced after each write
+        :param compact_every: If not None, the log is compacted after every compact_every records. See compact
+
+        Writes and compactions are done by a background thread, never by the listener of the storage
+        """
+        self.path = path
+        self.codec = get_codec(codec)
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.compact_every = compact_every
+        self._pending = []  # (timestamp, event, key, value, source) not encoded yet
+        self._pendingBytes = 0
+        self._sinceCompaction = 0
+        self._lastFlush = time.monotonic()
+        self._lock = threading.RLock()  # Held while writing the file
+        self._pendingLock = threading.Lock()  # Held while changing the pending records, never during I/O
+        self._storage = None
+        self._file = self._open()
+        self._wakeup = threading.Event()
+        weakref.finalize(self, self._wakeup.set)
+        self._flusher = threading.Thread(target=_flush_loop, args=(weakref.ref(self), self._wakeup),
+                                         name="configfile-changelog", daemon=True)
+        self._flusher.start()
+        _OPEN_LOGS.add(self)
+
+    def _open(self):
+        f = open(self.path, "ab")
+        if f.tell() == 0:
+            f.write(_MAGIC)
+            f.flush()
+        return f
+
+    def attach(self, storage):
+        """
+        Logs the current contents of storage (with source "snapshot") and then all its changes
+        """
+        assert self._storage is None, "Error, the log is already attached to a storage"
+        timestamp = time.time()
+        with self._pendingLock:
+            for k, v in storage.items():
+                self._pending.append((timestamp, "put", k, v, "snapshot"))
+        self._storage = storage
+        storage.add_listener(self.record)
+        self.flush()
+        return self
+
+    def detach(self):
+        if self._storage is not None:
+            self._storage.remove_listener(self.record)
+            self._storage = None
+
+    def record(self, event, k, v=None):
+        """
+        Storage listener that queues the change, waking up the flusher thread if it has something to do
+        """
+        entry = (time.time(), event, k, _copy_value(v), CHANGE_SOURCE.get())
+        with self._pendingLock:
+            wakeup = not self._pending
+            self._pending.append(entry)
+            self._pendingBytes += _RECORD_HEADER.size + len(k) + 16  # Estimated, values are only encoded on flush
+            self._sinceCompaction += 1
+            wakeup = wakeup or self._pendingBytes >= self.flush_bytes or self._compaction_due()
+        if wakeup:
+            self._wakeup.set()
+
+    def _compaction_due(self):
+        return self.compact_every is not None and self._sinceCompaction >= self.compact_every
+
+    def _flush_due(self):
+        """
+        Called by the flusher thread. Writes the pending records, or compacts the log, if it is time to.
+
+        :return: (False if the log is closed, seconds until the next write is due or None if nothing is pending)
+        """
+        with self._lock:
+            if self._file.closed:
+                return False, None
+            if self._compaction_due():
+                self.compact()
+            elif self._pending:
+                remaining = self._lastFlush + self.flush_interval - time.monotonic()
+                if remaining > 0 and self._pendingBytes < self.flush_bytes:
+                    return True, remaining
+                self.flush()
+            return True, None
+
+    def flush(self):
+        """
+        Writes the pending records (and fsyncs the file if fsync)
+        """
+        with self._lock:
+            self._lastFlush = time.monotonic()
+            with self._pendingLock:
+                pending, self._pending, self._pendingBytes = self._pending, [], 0
+            if not pending:
+                return
+            self._file.write(b"".join(_encode_record(self.codec, *entry) for entry in pending))
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def compact(self):
+        """
+        Replaces the whole log by a snapshot of its final state: a checkpoint record and then one record per
+        parameter, with the time of the compaction and the source of its last change. The history before the
+        compaction is lost, so replaying the log until an earlier time raises an error
+        """
+        with self._lock:
+            self.flush()
+            timestamp = time.time()
+            last = {}
+            for record in iter_records(self.path, self.codec):
+                if record.event == "put":
+                    last[record.key] = record
+                elif record.event == "delete":
+                    last.pop(record.key, None)
+            tmpPath = self.path + ".tmp"
+            with open(tmpPath, "wb") as f:
+                f.write(_MAGIC)
+                f.write(_encode_record(self.codec, timestamp, "checkpoint", "", None, "compaction"))
+                f.write(b"".join(_encode_record(self.codec, timestamp, "put", record.key, record.value,
+                                                record.source) for record in last.values()))
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            self._file.close()
+            os.replace(tmpPath, self.path)
+            self._file = self._open()
+            with self._pendingLock:
+                self._sinceCompaction = 0
+
+    def close(self):
+        """
+        Stops recording and writes the pending records
+        """
+        self.detach()
+        with self._lock:
+            if not self._file.closed:
+                self.flush()
+                self._file.close()
+        self._wakeup.set()  # The flusher thread stops
+        if self._flusher is not threading.current_thread():
+            self._flusher.join()
+        _OPEN_LOGS.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,165 @@
+"""
+Command line parsing without argparse, for configs with many parameters (see ConfigBase.parse_cli). It accepts
+the same flags as the parsers built with ConfigBase.add_args_to_argparse:
+
+    --intParam 1 --floatList 1. 2. --strParam=a --dictParam '{"a": 1}' --boolFalseByDefault --NOT_boolTrueByDefault
+
+argv is scanned once, and only the flags that are given are resolved to their parameter and type, so the cost
+does not depend on the number of parameters of the config.
+"""
+import array
+
+from configfile.envVarUtils import get_default_codec
+from configfile.exceptions import ConfigErrorParamNotDefined, ConfigErrorParamTypeMismatch
+from configfile.utils import parse_bool, typeBuilder
+
+_HELP_FLAGS = ("-h", "--help")
+_BOOL, _LIST, _DICT, _SCALAR = "bool", "list", "dict", "scalar"
+
+
+class CliSpec():
+    """
+    Param name -> (kind, dtype) table of the annotated parameters of a config class, filled lazily with the flags
+    that are used. Annotations only depend on the class, so it is shared by all its instances (see
+    ConfigBase._get_cli_spec). The kind of the parameters without annotation depends on their current value, so it
+    is not kept
+    """
+
+    def __init__(self):
+        self._specs = {}  # param_name -> (kind, dtype), once resolved
+
+    def _param_spec(self, config, key):
+        spec = self._specs.get(key)
+        if spec is None:
+            annotation = config._get_annotation(key)
+            if annotation is None:
+                return _spec_from_value(config, key)
+            spec = self._specs[key] = _spec_from_annotation(annotation)
+        return spec
+
+    def resolve(self, config, flag):
+        """
+        Returns (param_name, kind, dtype) for the flag name (without the leading --)
+        """
+        if config._is_parameter(flag):
+            return (flag,) + self._param_spec(config, flag)
+        if flag.startswith("NOT_") and config._is_parameter(flag[4:]):
+            kind, dtype = self._param_spec(config, flag[4:])
+            if kind == _BOOL:
+                return flag[4:], kind, dtype
+        raise ConfigErrorParamNotDefined(f"Error, --{flag} is not a parameter of config {config.name}")
+
+    def help(self, config):
+        lines = [f"usage: {config.name} [--param value ...]", "", "options:", "  -h, --help  show this help message"]
+        for key in sorted(config._parameter_keys()):
+            kind, dtype = self._param_spec(config, key)
+            v = _current_value(config, key)
+            if kind == _DICT:
+                lines.append(f"  --{key} JSON  A dictionary to be provided as json string. Default: {v}")
+            elif kind == _BOOL:
+                flag = "NOT_" + key if v is True else key
+                lines.append(f"  --{flag}  bool. Default={v}")
+            else:
+                metavar = f"{key.upper()} [{key.upper()} ...]" if kind == _LIST else key.upper()
+                lines.append(f"  --{key} {metavar}  {dtype.__name__}. Default={v}")
+        return "\n".join(lines)
+
+
+def _spec_from_annotation(annotation):
+    if annotation.get("isDict"):
+        return _DICT, None
+    dtype = annotation["dtype"]
+    if annotation["isList"]:
+        return _LIST, dtype
+    return (_BOOL if dtype == bool else _SCALAR), dtype
+
+
+def _spec_from_value(config, key):
+    v = _current_value(config, key)
+    if v is None:
+        raise ConfigErrorParamTypeMismatch(f"Error, argument {key} is None, but has no type hint in config")
+    if isinstance(v, dict):
+        return _DICT, None
+    if isinstance(v, (list, tuple, array.array)):
+        if not v:
+            raise ConfigErrorParamTypeMismatch(f"Error, argument {key} is an empty list, but has no type hint "
+                                               f"in config")
+        return _LIST, type(v[0])
+    return (_BOOL if type(v) == bool else _SCALAR), type(v)
+
+
+def _current_value(config, key):
+    if key in config._computed:
+        return config._get_computed(key)
+    return config._storage.peek(key)
+
+
+def _convert(flag, dtype, token):
+    try:
+        return parse_bool(token) if dtype == bool else dtype(token)
+    except ValueError:
+        raise ConfigErrorParamTypeMismatch(f"Error, invalid {dtype.__name__} value for --{flag}: {token!r}")
+
+
+def _convert_list(flag, dtype, tokens, typedArray):
+    """
+    Converts the tokens of a list flag in bulk, into an array.array if typedArray (see ConfigBase.TYPED_ARRAYS)
+    """
+    if dtype == bool:
+        return [_convert(flag, dtype, x) for x in tokens]
+    try:
+        return typeBuilder(dtype, True, isInputStr=False, typedArray=typedArray)(tokens)
+    except ValueError:
+        for x in tokens:  # Raises the error of the first invalid token
+            _convert(flag, dtype, x)
+        raise
+
+
+def _is_flag(token):
+    return token.startswith("--") or token in _HELP_FLAGS
+
+
+def parse_cli(config, spec, argv):
+    """
+    Parses argv and returns {param_name: value} with the parameters that are given in it. Prints the help and
+    exits on -h/--help
+    """
+    params = {}
+    i, n = 0, len(argv)
+    while i < n:
+        token = argv[i]
+        i += 1
+        if token in _HELP_FLAGS:
+            print(spec.help(config))
+            raise SystemExit(0)
+        if not token.startswith("--"):
+            raise ConfigErrorParamNotDefined(f"Error, unexpected argument {token!r}. Parameters are given as "
+                                             f"--param value")
+        flag, eq, inline = token[2:].partition("=")
+        key, kind, dtype = spec.resolve(config, flag)
+        if kind == _BOOL:
+            if eq:
+                raise ConfigErrorParamTypeMismatch(f"Error, --{flag} does not take a value")
+            params[key] = not flag.startswith("NOT_") or flag == key
+            continue
+        if eq:
+            values = [inline]
+        else:
+            start = i
+            while i < n and not _is_flag(argv[i]):
+                i += 1
+            values = argv[start:i]
+        if not values or (kind != _LIST and len(values) > 1):
+            expected = "one or more values" if kind == _LIST else "one value"
+            raise ConfigErrorParamTypeMismatch(f"Error, --{flag} expects {expected}, got {values}")
+        if kind == _LIST:
+            typedArray = isinstance(_current_value(config, key), array.array)
+            params[key] = _convert_list(flag, dtype, values, typedArray)
+        elif kind == _DICT:
+            try:
+                params[key] = get_default_codec().loads(values[0])
+            except ValueError as e:
+                raise ConfigErrorParamTypeMismatch(f"Error, invalid JSON string for --{flag}: {e}")
+        else:
+            params[key] = _convert(flag, dtype, values[0])
+    return params
@@ -0,0 +1,157 @@
+"""
+Ahead-of-time compilation of the schema of a config, so that it does not need to be parsed from the source code
+of set_parameters at runtime (e.g. zipapps, frozen binaries or .pyc-only deployments).
+
+    python -m configfile.compile mypkg.mymodule.MyConfig -o mypkg/_myconfig_schema.py
+
+Then, set COMPILED_SCHEMA = "mypkg._myconfig_schema" in MyConfig. The schema stores hashes of the bytecode and of
+the source code of set_parameters, so it has to be compiled again whenever set_parameters changes or for other
+Python versions. Stale schemas are ignored with a warning. Type hints are not part of the bytecode, so changes
+that only touch them are detected only where the source code is available. Nested configs use their own
+COMPILED_SCHEMA.
+"""
+import argparse
+import functools
+import hashlib
+import importlib
+import inspect
+import pprint
+import sys
+import types
+import warnings
+
+from configfile.constants import ALLOWED_TYPES, ALLOWED_TYPE_NAMES
+from configfile.utils import get_annotations_from_function
+
+SCHEMA_VERSION = 2
+
+
+def import_object(path):
+    """
+    Imports an object given as "package.module.name" or "package.module:name"
+    """
+    if ":" in path:
+        module_name, obj_name = path.split(":")
+    else:
+        module_name, _, obj_name = path.rpartition(".")
+    obj = importlib.import_module(module_name)
+    for attr in obj_name.split("."):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def _serialize_annotations(annotations):
+    return {k: None if v is None else {"dtype": v["dtype"].__name__, "isList": v["isList"], "isDict": v["isDict"]}
+            for k, v in annotations.items()}
+
+
+def _deserialize_annotations(annotations):
+    return {k: None if v is None else {"dtype": ALLOWED_TYPES[ALLOWED_TYPE_NAMES.index(v["dtype"])],
+                                       "isList": v["isList"], "isDict": v["isDict"]}
+            for k, v in annotations.items()}
+
+
+def _function_id(func):
+    return func.__module__ + ":" + func.__qualname__
+
+
+def _const_repr(c):
+    if isinstance(c, (frozenset, set)):  # Their order depends on the hash seed
+        return "{" + ",".join(sorted(_const_repr(x) for x in c)) + "}"
+    if isinstance(c, tuple):
+        return "(" + ",".join(_const_repr(x) for x in c) + ")"
+    return repr(c)
+
+
+def _update_code_hash(h, code):
+    h.update(code.co_code)
+    h.update(repr((code.co_names, code.co_varnames, code.co_freevars, code.co_cellvars)).encode("utf-8"))
+    for c in code.co_consts:
+        if isinstance(c, types.CodeType):
+            _update_code_hash(h, c)
+        else:
+            h.update(_const_repr(c).encode("utf-8"))
+
+
+@functools.lru_cache(maxsize=None)
+def code_hash(func):
+    """
+    Hash of the bytecode (without line numbers) of func and of its constants, so that any edit of its body changes it
+    """
+    h = hashlib.sha256(f"{sys.version_info[0]}.{sys.version_info[1]}".encode("utf-8"))
+    _update_code_hash(h, func.__code__)
+    return h.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def source_hash(func):
+    """
+    Hash of the source code of func, or None if it is not available
+    """
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        return None
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+def _is_stale(schema, set_parameters):
+    if schema.get("version") != SCHEMA_VERSION or schema["code_hash"] != code_hash(set_parameters):
+        return True
+    current_source_hash = source_hash(set_parameters)
+    return None not in (schema["source_hash"], current_source_hash) and schema["source_hash"] != current_source_hash
+
+
+def compile_schema(cls):
+    """
+    Returns the schema of cls: the annotations of its set_parameters, and what identifies the set_parameters they
+    were parsed from
+    """
+    return {"version": SCHEMA_VERSION,
+            "set_parameters": _function_id(cls.set_parameters),
+            "code_hash": code_hash(cls.set_parameters),
+            "source_hash": source_hash(cls.set_parameters),
+            "annotations": _serialize_annotations(get_annotations_from_function(cls.set_parameters))}
+
+
+def render_schema_module(schema, source=""):
+    return (f"# Schema of {source} generated by `python -m configfile.compile`. Do not edit it\n\n"
+            f"SCHEMA = {pprint.pformat(schema, sort_dicts=True)}\n")
+
+
+def load_compiled_annotations(module_name, set_parameters):
+    """
+    Returns the annotations of set_parameters stored in the compiled schema module_name, or None if the module
+    cannot be imported or it was compiled for a different set_parameters (e.g. one inherited by a subclass that
+    overrides it). Stale schemas (compiled from another version of set_parameters) are ignored with a warning
+    """
+    try:
+        schema = importlib.import_module(module_name).SCHEMA
+    except ImportError:
+        return None
+    if schema.get("set_parameters") != _function_id(set_parameters):
+        return None
+    if _is_stale(schema, set_parameters):
+        warnings.warn(f"Compiled schema {module_name} is stale: {_function_id(set_parameters)} changed since it was "
+                      f"compiled (or it was compiled with another Python version). Compile it again with "
+                      f"`python -m configfile.compile`")
+        return None
+    return _deserialize_annotations(schema["annotations"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m configfile.compile",
+                                     description="Compiles the schema of a config into a python module")
+    parser.add_argument("config", help="The config class, as package.module.ConfigClass")
+    parser.add_argument("-o", "--output", help="The python file to write. Printed to stdout if not provided")
+    args = parser.parse_args(argv)
+    content = render_schema_module(compile_schema(import_object(args.config)), source=args.config)
+    if args.output is None:
+        sys.stdout.write(content)
+    else:
+        with open(args.output, "w") as f:
+            f.write(content)
+
+
+if __name__ == "__main__":
+    main()
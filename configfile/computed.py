@@ -0,0 +1,79 @@
+class ComputedParam():
+    """
+    Placeholder for a parameter whose default value is computed lazily from the other parameters.
+    See computed
+    """
+    __slots__ = ("func",)
+
+    def __init__(self, func):
+        self.func = func
+
+
+def computed(func):
+    """
+    Declares, within set_parameters, a parameter whose value is func(config), evaluated on first access and
+    memoized. The parameters read by func are recorded, so that changing any of them invalidates the memoized value.
+    Assigning a value to the parameter (e.g. from yaml, env vars or update) replaces the computation.
+
+    def set_parameters(self):
+        self.dataset_size = 1000
+        self.batch_size: int = computed(lambda conf: conf.dataset_size // 10)
+    """
+    return ComputedParam(func)
+
+
+class _DependencyRecorder():
+    """
+    Proxy of a config that records the names of the parameters that are read through it
+    """
+    __slots__ = ("_config", "_dependencies")
+
+    def __init__(self, config, dependencies):
+        object.__setattr__(self, "_config", config)
+        object.__setattr__(self, "_dependencies", dependencies)
+
+    def __getattr__(self, key):
+        self._dependencies.add(key)
+        return self._config[key]
+
+    def __getitem__(self, key):
+        self._dependencies.add(key)
+        return self._config[key]
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Error, parameters cannot be modified while computing a computed parameter")
+
+
+class _NestedComputation():
+    """
+    The function of a computed parameter of a nested config, as computed by the config that includes it: the
+    parameters that it reads are looked up with the prefix of the nested config
+    """
+    __slots__ = ("func", "prefix")
+
+    def __init__(self, func, prefix):
+        self.func = func
+        self.prefix = prefix
+
+    def __call__(self, config):
+        return self.func(_PrefixedConfig(config, self.prefix))
+
+
+class _PrefixedConfig():
+    """
+    Read-only proxy of a config that reads the parameters of one of its nested configs by their unprefixed names
+    """
+    __slots__ = ("_config", "_prefix")
+
+    def __init__(self, config, prefix):
+        object.__setattr__(self, "_config", config)
+        object.__setattr__(self, "_prefix", prefix)
+
+    def __getattr__(self, key):
+        return self._config[self._prefix + key]
+
+    def __getitem__(self, key):
+        return self._config[self._prefix + key]
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Error, parameters cannot be modified while computing a computed parameter")
@@ -1,23 +1,44 @@
 # configfile
+import argparse
+import array
+import contextlib
+import contextvars
 import inspect
 import json
 import multiprocessing
 import os
+import sys
 import warnings
 from abc import abstractmethod
+from concurrent.futures import ProcessPoolExecutor
 from functools import partial
-from typing import Optional, Dict, Any, List
+from types import MappingProxyType
+from typing import Optional, Dict, Any, List, Union, TYPE_CHECKING
 
-from configfile.envVarUtils import param_to_env_name, env_to_param_name, \
-    load_envvar_to_param
-from configfile.storages import EnvVarsStorage, MultiStorage
+from configfile.envVarUtils import param_to_env_name, env_to_param_name, load_envvars_to_params, \
+    serialize_param_to_envvar
+from configfile.storages import EnvVarsStorage, MultiStorage, OverlayStorage, _copy_value
+from configfile.tracing import StartupTrace, NullTrace, startup_tracing_from_env
+from configfile.computed import ComputedParam, _DependencyRecorder, _NestedComputation
+from configfile.fingerprint import IncrementalFingerprint
+from configfile.compile import load_compiled_annotations
+from configfile.views import ConfigSubtree
+from configfile.cli import CliSpec, parse_cli
+from configfile.changelog import ChangeLog, change_source
+from configfile.provenance import Provenance, ProvenanceTracker, TRACKING_BUILD
+from configfile.yamlcache import load_yaml
+from configfile.typedarrays import ARRAY_TYPECODES, to_typed_array
 from configfile.utils import get_annotations_from_function, get_annotations_from_value, typeBuilder, flatDict, \
-    ParseJsonAction
+    ParseJsonAction, AnnotationTable
 from configfile.constants import ALLOWED_TYPES, PREFIX_ENV_SEP, NESTED_SEPARATOR
 
-import yaml
 from configfile.exceptions import ConfigErrorFromEnv, ConfigErrorParamNotDefined, ConfigErrorParamTypeMismatch
-from configfile.utils import AbstractSingleton
+from configfile.utils import AbstractSingleton, ISOLATED_BUILD
+
+if TYPE_CHECKING:
+    from configfile.daemon import ConfigServer
+
+_CURRENT_CONFIGS = contextvars.ContextVar("configfile_current_configs", default=MappingProxyType({}))
 
 
 class ConfigBase(metaclass=AbstractSingleton):
@@ -25,34 +46,207 @@ class ConfigBase(metaclass=AbstractSingleton):
     VALID_TYPES = ALLOWED_TYPES  # TODO: Enforce type checking
     NESTED_SEPARATOR = NESTED_SEPARATOR
     PREFIX_ENV_SEP = PREFIX_ENV_SEP
-    def __init__(self, name: str = None, config_file: Optional[str] = None):
-
+    TRACE_STARTUP = False
+    JSON_CODEC = None  # The JsonCodec, or its name, used to store the parameters. None for the default one
+    COMPILED_SCHEMA = None  # Module generated with `python -m configfile.compile` to avoid parsing set_parameters
+    TYPED_ARRAYS = False  # If True, List[int] and List[float] parameters are stored as array.array. See param_buffer
+    YAML_DISK_CACHE = False  # If True, parsed yaml files are also cached as pickles next to them. See load_yaml
+    COMPACT = False  # If True, annotations are kept in a shared AnnotationTable and the source is not cached
+    TRACK_PROVENANCE = False  # If True, the values set by each source (defaults, yaml, env...) are kept (also by the
+                              # nested configs built within set_parameters). See provenance
+    def __init__(self, name: str = None, config_file: Union[str, List[str], None] = None, isolated: bool = False):
+        """
+        :param name: The name of the config. Used to build the names of the environmental variables
+        :param config_file: A yaml file, or a list of them (later files win), to override the default parameters
+        :param isolated: If True, the parameters are kept in private in-memory storages (nested configs are copied,
+                         and the ones built within set_parameters are isolated and unregistered too) and the
+                         environmental variables are neither read nor written
+        """
         if name == None:
             name = type(self).__name__
+        isolated = isolated or ISOLATED_BUILD.get()
+        self._init_attributes(name, isolated)
+
+        tracing = self.TRACE_STARTUP or startup_tracing_from_env()
+        trace = StartupTrace(self.name) if tracing else NullTrace()
+        self._startup_trace = trace if tracing else None
+        with trace:
+            with trace.phase("copy_environ"):
+                env_vars = {} if isolated else os.environ.copy()
+
+            with trace.phase("build_storage"):
+                self._storage = self._build_storage(isolated)
+
+            with trace.phase("get_annotations"):
+                # self.config_classes_classPrefix = [(type(self), "")] #By default, the main Config has no prefix
+                self.config_classname_2_annotations_prefix = {self.name: (
+                self._get_set_parameters_annotations(), "")}  # By default, the main Config has no prefix
+
+            with trace.phase("set_parameters"):
+                self.initialize_params()
+            self._initialized = True
+            if self.TYPED_ARRAYS:
+                with trace.phase("typed_arrays"):
+                    self._set_typed_arrays()
+            self._attach_to_storage(trace)
+
+            if config_file is not None:
+                assert isolated or not self._yaml_files(None), "Error, config_file yaml was provided in the builder and as environmental variable"
+                with trace.phase("override_with_yaml"):
+                    self.override_with_yaml(config_file)
+            elif not isolated and (self.DEFAULT_YML_ENVVARNAME in os.environ or
+                                   self.DEFAULT_YML_LIST_ENVVARNAME in os.environ):
+                with trace.phase("override_with_yaml"):
+                    self.override_with_yaml(None)  # The files given in the env vars
+
+            if not isolated:
+                with trace.phase("override_with_env_vars"):
+                    self.override_with_env_vars(env_vars)
+
+    def _init_attributes(self, name, isolated):
+        """
+        Sets the attributes of a new instance that do not depend on its parameters. Shared by all the ways of building
+        an instance (see also daemon.build_client_config)
+        """
         self.name = name
         self.fullName = self.PROJECT_NAME + self.name
         self._private_vars = {}
+        self._isolated = isolated
+        self._computed = {}  # param_name -> function, for parameters declared with computed()
+        self._computed_cache = {}
+        self._computed_dependents = {}  # param_name -> names of the computed parameters that read it
+        self._fingerprint = None
+        self._provenance = None
+        self._startup_trace = None
+        self.env_var_prefix = param_to_env_name(self.fullName, self.PREFIX_ENV_SEP, "")
+        self._adding_params_flag = False  # A flag that switches from default setattr to store into _storage
 
-        env_vars = os.environ.copy()
-        self._storage = MultiStorage(name=self.name, fallbackStorageClassName="EnvVarsStorage",
-                                     fallbackStorageKwargs={"envNamePrefix":self.fullName}) # "EnvVarsStorage" is required to overwrite values from envvars
+    def _attach_to_storage(self, trace=NullTrace(), source="defaults"):
+        """
+        Installs the listeners of the storage and binds the parameters to it, once it holds all of them
 
-        # self.config_classes_classPrefix = [(type(self), "")] #By default, the main Config has no prefix
-        self.config_classname_2_annotations_prefix = {self.name: (
-        get_annotations_from_function(self.set_parameters), "")}  # By default, the main Config has no prefix
+        :param source: The source (see provenance) of the values that the storage already holds
+        """
+        if self._computed:
+            self._storage.add_listener(self._on_storage_change, weak=True)
+        nested_trackers = self.__dict__.pop("_nested_provenance", ())
+        if self.TRACK_PROVENANCE or TRACKING_BUILD.get():
+            with trace.phase("track_provenance"):
+                self._provenance = ProvenanceTracker().track(self._storage, source)
+                for prefix, tracker in nested_trackers:  # Nested configs know where their values come from
+                    self._provenance.merge(tracker, prefix)
+        with trace.phase("bind_descriptors"):
+            self._bind_param_descriptors()
 
-        self.env_var_prefix = param_to_env_name(self.fullName, self.PREFIX_ENV_SEP, "")
-        self._adding_params_flag = False  # A flag that switches from default setattr to store into _storage
-        self.initialize_params()
-        self._initialized = True
+    def _build_storage(self, isolated):
+        """
+        Returns the MultiStorage that will hold the parameters of the config
+        """
+        if isolated:
+            return MultiStorage(name=self.name, fallbackStorageClassName="DictStorage",
+                                fallbackStorageKwargs={"envNamePrefix": self.fullName, "codec": self.JSON_CODEC})
+        else:
+            return MultiStorage(name=self.name, fallbackStorageClassName="EnvVarsStorage",
+                                fallbackStorageKwargs={"envNamePrefix":self.fullName,
+                                                       "codec": self.JSON_CODEC}) # "EnvVarsStorage" is required to overwrite values from envvars
 
-        if config_file is not None:
-            assert self.DEFAULT_YML_ENVVARNAME not in os.environ, "Error, config_file yaml was provided in the builder and as environmental variable"
-            self.override_with_yaml(config_file)
-        elif self.DEFAULT_YML_ENVVARNAME in os.environ:
-            self.override_with_yaml(os.environ[self.DEFAULT_YML_ENVVARNAME])
+    def _nested_storage(self, config):
+        """
+        Returns the storage of the nested config to be added to the storage of this config
+        """
+        if self._isolated:
+            return config._storage.isolated_copy()
+        return config._storage
+
+    @property
+    def startup_trace(self) -> Optional[StartupTrace]:
+        """
+        The StartupTrace with the time spent in each phase of __init__, if tracing was enabled with the class
+        attribute TRACE_STARTUP or the environmental variable CONFIGFILE_TRACE_STARTUP. None otherwise
+        """
+        return self._startup_trace
+
+    @classmethod
+    def new_instance(cls, name: Optional[str] = None, config_file: Union[str, List[str], None] = None,
+                     **overrides) -> "ConfigBase":
+        """
+        Builds a new isolated instance of the config that is not registered as the singleton. Its parameters live
+        in private in-memory storages, so several instances can be used concurrently (e.g. one per thread) without
+        interfering with each other or with os.environ.
 
-        self.override_with_env_vars(env_vars)
+        :param name: The name of the config. Defaults to the class name
+        :param config_file: A yaml file, or a list of them (later files win), to override the default parameters
+        :param overrides: parameter values to be applied, as in update, after the yaml file
+        """
+        conf = cls._create_unregistered(name, config_file=config_file, isolated=True)
+        if overrides:
+            conf.update(overrides)
+        return conf
+
+    @classmethod
+    @contextlib.contextmanager
+    def scoped(cls, name: Optional[str] = None, config_file: Union[str, List[str], None] = None, **overrides):
+        """
+        Context manager that builds a new_instance and makes it the one returned by cls.current() within the
+        current context (thread or asyncio task).
+
+        with MyConfig.scoped(lr=0.1) as conf:
+            assert MyConfig.current() is conf
+        """
+        conf = cls.new_instance(name, config_file=config_file, **overrides)
+        current_configs = dict(_CURRENT_CONFIGS.get())
+        current_configs[cls] = conf
+        token = _CURRENT_CONFIGS.set(MappingProxyType(current_configs))
+        try:
+            yield conf
+        finally:
+            _CURRENT_CONFIGS.reset(token)
+
+    @classmethod
+    def current(cls) -> "ConfigBase":
+        """
+        Returns the instance of the innermost cls.scoped() block active in the current context, or the singleton
+        instance if there is none.
+        """
+        conf = _CURRENT_CONFIGS.get().get(cls)
+        if conf is None:
+            conf = cls()
+        return conf
+
+    @classmethod
+    def load_many(cls, yaml_paths: Optional[List[Optional[str]]] = None,
+                  overrides: Optional[List[Optional[Dict[str, Any]]]] = None,
+                  workers: Optional[int] = None, name: Optional[str] = None) -> List[MappingProxyType]:
+        """
+        Builds and validates many variants of the config in a process pool. Each variant is made of a yaml file
+        and/or a dictionary of overrides (both lists are matched by position). The variants are built as isolated
+        configs, so neither the process environment nor the singleton instance are modified.
+
+        :param yaml_paths: A list of yaml files (or None) to be loaded on top of the defaults
+        :param overrides: A list of dictionaries (or None) to be applied, as in update, after the yaml files
+        :param workers: Number of worker processes. Defaults to os.cpu_count(). If <=1, variants are built serially
+                        in the current process
+        :param name: The name of the config variants. Defaults to the class name
+        :return: A list of read-only mappings with all the parameters of each variant
+        """
+        if yaml_paths is None and overrides is None:
+            return []
+        if yaml_paths is None:
+            yaml_paths = [None] * len(overrides)
+        if overrides is None:
+            overrides = [None] * len(yaml_paths)
+        assert len(yaml_paths) == len(overrides), "Error, yaml_paths and overrides must have the same length"
+        if workers is None:
+            workers = os.cpu_count() or 1
+        n_variants = len(yaml_paths)
+        args = ([cls] * n_variants, [name] * n_variants, yaml_paths, overrides)
+        if workers <= 1 or n_variants <= 1:
+            results = map(_load_config_variant, *args)
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, n_variants)) as executor:
+                chunksize = max(1, n_variants // (4 * workers))
+                results = list(executor.map(_load_config_variant, *args, chunksize=chunksize))
+        return [MappingProxyType(params) for params in results]
 
     def _store_private(self, k, v):
         """
@@ -65,63 +259,503 @@ class ConfigBase(metaclass=AbstractSingleton):
 
     @property
     def all_parameters_dict(self):
-        return dict(self._storage.items())
+        params = dict(self._storage.items())
+        for key in self._computed:
+            params[key] = self._get_computed(key)
+        return params
 
     @property
     def DEFAULT_YML_ENVVARNAME(self):
         return self.fullName + "_conf.yaml"
 
+    @property
+    def DEFAULT_YML_LIST_ENVVARNAME(self):
+        """
+        Env var with a json list of yaml files, applied in order after the one in DEFAULT_YML_ENVVARNAME, if any
+        """
+        return self.fullName + "_conf.yamls"
+
     def param_to_env_name(self, k):
         return param_to_env_name(self.fullName, self.PREFIX_ENV_SEP, k)
 
     def initialize_params(self):
-        with multiprocessing.Lock():
-            self._adding_params_flag = True
-            self.set_parameters()
-            self._adding_params_flag = False
+        token = ISOLATED_BUILD.set(True) if self._isolated else None
+        trackingToken = TRACKING_BUILD.set(True) if self.TRACK_PROVENANCE else None
+        try:
+            with multiprocessing.Lock(), change_source("defaults"):
+                self._adding_params_flag = True
+                self.set_parameters()
+                self._adding_params_flag = False
+        finally:
+            if trackingToken is not None:
+                TRACKING_BUILD.reset(trackingToken)
+            if token is not None:
+                ISOLATED_BUILD.reset(token)
 
     def override_with_yaml(self, config_file):
-        with open(config_file, "r") as f:
-            yaml_data = yaml.safe_load(f)
-        for attrdict in yaml_data.values():
-            # key = list(attrdict.keys())[0]
-            # val = list(attrdict.values())[0]
-            for key, val in attrdict.items():
-                if key not in self._storage.keys():
-                    raise ConfigErrorParamNotDefined(f"Error, {key} parameter from yaml file {config_file} has not been "
-                                                     f"previously defined in set_parameters")
+        """
+        Sections (or nested mappings) named as a nested config are applied to it, with keys relative to it, so both
+
+            model:                                  parameters:
+              lr: 0.1                                 model__lr: 0.1
+              encoder:                                model__encoder__depth: 2
+                depth: 2
+
+        are equivalent. Mappings whose key is a dict-valued parameter are kept as its value.
+
+        :param config_file: A yaml file, or a list of them applied in order (later files win). All the files are
+                            validated before any parameter is modified
+        """
+        routed = self._route_yaml_params(config_file)
+        if routed:
+            with change_source("yaml"):
+                self._put_routed(routed)
+
+    def _put_routed(self, routed):
+        if not isinstance(self._storage, MultiStorage):  # e.g. derived configs, whose writes go to the overlay
+            self._storage.put_many({key: val for key, (_, _, val) in routed.items()})
+            return
+        storage_2_items = {}
+        for storage, storageKey, val in routed.values():
+            storage_2_items.setdefault(id(storage), (storage, {}))[1][storageKey] = val
+        for storage, storageItems in storage_2_items.values():  # A single bulk write per nested storage
+            storage.put_many(storageItems)
+
+    def _yaml_files(self, config_file):
+        if config_file is None:
+            if self._isolated:
+                return []
+            paths = [os.environ[self.DEFAULT_YML_ENVVARNAME]] if self.DEFAULT_YML_ENVVARNAME in os.environ else []
+            if self.DEFAULT_YML_LIST_ENVVARNAME in os.environ:
+                try:
+                    paths_list = json.loads(os.environ[self.DEFAULT_YML_LIST_ENVVARNAME])
+                except ValueError:
+                    paths_list = None
+                if not isinstance(paths_list, list) or not all(isinstance(path, str) for path in paths_list):
+                    raise ConfigErrorFromEnv(f"Error, {self.DEFAULT_YML_LIST_ENVVARNAME} must be a json list of "
+                                             f"paths, provided {os.environ[self.DEFAULT_YML_LIST_ENVVARNAME]}")
+                paths += paths_list
+            return paths
+        if isinstance(config_file, (str, os.PathLike)):
+            return [config_file]
+        return list(config_file)
+
+    def _read_yaml_params(self, config_file):
+        return {key: val for key, (_, _, val) in self._route_yaml_params(config_file).items()}
+
+    def _route_yaml_params(self, config_file):
+        """
+        Returns {param_name: (simple_storage, storage_key, value)} with the parameters of the yaml files
+        """
+        root = self._storage
+        while isinstance(root, OverlayStorage):
+            root = root.baseStorage
+        routed = {}
+        for path in self._yaml_files(config_file):
+            yaml_data = load_yaml(path, disk_cache=self.YAML_DISK_CACHE)
+            for section, attrdict in (yaml_data or {}).items():
+                if section in root.storages and isinstance(attrdict, dict):
+                    section_routed = {}
+                    try:
+                        self._route_yaml_mapping(root, "", {section: attrdict}, path, section_routed)
+                        routed.update(section_routed)
+                        continue
+                    except ConfigErrorParamNotDefined:  # A section that just happens to share the name
+                        pass
+                self._route_yaml_mapping(root, "", attrdict, path, routed)
+        return routed
+
+    def _route_yaml_mapping(self, storage, prefix, mapping, path, routed):
+        for key, val in mapping.items():
+            target = self._route_yaml_key(storage, prefix, key)
+            if target is not None:
                 # TODO: Do type checking
-                # _type = get_annotations_from_value(val)
-                # if _type != self.attr_2_type[key]:
-                #     raise ConfigErrorParamTypeMismatch(f"Error, {key} parameter from yaml file {config_file} has "
-                #                                        f"incompatible type with respect what was defined in "
-                #                                        f"set_parameters, {type(val), self.attr_2_type[key]}")
-                self._storage.put(key, val)
+                routed[prefix + key] = target + (val,)
+            elif isinstance(val, dict) and isinstance(storage, MultiStorage) and key in storage.storages:
+                self._route_yaml_mapping(storage.storages[key], prefix + key + self.NESTED_SEPARATOR, val, path,
+                                         routed)
+            else:
+                raise ConfigErrorParamNotDefined(f"Error, {prefix + key} parameter from yaml file {path} has not been "
+                                                 f"previously defined in set_parameters")
+
+    def _route_yaml_key(self, storage, prefix, key):
+        if prefix + key in self._computed:  # Not in the storages until a value is assigned
+            return storage.route(key) if isinstance(storage, MultiStorage) else (storage, key)
+        if not isinstance(storage, MultiStorage):
+            return (storage, key) if key in storage else None
+        try:
+            storage, storageKey = storage.route(key)
+        except KeyError:
+            return None
+        return (storage, storageKey) if storageKey in storage else None
 
     def override_with_env_vars(self, env_vars=None):
+        params = self._read_env_vars_params(env_vars)
+        if params:
+            with change_source("env"):
+                self._storage.put_many(params)
+
+    def _read_env_vars_params(self, env_vars=None):
         if env_vars is None:
             env_vars = os.environ.copy()
+        varnames, raw_values = [], []
         for k, v in env_vars.items():
             if k.startswith(self.env_var_prefix):
                 varname = env_to_param_name(k, self.PREFIX_ENV_SEP)
-                if varname not in self._storage.keys():
+                if not self._is_parameter(varname):
                     raise ConfigErrorParamNotDefined(
                         f"Error, {k} variable, found as environmental variable has not been previously defined")
-                # TODO: check type
-                v = load_envvar_to_param(v)
-                self._storage.put(varname, v)
+                varnames.append(varname)
+                raw_values.append(v)
+        # TODO: check type
+        try:
+            values = load_envvars_to_params(raw_values, self.JSON_CODEC)  # All the values are decoded at once
+        except ValueError as e:
+            raise ConfigErrorFromEnv(f"Error, invalid value in the environmental variables of {self.name}: {e}") from e
+        return dict(zip(varnames, values))
+
+    async def aload(self, config_file: Union[str, List[str], None] = None, env_vars: Optional[Dict[str, str]] = None):
+        """
+        Async version of override_with_yaml followed by override_with_env_vars. Reading and parsing the sources
+        runs in a worker thread and the values are written with the async storage protocol, so storages that do
+        I/O (e.g. RemoteKVStorage) do not block the event loop.
+
+        :param config_file: A yaml file, or a list of them (later files win), to override the parameters. None to
+                            skip it
+        :param env_vars: The environmental variables to apply. By default, os.environ, unless the config is isolated
+        """
+        import asyncio  # Not imported with the module, most configs never use the async API
+        if config_file is not None:
+            params = await asyncio.to_thread(self._read_yaml_params, config_file)
+            with change_source("yaml"):
+                await self._storage.aput_many(params)
+        if env_vars is not None or not self._isolated:
+            params = await asyncio.to_thread(self._read_env_vars_params, env_vars)
+            if params:
+                with change_source("env"):
+                    await self._storage.aput_many(params)
+        return self
+
+    async def aget(self, key):
+        """
+        Async version of conf[key]
+        """
+        if key in self._computed:
+            return self._get_computed(key)
+        try:
+            return await self._storage.aget(key)
+        except KeyError:
+            raise ConfigErrorParamNotDefined(f"Error, argument {key} was not defined as a valid parameter")
+
+    async def aall_parameters_dict(self):
+        """
+        Async version of all_parameters_dict, that reads the storages of the nested configs concurrently
+        """
+        params = dict(await self._storage.aitems())
+        for key in self._computed:
+            params[key] = self._get_computed(key)
+        return params
+
+    def _parameter_keys(self):
+        return set(self._storage.keys()).union(self._computed)
+
+    def _is_parameter(self, key):
+        """
+        key in self._parameter_keys(), without listing all the keys
+        """
+        return key in self._computed or key in self._storage
+
+    def _get_computed(self, key):
+        try:
+            return _copy_value(self._computed_cache[key])
+        except KeyError:
+            pass
+        dependencies = set()
+        value = self._computed[key](_DependencyRecorder(self, dependencies))
+        for dependency in dependencies:
+            self._computed_dependents.setdefault(dependency, set()).add(key)
+        self._computed_cache[key] = value
+        return _copy_value(value)
+
+    def _invalidate_computed(self, key):
+        for dependent in self._computed_dependents.pop(key, ()):
+            self._computed_cache.pop(dependent, None)
+            self._invalidate_computed(dependent)
+
+    def _on_storage_change(self, event, key, value):
+        if key in self._computed:  # A value was explicitly assigned to a computed parameter
+            del self._computed[key]
+            self._computed_cache.pop(key, None)
+        self._invalidate_computed(key)
 
     def update(self, params_dict: Dict[str, Any]):
-        for key, val in params_dict.items():
-            if key in self._storage.keys():
-                self._storage.put(key, val)
-            else:
+        for key in params_dict:
+            if not self._is_parameter(key):
                 raise ConfigErrorParamTypeMismatch(
                     f"Error, {key} parameter in the dictionary {params_dict} is not difined in the default parameters")
+        self._storage.put_many(params_dict)
+
+    def diff(self, other) -> Dict[str, Any]:
+        """
+        Computes which parameters would change if the values of other were applied to this config.
+
+        :param other: Another config, or a dictionary of parameters. Nested dictionaries are flattened using
+                      NESTED_SEPARATOR, unless their key is a (dict-valued) parameter
+        :return: A dictionary {param_name: new_value} with only the parameters whose value differs. It can be
+                 applied with apply_diff
+        """
+        if isinstance(other, ConfigBase):
+            other = other.all_parameters_dict
+        param_keys = self._parameter_keys()
+        other = flatDict(other, sep=self.NESTED_SEPARATOR, leaf_keys=param_keys)
+        changes = {}
+        for key, val in other.items():
+            if key not in param_keys:
+                raise ConfigErrorParamNotDefined(f"Error, {key} parameter has not been previously defined in "
+                                                 f"set_parameters")
+            current, newVal = self._get_from_storages(key), val
+            if isinstance(current, array.array):  # Typed lists are compared as the lists they are set from
+                current = current.tolist()
+                if isinstance(newVal, array.array):
+                    newVal = newVal.tolist()
+            if current != newVal or type(current) != type(newVal):
+                changes[key] = val
+        return changes
+
+    def apply_diff(self, diff: Dict[str, Any]):
+        """
+        Writes the changes computed by diff, using a single batched write per storage
+        """
+        for key in diff:
+            if not self._is_parameter(key):
+                raise ConfigErrorParamNotDefined(f"Error, {key} parameter has not been previously defined in "
+                                                 f"set_parameters")
+        if diff:
+            self._storage.put_many(diff)
+
+    def derive(self, **overrides) -> "ConfigBase":
+        """
+        Returns a variant of this config in which only the provided parameters are changed. The variant is backed by
+        an OverlayStorage that layers its overrides over the storage of this config without copying it: reads of
+        the other parameters fall through to this config (and so they see its later changes), while writes to the
+        variant are kept in the overlay and never reach this config nor os.environ.
+        set_parameters is not executed again.
+        """
+        for key in overrides:
+            if not self._is_parameter(key):
+                raise ConfigErrorParamNotDefined(f"Error, {key} parameter has not been previously defined in "
+                                                 f"set_parameters")
+        derived = type(self).__new__(type(self))
+        derived.__dict__.update(self.__dict__)
+        # Its parameters are not bound to the storages of this config, so they are read through the overlay
+        derived.__dict__.update(_storage=OverlayStorage(self.name, self._storage, overrides), _param_routes={},
+                                _isolated=True, _startup_trace=None, _fingerprint=None)
+        if self._computed:  # Overridden computed parameters take the given value
+            derived.__dict__.update(_computed={k: v for k, v in self._computed.items() if k not in overrides},
+                                    _computed_cache={}, _computed_dependents={})
+            derived._storage.add_listener(derived._on_storage_change, weak=True)
+        return derived
+
+    def provenance(self, key) -> Provenance:
+        """
+        Returns where the value of a parameter comes from (requires TRACK_PROVENANCE). E.g.
+        Provenance(source="env", value=4, layers={"defaults": 1, "yaml": 2, "env": 4}) for a parameter set by
+        set_parameters, then by a yaml file and then by an environmental variable. Sources are named after the
+        ConfigBase method that set the value ("defaults", "yaml", "env", "cli" or "update"), or as given with
+        changelog.change_source. Overrides of derived configs come from "derive", and computed parameters from
+        "computed"
+        """
+        tracker = self._get_provenance_tracker()
+        if self._is_derive_override(key):
+            value = self._storage.get(key)
+            layers = tracker.provenance(key).layers if key in tracker else {}
+            layers["derive"] = value
+            return Provenance("derive", value, layers)
+        if key in tracker:
+            return tracker.provenance(key)
+        if key in self._computed:
+            value = self._get_computed(key)
+            return Provenance("computed", value, {"computed": value})
+        raise ConfigErrorParamNotDefined(f"Error, argument {key} was not defined as a valid parameter")
+
+    def without_layer(self, source: str) -> "ConfigBase":
+        """
+        Returns a variant of this config (see derive) in which the parameters whose current value was set by source
+        (e.g. "env") take the value that they had before it (requires TRACK_PROVENANCE). Parameters only set by
+        source keep their value
+        """
+        previous = self._get_provenance_tracker().without_layer(source)
+        return self.derive(**{k: v for k, v in previous.items() if not self._is_derive_override(k)})
+
+    def _get_provenance_tracker(self):
+        tracker = self.__dict__.get("_provenance")
+        if tracker is None:
+            raise ConfigErrorParamNotDefined(f"Error, the provenance of the parameters of {self.name} is not "
+                                             f"tracked. Set TRACK_PROVENANCE = True in its class")
+        return tracker
+
+    def _is_derive_override(self, key):
+        storage = self._storage
+        while isinstance(storage, OverlayStorage):
+            if storage.is_overridden(key):
+                return True
+            storage = storage.baseStorage
+        return False
+
+    def _set_typed_arrays(self):
+        """
+        Makes the storages of the List[int] and List[float] parameters of this config (nested configs decide by
+        themselves) convert them to array.array whenever they are set, and converts their default values
+        """
+        annotations = self.config_classname_2_annotations_prefix[self.name][0] or {}
+        for key, annotation in annotations.items():
+            if annotation is None or not annotation["isList"] or annotation["dtype"] not in ARRAY_TYPECODES:
+                continue
+            if key in self._computed or key not in self._storage:
+                continue
+            storage, storageKey = self._storage.route(key)
+            storage.set_coercer(storageKey, partial(to_typed_array, typecode=ARRAY_TYPECODES[annotation["dtype"]]))
+            storage.put(storageKey, storage.get(storageKey))
+
+    def param_buffer(self, key) -> memoryview:
+        """
+        Returns a read-only memoryview over the array.array of a typed list parameter (see TYPED_ARRAYS), without
+        copying it. E.g. numpy.frombuffer(conf.param_buffer("weights")). Setting the parameter stores a new array,
+        so the memoryview keeps showing the values of the array it was taken from.
+        """
+        try:
+            storage, storageKey = self._storage.route(key)
+            value = storage.peek(storageKey)
+        except KeyError:
+            raise ConfigErrorParamNotDefined(f"Error, argument {key} was not defined as a valid parameter")
+        if not isinstance(value, array.array):
+            raise ConfigErrorParamTypeMismatch(f"Error, {key} is not a typed array parameter. Declare it as List[int] "
+                                               f"or List[float] in a config with TYPED_ARRAYS = True")
+        return memoryview(value).toreadonly()
+
+    def serve(self, path: str, background: bool = True) -> "ConfigServer":
+        """
+        Serves this config over the Unix domain socket path, so that other processes on the host can build it with
+        from_daemon instead of resolving it themselves. Changes done to this config, or by any client, are pushed to
+        all the clients.
+
+        :param background: If True, the requests are served from a daemon thread. Otherwise, this call blocks
+        :return: The ConfigServer. Call its close method to stop serving
+        """
+        from configfile.daemon import ConfigServer  # Not imported with the module, it loads the socket stack
+        server = ConfigServer(self, path)
+        if background:
+            return server.start()
+        try:
+            server.serve_forever()
+        finally:
+            server.close()
+        return server
+
+    @classmethod
+    def from_daemon(cls, path: str) -> "ConfigBase":
+        """
+        Builds a new (non singleton) instance of the config from the one served at the Unix domain socket path (see
+        serve), in a single round trip. set_parameters is not executed and neither yaml files nor environmental
+        variables are read. The parameters are kept in memory and updated when they change in the daemon, while
+        writes are sent to the daemon. Computed parameters are received as plain values.
+        """
+        from configfile.daemon import build_client_config
+        return build_client_config(cls, path)
+
+    def subtree(self, namespace) -> ConfigSubtree:
+        """
+        Returns a live mapping over the parameters of a nested config, with keys relative to it, that reads and
+        writes the storage of the nested config directly. E.g. conf.subtree("model")["lr"] is conf.model__lr, and
+        conf.subtree("model").update({"lr": 0.1}) only touches the parameters of the "model" namespace.
+
+        :param namespace: A nested config, or its name. Deeper namespaces are joined with NESTED_SEPARATOR
+                          (e.g. "model__encoder")
+        """
+        if isinstance(namespace, ConfigBase):
+            namespace = namespace.name
+        return ConfigSubtree(self, namespace)
+
+    def fingerprint(self, prefix=None) -> str:
+        """
+        Returns a hash of the current values of the parameters, that can be used as key of caches of artifacts
+        that depend on the config. It is computed over the whole storage on the first call, and then updated
+        incrementally on every change, so it is cheap to call often. Computed parameters are not included unless
+        a value was assigned to them, since they only depend on the other parameters.
+
+        :param prefix: A nested config, or its name, to compute the fingerprint only over its parameters. The
+                       result is the same as calling fingerprint() on the nested config itself
+        """
+        if self._fingerprint is None:
+            self._fingerprint = IncrementalFingerprint(self._storage, sep=self.NESTED_SEPARATOR)
+        if isinstance(prefix, ConfigBase):
+            prefix = prefix.name
+        return self._fingerprint.fingerprint(prefix or "")
+
+    def _namespace_storages(self):
+        """
+        Returns the list of (namespace, simple_storage) of this config ("" namespace) and of its nested configs,
+        and the list of OverlayStorages (outermost first) that wrap them, if any
+        """
+        storage, overlays = self._storage, []
+        while isinstance(storage, OverlayStorage):
+            overlays.append(storage)
+            storage = storage.baseStorage
+        namespace_storages = [(prefix[:-len(self.NESTED_SEPARATOR)], leaf)
+                              for prefix, leaf in storage._iter_prefix_storage()]
+        return namespace_storages, overlays
+
+    def subprocess_env(self, include: Optional[List[str]] = None, exclude: Optional[List[str]] = None,
+                       base: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        """
+        Builds the environment for a subprocess that only carries the parameters of the requested namespaces, so
+        that launching the subprocess and building its configs is cheaper.
+
+        :param include: The namespaces to include: "" for the parameters of this config or the name of a nested
+                        config (e.g. "model" or "model__encoder", that includes its own nested configs). None for all
+        :param exclude: The namespaces to exclude. It takes precedence over include
+        :param base: The environment to which the selected parameters are added. Defaults to os.environ without
+                     the variables (parameters and yaml files) of this config and its nested configs
+        :return: A dictionary to be used as env argument of subprocess.Popen and friends
+        """
+        def in_namespaces(namespace, namespaces):
+            return any(namespace == n or (n and namespace.startswith(n + self.NESTED_SEPARATOR))
+                       for n in namespaces)
+
+        selected = {}
+        env_prefixes = []
+        namespace_storages, overlays = self._namespace_storages()
+        for namespace, leaf in namespace_storages:
+            env_prefix = param_to_env_name(leaf.envNamePrefix, leaf.prefix_sep, "")
+            env_prefixes.append(env_prefix)
+            if (include is not None and not in_namespaces(namespace, include)) or \
+                    (exclude is not None and in_namespaces(namespace, exclude)):
+                continue
+            for k in leaf.keys():
+                if isinstance(leaf, EnvVarsStorage):  # Raw values are copied without decoding them
+                    selected[env_prefix + k] = os.environ[env_prefix + k]
+                else:
+                    selected[env_prefix + k] = serialize_param_to_envvar(leaf.get(k), leaf.codec)
+        for overlay in reversed(overlays):
+            for k, v in overlay.overrides.items():
+                leaf, storageKey = overlay.baseStorage.route(k)
+                while isinstance(leaf, OverlayStorage):
+                    leaf, storageKey = leaf.baseStorage.route(storageKey)
+                env_name = param_to_env_name(leaf.envNamePrefix, leaf.prefix_sep, storageKey)
+                if env_name in selected:
+                    selected[env_name] = serialize_param_to_envvar(v, leaf.codec)
+
+        if base is None:
+            yaml_envvars = {prefix[:-len(self.PREFIX_ENV_SEP)] + suffix for prefix in env_prefixes
+                            for suffix in ("_conf.yaml", "_conf.yamls")}
+            env_prefixes = tuple(env_prefixes)
+            base = {k: v for k, v in os.environ.items() if not k.startswith(env_prefixes) and k not in yaml_envvars}
+        env = dict(base)
+        env.update(selected)
+        return env
 
     def add_args_to_argparse(self, parser, include_only=None):
 
-        annotations = self._get_annotations_from_function()
         # all_params = flatDict(self.all_parameters_dict, sep=self.NESTED_SEPARATOR)
         all_params = self.all_parameters_dict
         if include_only is None:
@@ -129,18 +763,22 @@ class ConfigBase(metaclass=AbstractSingleton):
         for k, v in all_params.items():
             if k not in include_only:
                 continue
+            # Computed params are only included in the namespace if provided, so that update(vars(args)) does not
+            # replace their computation by their current value
+            default = argparse.SUPPRESS if k in self._computed else v
+            annotation = self._get_annotation(k, _NO_ANNOTATION)
             if v is None:
-                assert k in annotations, f"Error, argument {k} is None, but has no type hint in config"
-                _type = annotations[k]["dtype"]
+                assert annotation is not _NO_ANNOTATION, f"Error, argument {k} is None, but has no type hint in config"
+                _type = annotation["dtype"]
                 type_name = _type.__name__
-                if annotations[k]["isDict"]:
+                if annotation["isDict"]:
                     parser.add_argument("--" + k, help="A dictionary to be provided as json string",
-                                        action=ParseJsonAction)
+                                        action=ParseJsonAction, default=default)
                     continue
-                assert not annotations[k]["isDict"], "Not implemented yet"
-                nargs = "+" if annotations[k]["isList"] else None
+                assert not annotation["isDict"], "Not implemented yet"
+                nargs = "+" if annotation["isList"] else None
 
-            elif isinstance(v, (list, tuple)):
+            elif isinstance(v, (list, tuple, array.array)):
                 nargs = "+"
                 types = [type(x) for x in v]
                 types_names = set()
@@ -153,7 +791,7 @@ class ConfigBase(metaclass=AbstractSingleton):
 
             elif isinstance(v, (dict)):  # We are using flatten instead of json option
                 parser.add_argument("--" + k, help=f"A dictionary to be provided as json string. Default: {v}",
-                                    action=ParseJsonAction, default=v)
+                                    action=ParseJsonAction, default=default)
                 continue
             else:
                 nargs = None
@@ -161,14 +799,13 @@ class ConfigBase(metaclass=AbstractSingleton):
                 assert _type in ALLOWED_TYPES, f"Error, only _type {ALLOWED_TYPES} are allowed. Got {k, v, _type}"
                 type_name = _type.__name__
 
-            if k in annotations:
-                an_type = annotations[k]
-                if an_type is None:
+            if annotation is not _NO_ANNOTATION:
+                if annotation is None:
                     warnings.warn(
                         f"Type annotation is not present for {k}. We cannot know if new value is compatible")
                 else:
-                    assert _type == annotations[k]["dtype"], f"Error, mismatch between type hint and set value " \
-                                                         f"{k, _type, annotations[k]['dtype']}"
+                    assert _type == annotation["dtype"], f"Error, mismatch between type hint and set value " \
+                                                         f"{k, _type, annotation['dtype']}"
 
             help = f" {type_name}. Default={v}"
             if _type == bool:
@@ -180,20 +817,90 @@ class ConfigBase(metaclass=AbstractSingleton):
                     action = "store_true"
                     varname = k
                 help += " Action: " + action + " for variable %s" % k
-                parser.add_argument("--" + varname, help=help, action=action, dest=k)
+                parser.add_argument("--" + varname, help=help, action=action, dest=k,
+                                    **({"default": default} if k in self._computed else {}))
             else:
-                parser.add_argument(f"--{k}", type=_type, default=v, nargs=nargs, help=help)
+                parser.add_argument(f"--{k}", type=_type, default=default, nargs=nargs, help=help)
         return parser
 
+    def record_changes(self, path, **kwargs) -> ChangeLog:
+        """
+        Starts logging the current values of the parameters, and then every change, to the append-only log file at
+        path, tagged with their source ("yaml", "env", "cli", "update"... see changelog.change_source). The state at
+        any time can be rebuilt with changelog.replay. Computed parameters are not logged.
+
+        :param kwargs: Options of the ChangeLog, e.g. flush_interval, fsync or compact_every
+        :return: The ChangeLog. Close it to stop logging
+        """
+        return ChangeLog(path, codec=self.JSON_CODEC, **kwargs).attach(self._storage)
+
+    def parse_cli(self, argv: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Lightweight alternative to add_args_to_argparse + parser.parse_args + update, for configs with many
+        parameters. argv is scanned once, and only the given flags are resolved and type converted. The flags are
+        the same as the ones of add_args_to_argparse (--NOT_param for bools that are True by default, json strings
+        for dictionaries). The help is only built if -h/--help is given.
+
+        :param argv: The command line arguments. By default, sys.argv[1:]
+        :return: A dictionary {param_name: value} with the parameters given in argv, that have been applied
+        """
+        if argv is None:
+            argv = sys.argv[1:]
+        params = parse_cli(self, self._get_cli_spec(), argv)
+        if params:
+            with change_source("cli"):
+                self._storage.put_many(params)
+        return params
+
+    def cli_help(self) -> str:
+        """
+        Returns the help of the flags accepted by parse_cli
+        """
+        return self._get_cli_spec().help(self)
+
+    @classmethod
+    def _get_cli_spec(cls):
+        spec = cls.__dict__.get("_cli_spec")  # Not inherited, subclasses have their own parameters
+        if spec is None:
+            spec = cls._cli_spec = CliSpec()
+        return spec
+
     def _add_params_from_other_config(self, config):
         assert isinstance(config, ConfigBase), "Error, config is not of class ConfigBase"
         assert inspect.stack()[1].function == "set_parameters"
         # self.config_classes_classPrefix.append((type(config), config.name+self.NESTED_SEPARATOR) )
-        self.config_classname_2_annotations_prefix[config.name] = (get_annotations_from_function(config.set_parameters),
-                                                                   config.name + self.NESTED_SEPARATOR)
-        self._storage.addStorage(config._storage)
+        self.config_classname_2_annotations_prefix[config.name] = (
+            config.config_classname_2_annotations_prefix[config.name][0], config.name + self.NESTED_SEPARATOR)
+        self._storage.addStorage(self._nested_storage(config))
+        prefix = config.name + self.NESTED_SEPARATOR
+        for key, func in config._computed.items():  # Computed by this config, reading the nested parameters
+            self._computed[prefix + key] = _NestedComputation(func, prefix)
+        if config.__dict__.get("_provenance") is not None:  # Merged into the tracker of this config once it is built
+            self.__dict__.setdefault("_nested_provenance", []).append(
+                (config.name + self.NESTED_SEPARATOR, config._provenance))
         return dict(config.all_parameters_dict.copy())
 
+    @classmethod
+    def _get_set_parameters_annotations(cls):
+        if cls.COMPILED_SCHEMA is not None:
+            annotations = load_compiled_annotations(cls.COMPILED_SCHEMA, cls.set_parameters)
+            if annotations is not None:
+                return AnnotationTable(annotations) if cls.COMPACT else annotations
+        return get_annotations_from_function(cls.set_parameters, compact=cls.COMPACT)
+
+    def _get_annotation(self, key, default=None):
+        """
+        The annotation of key in _get_annotations_from_function(), without building the whole dictionary (nor the
+        dictionaries of the other parameters, if they are kept in an AnnotationTable)
+
+        :param default: Returned if key is not in the annotations. Parameters without type hint have None
+        """
+        annotation = default
+        for _annot, prefix in self.config_classname_2_annotations_prefix.values():
+            if _annot and key.startswith(prefix):
+                annotation = _annot.get(key[len(prefix):], annotation)
+        return annotation
+
     def _get_annotations_from_function(self):
         annotated_types = {}
         # for cls in self.__class__.mro():
@@ -212,20 +919,51 @@ class ConfigBase(metaclass=AbstractSingleton):
         """
         return NotImplementedError
 
+    def _bind_param_descriptors(self):
+        """
+        Binds each parameter to the simple storage that holds it (in _param_routes), so that reading and writing
+        parameters skip __getattr__ and the key routing. The _ParamDescriptors are installed in the class, once per
+        parameter name, and are shared by all its instances.
+        """
+        cls = type(self)
+        routes = {}
+        for key in self._storage.keys():
+            if key in self.__dict__:
+                continue
+            descriptor = getattr(cls, key, None)
+            if not isinstance(descriptor, _ParamDescriptor):
+                if descriptor is not None or hasattr(cls, key):  # Parameters never shadow methods or attributes
+                    continue
+                setattr(cls, key, _ParamDescriptor(key))
+            routes[key] = self._storage.route(key)
+        self.__dict__["_param_routes"] = routes
+
+    def __reduce_ex__(self, protocol):
+        # The storages are bound again when unpickling, see _unpickle_config
+        state = {k: v for k, v in self.__dict__.items() if k != "_param_routes"}
+        return _unpickle_config, (type(self), state)
+
     def __setattr__(self, key, value):
 
-        if hasattr(self, "_adding_params_flag") and self._adding_params_flag:
+        route = self.__dict__.get("_param_routes", _NO_ROUTES).get(key)
+        if route is not None:
+            route[0].put(route[1], value)
+        elif hasattr(self, "_adding_params_flag") and self._adding_params_flag:
             if key == "_adding_params_flag":
                 super().__setattr__(key, value)
+            elif isinstance(value, ComputedParam):
+                self._computed[key] = value.func
             else:
                 self._storage.put(key, value)
         else:
-            if hasattr(self, "_storage") and key in self._storage.keys():
+            if hasattr(self, "_storage") and (key in self._storage or key in self._computed):
                 self._storage.put(key, value)
             else:
                 super().__setattr__(key, value)
 
     def _get_from_storages(self, key):
+        if key in self._computed:
+            return self._get_computed(key)
         try:  # This works because keys in storage are never stored as part of the __dict__
             return self._storage.get(key)
         except KeyError:
@@ -252,3 +990,59 @@ class ConfigBase(metaclass=AbstractSingleton):
         if "_initialized" in self.__dict__ and self._initialized:
             return str(self.all_parameters_dict)
         return super().__str__()
+
+
+_NO_ROUTES = MappingProxyType({})
+_NO_ANNOTATION = object()
+
+
+class _ParamDescriptor():
+    """
+    Data descriptor that reads and writes a parameter directly from the simple storage that holds it in each instance
+    (see ConfigBase._bind_param_descriptors). Instances in which the parameter is not bound (e.g. derived configs,
+    or instances whose nested configs have other names) fall back to the regular attribute lookup
+    """
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        try:
+            storage, storageKey = instance.__dict__["_param_routes"][self.key]
+        except KeyError:
+            try:
+                return instance.__dict__[self.key]
+            except KeyError:
+                return instance.__getattr__(self.key)
+        try:
+            return storage.get(storageKey)
+        except KeyError:
+            raise ConfigErrorParamNotDefined(f"Error, argument {self.key} is no longer available in its storage")
+
+    def __set__(self, instance, value):
+        route = instance.__dict__.get("_param_routes", _NO_ROUTES).get(self.key)
+        if route is None:
+            instance.__dict__[self.key] = value
+        else:
+            route[0].put(route[1], value)
+
+
+def _unpickle_config(cls, state):
+    conf = cls.__new__(cls)
+    conf.__dict__.update(state)
+    conf.__dict__["_fingerprint"] = None  # It would no longer be notified of the changes
+    if state.get("_initialized"):
+        conf._bind_param_descriptors()
+        if conf._computed:
+            conf._storage.add_listener(conf._on_storage_change, weak=True)
+        if state.get("_provenance") is not None:
+            state["_provenance"].listen(conf._storage)
+    return conf
+
+
+def _load_config_variant(cls, name, config_file, overrides):
+    conf = cls.new_instance(name, config_file=config_file, **(overrides or {}))
+    return conf.all_parameters_dict
@@ -1,60 +1,53 @@
-# configfile
-import collections
-import inspect
-import json
-import multiprocessing
-import os
-from abc import abstractmethod
-from typing import Optional, Dict, Any, List
-
-from configfile.envVarUtils import param_to_env_name, env_to_param_name, serialize_param_to_envvar, \
-    load_envvar_to_param, load_envvar
-from configfile.storages import EnvVarsStorage, MultiStorage
-from configfile.utils import get_annotations_from_function, get_annotations_from_value, typeBuilder, flatDict, \
-    ParseJsonAction
-from configfile.constants import ALLOWED_TYPES, ALLOWED_TYPE_NAMES, PREFIX_ENV_SEP, NESTED_SEPARATOR
-
-import yaml
-from configfile.exceptions import ConfigErrorFromEnv, ConfigErrorParamNotDefined, ConfigErrorParamTypeMismatch
-from configfile.utils import AbstractSingleton
-
-
-class ConfigBaseDict(metaclass=AbstractSingleton):
-    PROJECT_NAME = ""
-    VALID_TYPES = ALLOWED_TYPES  # TODO: Enforce type checking
-
-    def __init__(self, name: str = None, config_file: Optional[str] = None):
-
-        if name == None:
-            name = type(self).__name__
-        self._name = name
-        self._config_vars = {} #TODO: Replace it by sqlitedict or any other dict-like storage
-
-
-    def __setattr__(self, key, value):
-        if key.startswith("_"):
-            super().__setattr__(key, value)
-        else:
-            #TODO: FLATTEN AND UNFLATTEN KEYS
-            self._config_vars[key] = value
-
-    def __getattr__(self, key):
-        if key.startswith("_"):
-            return self.__dict__[key]
-        else:
-            #TODO: FLATTEN AND UNFLATTEN KEYS
-            try:
-                val = self._config_vars[key]
-                return val
-            except KeyError:
-                raise AttributeError(f"Error, config object does not contain config paramenter {key}")
+from configfile.configbase import ConfigBase
+from configfile.storages import DictTreeStorage
+
+
+class ConfigBaseDict(ConfigBase):
+    """
+    Drop-in alternative to ConfigBase whose parameters live in a DictTreeStorage: a tree of in-memory dictionaries,
+    one per nested config, with an index of the flat (e.g. "model__lr") keys. Parameters are never written to nor
+    decoded from os.environ. The environmental variables (and the yaml files listed in DEFAULT_YML_ENVVARNAME) are
+    only read once, when the config is built, to override the defaults, unless the config is isolated.
+
+    Nested ConfigBaseDict configs share their storage with the parent, as in ConfigBase. Nested ConfigBase configs
+    are copied, so that writes through the parent do not reach os.environ
+    """
+
+    def _build_storage(self, isolated):
+        return DictTreeStorage(name=self.name, fallbackStorageKwargs={"envNamePrefix": self.fullName,
+                                                                      "codec": self.JSON_CODEC})
+
+    def _nested_storage(self, config):
+        if self._isolated or not isinstance(config._storage, DictTreeStorage):
+            return config._storage.isolated_copy()
+        return config._storage
+
+    def _bind_param_descriptors(self):
+        if isinstance(self._storage, DictTreeStorage):  # Not for derived configs or daemon clients
+            self._storage.build_index()
+        super()._bind_param_descriptors()
+
+    @property
+    def parameters_tree(self):
+        """
+        The parameters (including the computed ones) as nested dictionaries, one per nested config
+        """
+        tree = self._storage.tree()
+        for key in self._computed:
+            *path, name = key.split(self.NESTED_SEPARATOR)
+            node = tree
+            for nodeName in path:
+                node = node[nodeName]
+            node[name] = self._get_computed(key)
+        return tree
+
 
 if __name__ == "__main__":
     class MyConf(ConfigBaseDict):
-        pass
+        def set_parameters(self):
+            self.CONF_KK: int = 1
 
     conf = MyConf("MyConf")
-    conf.CONF_KK = 1
-    conf._kk = 2
+    conf.CONF_KK = 2
     print(conf.CONF_KK)
-    print()
\ No newline at end of file
+    print(conf.parameters_tree)
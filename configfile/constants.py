@@ -4,4 +4,8 @@ VALID_ANNOTATION_LIST_REGEX_PATT = r"(List|Tuple)\[(\w+)\]"
 PREFIX_ENV_SEP = "___"  # Access it only with ConfigBase.PREFIX_ENV_SEP
 NESTED_SEPARATOR = "__"  # Access it only with ConfigBase.NESTED_SEPARATOR
 
-DEFAULT_SIMPLE_STORAGENAME="EnvVarsStorage"
\ No newline at end of file
+DEFAULT_SIMPLE_STORAGENAME="EnvVarsStorage"
+
+TRACE_STARTUP_ENVVARNAME = "CONFIGFILE_TRACE_STARTUP"  # Set it to 1 to trace the construction of all the configs
+JSON_CODEC_ENVVARNAME = "CONFIGFILE_JSON_CODEC"  # json (the default), orjson or ujson
+KV_URL_ENVVARNAME = "CONFIGFILE_KV_URL"  # Default server of RemoteKVStorage, as redis://[:password@]host:port[/db]
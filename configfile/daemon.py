@@ -0,0 +1,402 @@
+"""
+Serves a resolved config over a Unix domain socket, so that many co-located processes can get it without running
+set_parameters, parsing yaml files or scanning the environmental variables.
+
+    # In the daemon process
+    server = MyConfig(config_file="config.yaml").serve("/tmp/myconfig.sock")
+
+    # In each worker
+    conf = MyConfig.from_daemon("/tmp/myconfig.sock")
+
+The protocol is newline-delimited json. Requests are {"id": n, "op": ...} and get a reply with the same id.
+Subscribed clients also receive {"event": "put"|"delete", "key": ..., "value": ...} pushes for every change.
+"""
+import array
+import errno
+import itertools
+import os
+import queue
+import socket
+import socketserver
+import tempfile
+import threading
+import weakref
+from functools import partial
+
+from configfile import exceptions
+from configfile.compile import _serialize_annotations, _deserialize_annotations
+from configfile.constants import NESTED_SEPARATOR, PREFIX_ENV_SEP
+from configfile.envVarUtils import get_default_codec, param_to_env_name
+from configfile.storages import DictStorage, MultiStorage
+from configfile.typedarrays import to_typed_array
+
+_CODEC = get_default_codec()
+
+
+def _encode_message(msg):
+    return (_CODEC.dumps(msg) + "\n").encode("utf-8")
+
+
+def _bind_private(sock, path):
+    """
+    Binds the Unix socket sock to path, readable and writable only by its owner. It is bound within a new private
+    directory and then moved to path, so it is never reachable with looser permissions
+    """
+    if os.path.exists(path):
+        raise OSError(errno.EADDRINUSE, f"Error, {path} already exists")
+    tmpdir = tempfile.mkdtemp(prefix=".", dir=os.path.dirname(os.path.abspath(path)))
+    tmp_path = os.path.join(tmpdir, "s")
+    try:
+        sock.bind(tmp_path)
+        os.chmod(tmp_path, 0o600)
+        os.rename(tmp_path, path)
+    finally:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        os.rmdir(tmpdir)
+
+
+class _ConfigRequestHandler(socketserver.StreamRequestHandler):
+    MAX_PENDING_MESSAGES = 10000  # Clients that fall further behind are disconnected
+
+    def setup(self):
+        super().setup()
+        self.outbox = queue.Queue(self.MAX_PENDING_MESSAGES)
+        self.writer = threading.Thread(target=self._write_loop, name="configfile-daemon-writer", daemon=True)
+        self.writer.start()
+
+    def send(self, msg):
+        """
+        Queues msg, that is written to the client from the writer thread of the connection, so it never blocks.
+        Raises OSError, and disconnects the client, if it does not read its messages
+        """
+        try:
+            self.outbox.put_nowait(_encode_message(msg))
+        except queue.Full:
+            self.disconnect()
+            raise OSError(f"Error, the client has more than {self.MAX_PENDING_MESSAGES} messages pending")
+
+    def disconnect(self):
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _write_loop(self):
+        while True:
+            data = self.outbox.get()
+            if data is None:
+                return
+            try:
+                self.wfile.write(data)
+                self.wfile.flush()
+            except OSError:
+                self.disconnect()
+                return
+
+    def finish(self):
+        try:
+            self.outbox.put_nowait(None)
+        except queue.Full:  # The client is gone, so the writer is stopped (or will be) by the disconnection
+            self.disconnect()
+        self.writer.join()
+        super().finish()
+
+    def handle(self):
+        server = self.server.config_server
+        try:
+            for line in self.rfile:
+                msg = _CODEC.loads(line.decode("utf-8"))
+                try:
+                    reply = server.handle_request(self, msg)
+                    reply.update(id=msg["id"], ok=True)
+                except Exception as e:
+                    reply = {"id": msg["id"], "ok": False, "error_type": type(e).__name__, "error": str(e)}
+                if msg["op"] != "subscribe" or not reply["ok"]:  # subscribe sends its snapshot holding the lock
+                    self.send(reply)
+        finally:
+            server.unsubscribe(self)
+
+
+class ConfigServer():
+    """
+    Serves config over the Unix socket path. Use ConfigBase.serve to build it
+    """
+
+    def __init__(self, config, path):
+        self.config = config
+        self.path = path
+        self._subscribers = set()
+        self._lock = threading.RLock()
+        self._origin = threading.local()  # The handler whose request is being applied, that needs no push back
+        self._server = socketserver.ThreadingUnixStreamServer(path, _ConfigRequestHandler, bind_and_activate=False)
+        try:
+            _bind_private(self._server.socket, path)
+            self._server.server_activate()
+        except BaseException:
+            self._server.server_close()
+            raise
+        self._server.daemon_threads = True
+        self._server.config_server = self
+        self._thread = None
+        config._storage.add_listener(self._on_change)
+
+    def start(self):
+        """
+        Serves the config from a background thread
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, name="configfile-daemon", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def close(self):
+        self.config._storage.remove_listener(self._on_change)
+        if self._thread is not None:
+            self._server.shutdown()
+        self._server.server_close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def snapshot(self):
+        config = self.config
+        namespace_storages, _ = config._namespace_storages()
+        params = dict(config._storage.items())
+        params.update({key: config._get_computed(key) for key in config._computed})
+        return {"name": config.name,
+                "fullName": config.fullName,
+                "namespaces": [[namespace, getattr(storage, "envNamePrefix", None)]
+                               for namespace, storage in namespace_storages],
+                "annotations": {name: [None if annotations is None else _serialize_annotations(annotations), prefix]
+                                for name, (annotations, prefix)
+                                in config.config_classname_2_annotations_prefix.items()},
+                "params": params,
+                # Typed arrays are sent in their exported form, so the clients need to know which ones to convert
+                "arrays": {key: v.typecode for key, v in params.items() if isinstance(v, array.array)}}
+
+    def handle_request(self, handler, msg):
+        op = msg["op"]
+        if op == "snapshot":
+            return {"snapshot": self.snapshot()}
+        if op == "subscribe":
+            with self._lock:  # No change can be queued between the snapshot and the subscription
+                reply = {"id": msg["id"], "ok": True, "snapshot": self.snapshot()}
+                handler.send(reply)
+                self._subscribers.add(handler)
+            return reply
+        self._origin.handler = handler
+        try:
+            if op == "put_many":
+                self.config.update(msg["items"])
+            elif op == "delete":
+                self.config._storage.delete(msg["key"])
+            else:
+                raise ValueError(f"Error, unknown op {op}")
+        finally:
+            self._origin.handler = None
+        return {}
+
+    def unsubscribe(self, handler):
+        with self._lock:
+            self._subscribers.discard(handler)
+
+    def _push(self, msg, origin):
+        for handler in list(self._subscribers):
+            if handler is origin:
+                continue
+            try:
+                handler.send(msg)
+            except OSError:
+                self._subscribers.discard(handler)
+
+    def _on_change(self, event, k, v):
+        # Pushes are only queued (see _ConfigRequestHandler.send), so slow clients never block the changes
+        config = self.config
+        origin = getattr(self._origin, "handler", None)
+        with self._lock:
+            if not self._subscribers:
+                return
+            self._push({"event": event, "key": k, "value": v}, origin)
+            # Clients get the computed parameters as plain values, so the ones invalidated by the change are pushed
+            for key in list(config._computed):
+                if key not in config._computed_cache:
+                    self._push({"event": "put", "key": key, "value": config._get_computed(key)}, None)
+
+
+class DaemonClient():
+    """
+    Connection to a ConfigServer. Replies are matched to their requests, and pushed changes are applied to the
+    SocketStorages registered with the client, from a background thread
+    """
+
+    def __init__(self, path, timeout=10.0, sep=NESTED_SEPARATOR):
+        self.path = path
+        self.timeout = timeout
+        self.sep = sep
+        self.pid = os.getpid()  # The reader thread does not survive a fork, so children cannot use the connection
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(path)
+        self._reader = self._sock.makefile("rb")
+        self._send_lock = threading.Lock()
+        self._ids = itertools.count()
+        self._pending = {}  # request id -> [threading.Event, reply]
+        self._leaves = {}  # namespace -> weakref to its SocketStorage
+        self._closed = False
+        self._thread = threading.Thread(target=self._read_loop, name="configfile-daemon-client", daemon=True)
+        self._thread.start()
+
+    def request(self, op, **kwargs):
+        request_id = next(self._ids)
+        slot = self._pending[request_id] = [threading.Event(), None]
+        kwargs.update(id=request_id, op=op)
+        with self._send_lock:
+            self._sock.sendall(_encode_message(kwargs))
+        if not slot[0].wait(self.timeout):
+            self._pending.pop(request_id, None)
+            raise TimeoutError(f"Error, no reply from the config daemon at {self.path}")
+        reply = slot[1]
+        if reply is None:
+            raise ConnectionError(f"Error, the connection to the config daemon at {self.path} was closed")
+        if not reply["ok"]:
+            raise getattr(exceptions, reply["error_type"], RuntimeError)(reply["error"])
+        return reply
+
+    def register(self, namespace, storage):
+        self._leaves[namespace] = weakref.ref(storage)
+
+    def _read_loop(self):
+        try:
+            for line in self._reader:
+                msg = _CODEC.loads(line.decode("utf-8"))
+                if "id" in msg:
+                    slot = self._pending.pop(msg["id"], None)
+                    if slot is not None:
+                        slot[1] = msg
+                        slot[0].set()
+                else:
+                    self._apply(msg["event"], msg["key"], msg.get("value"))
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._closed = True
+            for slot in list(self._pending.values()):
+                slot[0].set()
+
+    def _apply(self, event, key, value):
+        namespace, _, k = key.rpartition(self.sep)
+        storageRef = self._leaves.get(namespace)
+        storage = storageRef() if storageRef is not None else None
+        if storage is not None:
+            storage._apply_remote(event, k, value)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+
+
+class SocketStorage(DictStorage):
+    """
+    Local copy of the parameters of one namespace of a served config. Reads never leave the process. Writes are
+    sent to the ConfigServer, and changes done by other clients are pushed back. Once pickled, or in a forked
+    child, it is detached from the daemon and behaves as a DictStorage
+    """
+
+    def __init__(self, name, envNamePrefix=None, prefix_sep=PREFIX_ENV_SEP, codec=None):
+        super().__init__(name, envNamePrefix=envNamePrefix, prefix_sep=prefix_sep, codec=codec)
+        self.client = None
+        self.namespace = ""
+
+    def attach(self, client, namespace):
+        """
+        Connects the storage to the namespace (e.g. "model" or "" for the top level config) of the served config
+        """
+        self.client = client
+        self.namespace = namespace
+        client.register(namespace, self)
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["client"] = None
+        return state
+
+    def _connected(self):
+        return self.client is not None and self.client.pid == os.getpid()
+
+    def _full_key(self, k):
+        return self.namespace + NESTED_SEPARATOR + k if self.namespace else k
+
+    def put(self, k, v):
+        self.put_many({k: v})
+
+    def put_many(self, items):
+        if self._connected():
+            self.client.request("put_many", items={self._full_key(k): v for k, v in items.items()})
+        super().put_many(items)
+
+    def delete(self, k):
+        if self._connected():
+            self.client.request("delete", key=self._full_key(k))
+        super().delete(k)
+
+    def _apply_remote(self, event, k, v):
+        if event == "put":
+            DictStorage.put_many(self, {k: v})
+        elif k in self._data:
+            DictStorage.delete(self, k)
+
+
+def build_client_config(cls, path):
+    """
+    Builds an instance of the ConfigBase subclass cls from the snapshot served at path. set_parameters is not
+    executed: the parameters, the nested configs and the type annotations are all taken from the daemon
+    """
+    client = DaemonClient(path, sep=cls.NESTED_SEPARATOR)
+    snapshot = client.request("subscribe")["snapshot"]
+
+    storages = {}  # namespace -> MultiStorage
+    for namespace, envNamePrefix in snapshot["namespaces"]:  # Parents always come before their nested configs
+        parent_namespace, _, name = namespace.rpartition(cls.NESTED_SEPARATOR)
+        nested = MultiStorage(name or snapshot["name"], fallbackStorageClassName="SocketStorage",
+                              fallbackStorageKwargs={"envNamePrefix": envNamePrefix})
+        nested.fallbackStorage.attach(client, namespace)
+        if namespace:
+            storages[parent_namespace].addStorage(nested)
+        storages[namespace] = nested
+    storage = storages[""]
+    for key, typecode in snapshot["arrays"].items():
+        leaf, leafKey = storage.route(key)
+        leaf.set_coercer(leafKey, partial(to_typed_array, typecode=typecode))
+    for key, v in snapshot["params"].items():
+        leaf, leafKey = storage.route(key)
+        leaf._data[leafKey] = leaf._coerce(leafKey, v)
+
+    conf = cls.__new__(cls)
+    conf._init_attributes(snapshot["name"], isolated=True)
+    conf.__dict__.update(
+        fullName=snapshot["fullName"], _storage=storage,
+        env_var_prefix=param_to_env_name(snapshot["fullName"], cls.PREFIX_ENV_SEP, ""),
+        config_classname_2_annotations_prefix={
+            name: (None if annotations is None else _deserialize_annotations(annotations), prefix)
+            for name, (annotations, prefix) in snapshot["annotations"].items()},
+        _initialized=True)
+    conf._attach_to_storage(source="daemon")
+    return conf
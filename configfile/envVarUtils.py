@@ -1,5 +1,175 @@
 import json
 import ast
+import math
+import os
+import re
+
+from configfile.constants import JSON_CODEC_ENVVARNAME
+from configfile.typedarrays import json_default
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class JsonCodec():
+    """
+    Encodes parameter values as json strings and decodes them back. The default "json" codec writes the same
+    strings as json.dumps, the format of the environmental variables written by previous versions. The faster
+    codecs are opt-in (ConfigBase.JSON_CODEC or the CONFIGFILE_JSON_CODEC environmental variable), since their
+    output is not byte-identical (e.g. compact separators, non-ascii characters not escaped or 1e16 instead of
+    1e+16), but the values written by any codec can be read by any other.
+    array.array values are encoded in the compact form of configfile.typedarrays, and decoded as that mapping
+    """
+    name = None
+
+    def dumps(self, v) -> str:
+        raise NotImplementedError()
+
+    def loads(self, s):
+        raise NotImplementedError()
+
+    def loads_many(self, values) -> list:
+        """
+        Decodes a list of json strings. Raises ValueError if any of them is not valid json on its own
+        """
+        return [self.loads(v) for v in values]
+
+
+_JSON_DECODER = json.JSONDecoder()
+
+
+class StdlibJsonCodec(JsonCodec):
+    name = "json"
+
+    def dumps(self, v):
+        return json.dumps(v, default=json_default)
+
+    def loads(self, s):
+        return json.loads(s)
+
+    def loads_many(self, values):
+        """
+        Scans all the values joined in a single document, checking that each decoded value spans exactly its own
+        string (so that e.g. ["1,[2", "3]"] is not accepted as [1, [2, 3]]). Values that do not, e.g. because of
+        surrounding whitespace, are decoded on their own
+        """
+        doc = ",".join(values)
+        scan_once = _JSON_DECODER.scan_once
+        params = []
+        start = 0
+        for v in values:
+            end = start + len(v)
+            try:
+                param, parsedEnd = scan_once(doc, start)
+            except (StopIteration, ValueError):
+                parsedEnd = None
+            if parsedEnd == end:
+                params.append(param)
+            else:
+                params.append(self.loads(v))
+            start = end + 1
+        return params
+
+
+def _has_non_finite(v):
+    if isinstance(v, float):
+        return not math.isfinite(v)
+    if isinstance(v, (list, tuple)):
+        return any(_has_non_finite(x) for x in v)
+    if isinstance(v, dict):
+        return any(_has_non_finite(x) for x in v.values())
+    return False
+
+
+_LONG_NUMBER_PATT = re.compile(r"\d{19}")
+
+
+class OrjsonCodec(StdlibJsonCodec):
+    """
+    Uses orjson, falling back to the json module for the values that orjson does not support (e.g. integers
+    larger than 64 bits, that it would decode as floats, or non-string dict keys) or encodes differently (NaN and
+    infinity, that orjson writes as null)
+    """
+    name = "orjson"
+
+    def dumps(self, v):
+        try:
+            encoded = orjson.dumps(v, default=json_default)
+        except TypeError:
+            return super().dumps(v)
+        if b"null" in encoded and _has_non_finite(v):
+            return super().dumps(v)
+        return encoded.decode("utf-8")
+
+    def loads(self, s):
+        if _LONG_NUMBER_PATT.search(s):
+            return super().loads(s)
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:  # e.g. NaN, that is accepted by the json module
+            return super().loads(s)
+
+    loads_many = JsonCodec.loads_many
+
+
+class UjsonCodec(StdlibJsonCodec):
+    """
+    Uses ujson, falling back to the json module for the values that ujson does not support
+    """
+    name = "ujson"
+
+    def dumps(self, v):
+        if _has_non_finite(v):
+            return super().dumps(v)
+        try:
+            return ujson.dumps(v, ensure_ascii=False, escape_forward_slashes=False)
+        except (TypeError, OverflowError):
+            return super().dumps(v)
+
+    def loads(self, s):
+        try:
+            return ujson.loads(s)
+        except ValueError:
+            return super().loads(s)
+
+    loads_many = JsonCodec.loads_many
+
+
+AVAILABLE_JSON_CODECS = {"json": StdlibJsonCodec}
+if orjson is not None:
+    AVAILABLE_JSON_CODECS["orjson"] = OrjsonCodec
+if ujson is not None:
+    AVAILABLE_JSON_CODECS["ujson"] = UjsonCodec
+
+
+def _select_default_codec():
+    return get_codec(os.environ.get(JSON_CODEC_ENVVARNAME, "json"))
+
+
+def get_codec(codec=None) -> JsonCodec:
+    """
+    :param codec: A JsonCodec, the name of an available codec ("json", "orjson" or "ujson") or None for the default
+    """
+    if codec is None:
+        return _DEFAULT_CODEC
+    if isinstance(codec, JsonCodec):
+        return codec
+    try:
+        return AVAILABLE_JSON_CODECS[codec]()
+    except KeyError:
+        raise ValueError(f"Error, json codec {codec} is not available. Available: {list(AVAILABLE_JSON_CODECS)}")
+
+
+def get_default_codec() -> JsonCodec:
+    return _DEFAULT_CODEC
+
 
 def param_to_env_name(prefix, prefix_sep, paramname):
     return prefix + prefix_sep + paramname
@@ -11,11 +181,23 @@ def env_to_param_name(envname, prefix_sep):
         raise ValueError(f"Error, env_to_param_name failed for {envname} using prefix_sep {prefix_sep}")
     return varname
 
-def serialize_param_to_envvar(v):
-    return json.dumps(v)
+def serialize_param_to_envvar(v, codec=None):
+    return get_codec(codec).dumps(v)
+
+def load_envvar_to_param(v, codec=None):
+    return get_codec(codec).loads(v)
 
-def load_envvar_to_param(v):
-    return json.loads(v)
+def load_envvars_to_params(values, codec=None):
+    """
+    Decodes a list of env var values at once (see JsonCodec.loads_many). Raises ValueError if any of them is not
+    valid json on its own
+    """
+    if not values:
+        return []
+    return get_codec(codec).loads_many(values)
 
 def load_envvar(envVal):
-    return ast.literal_eval(envVal)
\ No newline at end of file
+    return ast.literal_eval(envVal)
+
+
+_DEFAULT_CODEC = _select_default_codec()
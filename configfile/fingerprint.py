@@ -0,0 +1,72 @@
+import hashlib
+import json
+
+from configfile.constants import NESTED_SEPARATOR
+from configfile.typedarrays import json_default
+
+_MASK = (1 << 64) - 1
+
+
+def _pair_hash(k, encoded_value):
+    digest = hashlib.blake2b((k + "\0" + encoded_value).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class IncrementalFingerprint():
+    """
+    Order-independent hash of the contents of a storage, computed as the sum (mod 2**64) of the hashes of its
+    (key, value) pairs. A sum is kept for every nested namespace (e.g. "model" for "model__lr"), using the keys
+    relative to the namespace, so that the fingerprint of a nested config is the same whether it is computed from
+    the config itself or from its parent. The sums are updated in O(depth) after each put/delete of the storage.
+
+    Changes done to os.environ without going through the storage are not observed.
+    """
+
+    def __init__(self, storage, sep=NESTED_SEPARATOR):
+        self.sep = sep
+        self._encoded = {}  # key -> canonical json of its value
+        self._sums = {"": 0}  # namespace -> sum of the hashes of the keys within it
+        for k, v in storage.items():
+            self._update(k, self._encode(v))
+        storage.add_listener(self._on_change)
+
+    @staticmethod
+    def _encode(v):
+        return json.dumps(v, sort_keys=True, separators=(",", ":"), default=json_default)
+
+    def _namespaces(self, k):
+        """
+        Yields the namespaces that contain k together with the name of k relative to them
+        """
+        yield "", k
+        start = k.find(self.sep)
+        while start != -1:
+            yield k[:start], k[start + len(self.sep):]
+            start = k.find(self.sep, start + len(self.sep))
+
+    def _update(self, k, encoded):
+        old_encoded = self._encoded.get(k)
+        if old_encoded == encoded:
+            return
+        if encoded is None:
+            del self._encoded[k]
+        else:
+            self._encoded[k] = encoded
+        for namespace, relative_k in self._namespaces(k):
+            delta = 0
+            if old_encoded is not None:
+                delta -= _pair_hash(relative_k, old_encoded)
+            if encoded is not None:
+                delta += _pair_hash(relative_k, encoded)
+            self._sums[namespace] = (self._sums.get(namespace, 0) + delta) & _MASK
+
+    def _on_change(self, event, k, v):
+        self._update(k, self._encode(v) if event == "put" else None)
+
+    def fingerprint(self, prefix=""):
+        """
+        :param prefix: The namespace (e.g. the name of a nested config) to which the fingerprint is restricted.
+                       "" for the whole storage
+        :return: The fingerprint as a 16 characters hex string
+        """
+        return format(self._sums.get(prefix, 0), "016x")
@@ -0,0 +1,447 @@
+"""
+Storage backed by a remote key-value server that speaks the Redis protocol (RESP), so that the parameters of a
+config can be shared by a whole fleet of processes and machines. Only the standard library is required.
+
+    storage = MultiStorage("myconfig", fallbackStorageClassName="RemoteKVStorage",
+                           fallbackStorageKwargs={"url": "redis://confighost:6379/0"})
+"""
+import contextlib
+import os
+import socket
+import threading
+import time
+import weakref
+from urllib.parse import urlparse
+
+from configfile.constants import PREFIX_ENV_SEP, KV_URL_ENVVARNAME
+from configfile.envVarUtils import get_codec
+from configfile.storages import SimpleStorage, _copy_value
+
+DEFAULT_KV_URL = "redis://localhost:6379/0"
+
+
+class KVStorageError(Exception):
+    pass
+
+
+def _encode_command(args):
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode("utf-8")
+        elif isinstance(arg, int):
+            arg = str(arg).encode("ascii")
+        out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(out)
+
+
+def _escape_glob(s):
+    for c in "\\*?[]":
+        s = s.replace(c, "\\" + c)
+    return s
+
+
+class RespConnection():
+    """
+    A single connection to the server. Replies are returned as str (bulk and simple strings), int, None or lists.
+    Error replies raise KVStorageError
+    """
+
+    def __init__(self, host, port, timeout=None):
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile("rb")
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by the server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            raise KVStorageError(payload.decode("utf-8"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length == -1:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            length = int(payload)
+            if length == -1:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise KVStorageError(f"Error, unexpected reply {line!r}")
+
+    def execute(self, *args):
+        return self.pipeline([args])[0]
+
+    def read_reply(self):
+        """
+        Reads the next reply, e.g. the messages pushed to a connection subscribed to a channel
+        """
+        return self._read_reply()
+
+    def pipeline(self, commands):
+        """
+        Sends all the commands in a single write and then reads their replies, so they take one round trip
+        """
+        self._sock.sendall(b"".join(_encode_command(args) for args in commands))
+        replies, error = [], None
+        for _ in commands:
+            try:
+                replies.append(self._read_reply())
+            except KVStorageError as e:  # The remaining replies still need to be consumed
+                error = error or e
+                replies.append(None)
+        if error is not None:
+            raise error
+        return replies
+
+    def close(self):
+        try:
+            self._reader.close()
+            self._sock.close()
+        except OSError:
+            pass
+
+
+class ConnectionPool():
+    """
+    Thread-safe pool of RespConnections to the server given by url (redis://[:password@]host:port[/db]).
+    Connections are created on demand and at most max_idle of them are kept open once released
+    """
+
+    def __init__(self, url, max_idle=8, timeout=5.0):
+        parsed = urlparse(url)
+        self.url = url
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.strip("/") or 0)
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def new_connection(self, timeout=-1):
+        """
+        Opens a new connection that is not managed by the pool
+
+        :param timeout: The socket timeout. By default, the one of the pool. None to block forever
+        """
+        conn = RespConnection(self.host, self.port, timeout=self.timeout if timeout == -1 else timeout)
+        try:
+            if self.password:
+                conn.execute("AUTH", self.password)
+            if self.db:
+                conn.execute("SELECT", self.db)
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    @contextlib.contextmanager
+    def connection(self):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self.new_connection()
+        reusable = False
+        try:
+            yield conn
+            reusable = True
+        except KVStorageError:  # Error replies are fully read, so the connection is still in a consistent state
+            reusable = True
+            raise
+        finally:
+            released = False
+            if reusable:
+                with self._lock:
+                    if len(self._idle) < self.max_idle:
+                        self._idle.append(conn)
+                        released = True
+            if not released:
+                conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(url) -> ConnectionPool:
+    """
+    Returns the ConnectionPool shared by all the storages of this process that use url. Forked children get
+    their own pool, since sockets cannot be shared with the parent
+    """
+    key = (url, os.getpid())
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = _POOLS[key] = ConnectionPool(url)
+        return pool
+
+
+class InvalidationSubscriber():
+    """
+    Daemon thread that listens to a pub/sub channel of the server, on which RemoteKVStorages publish the (newline
+    separated) remote keys that they change, and drops those keys from the read caches of the storages of this
+    process that use the channel. If the subscription is lost, the caches are cleared once it is restored, since
+    messages may have been missed
+    """
+
+    def __init__(self, url, channel, retry_interval=1.0):
+        self.url = url
+        self.channel = channel
+        self.retry_interval = retry_interval
+        self._storages = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._subscribed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"configfile-invalidation-{channel}", daemon=True)
+        self._thread.start()
+
+    def add(self, storage):
+        with self._lock:
+            self._storages.add(storage)
+
+    def wait_subscribed(self, timeout=None) -> bool:
+        return self._subscribed.wait(timeout)
+
+    def _for_each_storage(self, func):
+        with self._lock:
+            storages = list(self._storages)
+        for storage in storages:
+            func(storage)
+
+    def _invalidate(self, remoteKeys):
+        def invalidate(storage):
+            remotePrefix = storage.envNamePrefix + storage.prefix_sep
+            for remoteKey in remoteKeys:
+                if remoteKey.startswith(remotePrefix):
+                    storage.invalidate(remoteKey[len(remotePrefix):])
+        self._for_each_storage(invalidate)
+
+    def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = get_pool(self.url).new_connection(timeout=None)
+                conn.execute("SUBSCRIBE", self.channel)
+                self._for_each_storage(lambda storage: storage.invalidate())
+                self._subscribed.set()
+                while True:
+                    reply = conn.read_reply()
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == "message":
+                        self._invalidate(reply[2].split("\n"))
+            except (OSError, KVStorageError):
+                self._subscribed.clear()
+                if conn is not None:
+                    conn.close()
+                time.sleep(self.retry_interval)
+
+
+_SUBSCRIBERS = {}
+
+
+def get_invalidation_subscriber(url, channel, timeout=5.0) -> InvalidationSubscriber:
+    """
+    Returns the InvalidationSubscriber of this process for channel of the server at url, waiting up to timeout
+    seconds for it to be subscribed when it is created
+    """
+    key = (url, channel, os.getpid())
+    with _POOLS_LOCK:
+        subscriber = _SUBSCRIBERS.get(key)
+        created = subscriber is None
+        if created:
+            subscriber = _SUBSCRIBERS[key] = InvalidationSubscriber(url, channel)
+    if created:
+        subscriber.wait_subscribed(timeout)
+    return subscriber
+
+
+class RemoteKVStorage(SimpleStorage):
+    """
+    Storage whose values are kept, encoded with codec, in a Redis-protocol server under the keys
+    envNamePrefix + prefix_sep + k (the same names that EnvVarsStorage uses for the environmental variables).
+
+    Reads are served from a local cache for cache_ttl seconds, so changes done by other clients may take up to
+    cache_ttl seconds to be observed. To observe them earlier, give an invalidation_channel: writes publish the
+    changed keys on it, and the storages that use it drop them from their caches as soon as they are notified (see
+    InvalidationSubscriber). invalidate can also be called directly, e.g. from other notification systems
+    """
+    IO_BOUND = True
+
+    def __init__(self, name, envNamePrefix=None, prefix_sep=PREFIX_ENV_SEP, codec=None, url=None,
+                 cache_ttl: float = 1.0, scan_count: int = 1000, invalidation_channel=None):
+        """
+        :param url: redis://[:password@]host:port[/db]. Defaults to the CONFIGFILE_KV_URL environmental variable
+        :param cache_ttl: Seconds during which a value read from the server is reused. 0 disables the cache
+        :param scan_count: Number of keys requested per SCAN/MGET round trip when listing the storage
+        :param invalidation_channel: A pub/sub channel of the server shared by all the clients of the storage. Writes
+                                     are published on it, and cached values are invalidated when they are notified
+        """
+        super().__init__(name)
+        self.envNamePrefix = name if envNamePrefix is None else envNamePrefix
+        self.prefix_sep = prefix_sep
+        self.codec = get_codec(codec)
+        self.url = url or os.environ.get(KV_URL_ENVVARNAME, DEFAULT_KV_URL)
+        self.cache_ttl = cache_ttl
+        self.scan_count = scan_count
+        self.invalidation_channel = invalidation_channel
+        self._cache = {}  # k -> (expiration time, value)
+        self._subscribedPid = None  # The process in which the storage was added to its InvalidationSubscriber
+
+    @property
+    def name(self):
+        return self._name
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["_cache"] = {}
+        state["_subscribedPid"] = None
+        return state
+
+    def _remote_key(self, k):
+        return self.envNamePrefix + self.prefix_sep + k
+
+    def _execute(self, *args):
+        with get_pool(self.url).connection() as conn:
+            return conn.execute(*args)
+
+    def _execute_write(self, args, keys):
+        """
+        Executes the write command args, publishing the changed keys in the same round trip if there is an
+        invalidation channel
+        """
+        if self.invalidation_channel is None:
+            return self._execute(*args)
+        message = "\n".join(self._remote_key(k) for k in keys)
+        with get_pool(self.url).connection() as conn:
+            return conn.pipeline([args, ("PUBLISH", self.invalidation_channel, message)])[0]
+
+    def _cache_put(self, k, v):
+        if self.cache_ttl > 0:
+            if self.invalidation_channel is not None and self._subscribedPid != os.getpid():
+                get_invalidation_subscriber(self.url, self.invalidation_channel).add(self)
+                self._subscribedPid = os.getpid()
+            self._cache[k] = (time.monotonic() + self.cache_ttl, _copy_value(v))
+
+    def invalidate(self, k=None):
+        """
+        Drops k (or every key if None) from the local read cache, so that the next read goes to the server
+        """
+        if k is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(k, None)
+
+    def keys(self):
+        remotePrefix = self.envNamePrefix + self.prefix_sep
+        pattern = _escape_glob(remotePrefix) + "*"
+        cursor = "0"
+        seen = set()  # SCAN may return a key more than once (e.g. if the server rehashes during the iteration)
+        while True:
+            cursor, remoteKeys = self._execute("SCAN", cursor, "MATCH", pattern, "COUNT", self.scan_count)
+            for remoteKey in remoteKeys:
+                if remoteKey not in seen:
+                    seen.add(remoteKey)
+                    yield remoteKey[len(remotePrefix):]
+            if cursor == "0":
+                break
+
+    def put(self, k, v):
+        if self._coercers:
+            v = self._coerce(k, v)
+        self._execute_write(("SET", self._remote_key(k), self.codec.dumps(v)), [k])
+        self._cache_put(k, v)
+        if self._listeners:
+            self._notify("put", k, v)
+
+    def put_many(self, items):
+        if not items:
+            return
+        if self._coercers:
+            items = {k: self._coerce(k, v) for k, v in items.items()}
+        args = ["MSET"]
+        for k, v in items.items():
+            args += [self._remote_key(k), self.codec.dumps(v)]
+        self._execute_write(args, items)
+        for k, v in items.items():
+            self._cache_put(k, v)
+        if self._listeners:
+            for k, v in items.items():
+                self._notify("put", k, v)
+
+    def get(self, k):
+        cached = self._cache.get(k)
+        if cached is not None and cached[0] > time.monotonic():
+            return _copy_value(cached[1])
+        raw = self._execute("GET", self._remote_key(k))
+        if raw is None:
+            self._cache.pop(k, None)
+            raise KeyError(k)
+        v = self.codec.loads(raw)
+        if self._coercers:  # e.g. typed arrays, that are decoded in their exported form
+            v = self._coerce(k, v)
+        self._cache_put(k, v)
+        return _copy_value(v)
+
+    def get_many(self, keys):
+        """
+        Returns {k: value} for the keys that exist in the storage, reading the ones that are not cached with a
+        single MGET
+        """
+        now = time.monotonic()
+        result, missing = {}, []
+        for k in keys:
+            cached = self._cache.get(k)
+            if cached is not None and cached[0] > now:
+                result[k] = _copy_value(cached[1])
+            else:
+                missing.append(k)
+        if missing:
+            raws = self._execute("MGET", *[self._remote_key(k) for k in missing])
+            for k, raw in zip(missing, raws):
+                if raw is not None:
+                    v = self.codec.loads(raw)
+                    if self._coercers:
+                        v = self._coerce(k, v)
+                    self._cache_put(k, v)
+                    result[k] = _copy_value(v)
+        return result
+
+    def __contains__(self, k):
+        cached = self._cache.get(k)
+        if cached is not None and cached[0] > time.monotonic():
+            return True
+        return bool(self._execute("EXISTS", self._remote_key(k)))
+
+    def delete(self, k):
+        removed = self._execute_write(("DEL", self._remote_key(k)), [k])
+        self._cache.pop(k, None)
+        if not removed:
+            raise KeyError(k)
+        if self._listeners:
+            self._notify("delete", k)
+
+    def items(self):
+        batch = []
+        for k in self.keys():
+            batch.append(k)
+            if len(batch) >= self.scan_count:
+                yield from self.get_many(batch).items()
+                batch = []
+        if batch:
+            yield from self.get_many(batch).items()
+
+    def __str__(self):
+        return self.name + ":" + str(dict(self.items()))
@@ -0,0 +1,112 @@
+"""
+Tracking of where the value of each parameter comes from (see ConfigBase.TRACK_PROVENANCE). Every source that sets
+a parameter ("defaults", "yaml", "env", "cli", "update" or any name given with changelog.change_source) is kept
+as a separate layer, so the value that a parameter would take without one of them is known without building the
+config again.
+"""
+import contextvars
+from collections import namedtuple
+
+from configfile.changelog import CHANGE_SOURCE
+from configfile.storages import _copy_value
+
+# True while a config that tracks provenance runs its set_parameters, so that its nested configs track it too
+TRACKING_BUILD = contextvars.ContextVar("configfile_tracking_build", default=False)
+
+Provenance = namedtuple("Provenance", ["source", "value", "layers"])
+Provenance.__doc__ = """
+The source that set the current value of a parameter, and the value set by each of the sources (layers), the
+current one last
+"""
+
+
+class ProvenanceTracker():
+    """
+    Listener of a storage that keeps the values put by each source. For each parameter, it also keeps its sources
+    ordered by their last write, so that the winner (the source of its current value) is always the last one
+    """
+
+    def __init__(self):
+        self._layers = {}  # source -> {param_name: value}
+        self._sources = {}  # param_name -> sources that set it, the winner last
+        self._won = {}  # source -> names of the parameters whose current value it set
+
+    def track(self, storage, source="defaults"):
+        """
+        Records the current contents of storage as coming from source, and then all its changes
+        """
+        for k, v in storage.items():
+            self._set(source, k, v)
+        self.listen(storage)
+        return self
+
+    def listen(self, storage):
+        storage.add_listener(self.on_change)
+
+    def _set(self, source, k, v):
+        self._layers.setdefault(source, {})[k] = v
+        sources = self._sources.get(k)
+        if sources is None:
+            self._sources[k] = [source]
+        elif sources[-1] != source:
+            self._won[sources[-1]].discard(k)
+            if source in sources:
+                sources.remove(source)
+            sources.append(source)
+        else:
+            return
+        self._won.setdefault(source, set()).add(k)
+
+    def _forget(self, k):
+        sources = self._sources.pop(k, ())
+        if sources:
+            self._won[sources[-1]].discard(k)
+        for source in sources:
+            del self._layers[source][k]
+
+    def on_change(self, event, k, v=None):
+        if event == "put":
+            self._set(CHANGE_SOURCE.get(), k, _copy_value(v))
+        else:
+            self._forget(k)
+
+    def merge(self, other, prefix=""):
+        """
+        Replaces the history of the parameters known by other, the tracker of a nested config whose keys are relative
+        to prefix, by the one that other recorded (e.g. the values that the nested config read from its own yaml
+        files or environmental variables before being added)
+        """
+        for k, sources in other._sources.items():
+            key = prefix + k
+            self._forget(key)
+            for source in sources:
+                self._set(source, key, _copy_value(other._layers[source][k]))
+
+    def __contains__(self, k):
+        return k in self._sources
+
+    def winner(self, k):
+        return self._sources[k][-1]
+
+    def provenance(self, k) -> Provenance:
+        sources = self._sources[k]
+        layers = {source: _copy_value(self._layers[source][k]) for source in sources}
+        return Provenance(sources[-1], layers[sources[-1]], layers)
+
+    def layer(self, source):
+        """
+        Returns {param_name: value} with the values put by source
+        """
+        return {k: _copy_value(v) for k, v in self._layers.get(source, {}).items()}
+
+    def without_layer(self, source):
+        """
+        Returns {param_name: value} with the values that the parameters whose winner is source would take without it
+        (i.e. the values of their previous winners). Parameters only set by source are not included
+        """
+        previous = {}
+        for k in self._won.get(source, ()):
+            sources = self._sources[k]
+            if len(sources) > 1:
+                previous[k] = _copy_value(self._layers[sources[-2]][k])
+        return previous
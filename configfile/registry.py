@@ -0,0 +1,106 @@
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Optional, Callable
+
+
+class ConfigRegistry():
+    """
+    Bounded cache of config instances, keyed by an arbitrary hashable (e.g. a tenant or model name), for services
+    that build many configs of the same class. At most max_instances configs are kept alive by the registry, the
+    least recently used being evicted first, and configs not accessed for ttl seconds are evicted too.
+    Evicted configs that are still referenced somewhere else are handed out again by get instead of being rebuilt,
+    so two callers never get different instances for the same key.
+
+    Use ConfigBase.registry to build it.
+    """
+
+    def __init__(self, config_class, max_instances: Optional[int] = None, ttl: Optional[float] = None,
+                 factory: Optional[Callable] = None):
+        """
+        :param config_class: The ConfigBase subclass of the instances
+        :param max_instances: Maximum number of configs kept alive by the registry. None for no limit
+        :param ttl: Seconds after the last access after which a config is evicted. None for no limit
+        :param factory: factory(key, **kwargs) builds the config for key. By default,
+                        config_class.new_instance(str(key), **kwargs)
+        """
+        if max_instances is not None and max_instances < 1:
+            raise ValueError("Error, max_instances must be positive")
+        self.config_class = config_class
+        self.max_instances = max_instances
+        self.ttl = ttl
+        self._factory = factory
+        self._entries = OrderedDict()  # key -> (config, last access time), least recently used first
+        self._evicted = weakref.WeakValueDictionary()  # Evicted configs that are still in use
+        self._lock = threading.RLock()
+
+    def _build(self, key, **kwargs):
+        if self._factory is not None:
+            return self._factory(key, **kwargs)
+        return self.config_class.new_instance(str(key), **kwargs)
+
+    def _evict_expired(self, now):
+        if self.ttl is None:
+            return
+        while self._entries:
+            key, (config, last_access) = next(iter(self._entries.items()))
+            if now - last_access < self.ttl:
+                break
+            self._evict(key)
+
+    def _evict(self, key):
+        config, _ = self._entries.pop(key)
+        self._evicted[key] = config
+
+    def get(self, key, **kwargs):
+        """
+        Returns the config for key, building it with the factory (to which kwargs are passed, e.g. config_file or
+        parameter overrides) if it is not in the registry. kwargs are ignored if the config already exists
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._evict_expired(now)
+            entry = self._entries.pop(key, None)
+            config = entry[0] if entry is not None else self._evicted.pop(key, None)
+            if config is None:
+                config = self._build(key, **kwargs)
+            self._entries[key] = (config, now)
+            if self.max_instances is not None:
+                while len(self._entries) > self.max_instances:
+                    self._evict(next(iter(self._entries)))
+            return config
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def release(self, key):
+        """
+        Stops keeping the config for key alive. It is still returned by get while it is referenced elsewhere
+        """
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._evict(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            return key in self._entries or key in self._evicted
+
+    def __len__(self):
+        """
+        Number of configs kept alive by the registry
+        """
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            return len(self._entries)
+
+    def keys(self):
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            return list(self._entries)
@@ -1,25 +1,139 @@
+import array
 import copy
+import importlib
 import json
 import os
+import threading
 import uuid
 import warnings
+import weakref
 from abc import abstractmethod
 from typing import Dict, Optional, List, Literal
 
 from configfile.constants import PREFIX_ENV_SEP, NESTED_SEPARATOR, DEFAULT_SIMPLE_STORAGENAME
-from configfile.envVarUtils import param_to_env_name, env_to_param_name
+from configfile.envVarUtils import param_to_env_name, env_to_param_name, get_codec
+
+
+_SCALAR_TYPES = (int, float, str, bool, type(None))
+
+# Events of the storages written by a thread of the async protocol, to be notified from the event loop thread
+_DEFERRED_EVENTS = threading.local()
+
+def _copy_value(v):
+    if isinstance(v, list):
+        if all(type(x) in _SCALAR_TYPES for x in v):
+            return list(v)
+        return copy.deepcopy(v)
+    if isinstance(v, dict):
+        if all(type(x) in _SCALAR_TYPES for x in v.values()):
+            return dict(v)
+        return copy.deepcopy(v)
+    if isinstance(v, (tuple, set)):
+        return copy.deepcopy(v)
+    if isinstance(v, array.array):
+        return v[:]
+    return v
 
 
 class BaseStorage(): #TODO: add code to prevent instantiating several storages with the same name
+    IO_BOUND = False  # Set it to True in storages whose operations block on I/O, so the async methods use a thread
+    __slots__ = ("_name", "_listeners", "_coercers", "__weakref__")
 
     def __init__(self, name):
         self._name = name
+        self._listeners = ()
+        self._coercers = {}  # k -> function that converts the values stored under k
 
     @property
     @abstractmethod
     def name(self):
         return self._name
 
+    def add_listener(self, listener, weak=False):
+        """
+        Registers listener(event, k, v), that will be called after each change of the storage, with
+        event="put" (v is the new value) or event="delete" (v is None)
+
+        :param weak: If True, listener must be a bound method, and only a weak reference to its object is kept, so
+                     that objects that listen to a storage they own do not form a reference cycle with it
+        """
+        if weak:
+            listener = _WeakMethodListener(listener)
+        self._listeners = tuple(l for l in self._listeners if l) + (listener,)  # Dead weak listeners are dropped
+
+    def remove_listener(self, listener):
+        self._listeners = tuple(l for l in self._listeners if l != listener)
+
+    def set_coercer(self, k, coercer):
+        """
+        Registers coercer(v), that returns the value to be stored when v is put under k (e.g. ConfigBase.TYPED_ARRAYS
+        uses it to store lists as arrays). It must return a new object. Only simple storages apply coercers
+        """
+        self._coercers = {**self._coercers, k: coercer}
+
+    def _coerce(self, k, v):
+        coercer = self._coercers.get(k)
+        return v if coercer is None else coercer(v)
+
+    def coerce(self, k, v):
+        """
+        Returns v as it would be stored under k
+        """
+        try:
+            storage, storageKey = self.route(k)
+        except KeyError:
+            return v
+        return storage._coerce(storageKey, v)
+
+    def peek(self, k):
+        """
+        Returns the value stored under k without copying it, so it must not be modified
+        """
+        return self.get(k)
+
+    def _notify(self, event, k, v=None):
+        deferred = getattr(_DEFERRED_EVENTS, "events", None)
+        if deferred is not None:
+            deferred.append((self, event, k, v))
+            return
+        for listener in self._listeners:
+            listener(event, k, v)
+
+    def _on_nested_event(self, storage, prefix, event, k, v):
+        if self._listeners:
+            self._notify(event, prefix + k, v)
+
+    def _forward_events_from(self, storage, prefix=""):
+        """
+        Re-emits the events of storage as events of self, prepending prefix to the keys. Only a weak reference
+        to self is kept
+        """
+        selfRef = weakref.ref(self)
+        storageRef = weakref.ref(storage)  # The storage keeps the forwarder, so a strong reference would be a cycle
+
+        def forwarder(event, k, v):
+            target = selfRef()
+            if target is None:
+                storageRef().remove_listener(forwarder)
+            else:
+                target._on_nested_event(storageRef(), prefix, event, k, v)
+
+        storage.add_listener(forwarder)
+        return forwarder
+
+    def __getstate__(self):
+        state = dict(getattr(self, "__dict__", {}))  # Subclasses without __slots__
+        for cls in type(self).__mro__:
+            for slot in cls.__dict__.get("__slots__", ()):
+                if slot != "__weakref__" and hasattr(self, slot):
+                    state[slot] = getattr(self, slot)
+        state["_listeners"] = ()  # Listeners are bound to the running process objects
+        return state
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            object.__setattr__(self, k, v)
+
     @abstractmethod
     def put(self, k, v):
         raise NotImplementedError()
@@ -40,6 +154,60 @@ class BaseStorage(): #TODO: add code to prevent instantiating several storages w
     def items(self):
         raise NotImplementedError()
 
+    def put_many(self, items):
+        """
+        Stores several values at once. items is a dictionary {k: v}
+        """
+        for k, v in items.items():
+            self.put(k, v)
+
+    def route(self, k):
+        """
+        Returns the simple storage that holds k and the name of k within it
+        """
+        return self, k
+
+    async def _run(self, func, *args):
+        if self.IO_BOUND:
+            import asyncio  # Not imported with the module, most configs never use the async API
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    async def _run_write(self, func, *args):
+        """
+        Like _run, but the listeners are always called from the calling (event loop) thread, after the write, so
+        they never run concurrently with the code of the event loop
+        """
+        if not self.IO_BOUND:
+            return func(*args)
+        import asyncio
+        events, error = await asyncio.to_thread(_run_deferring_events, func, *args)
+        for storage, event, k, v in events:
+            storage._notify(event, k, v)
+        if error is not None:
+            raise error
+
+    async def aget(self, k):
+        return await self._run(self.get, k)
+
+    async def aput(self, k, v):
+        await self._run_write(self.put, k, v)
+
+    async def aput_many(self, items):
+        await self._run_write(self.put_many, items)
+
+    async def adelete(self, k):
+        await self._run_write(self.delete, k)
+
+    async def acontains(self, k):
+        return await self._run(self.__contains__, k)
+
+    async def aitems(self):
+        """
+        Returns the list of (k, v) of the storage
+        """
+        return await self._run(lambda: list(self.items()))
+
     def keys(self):
         for k,v in self.items():
             yield k
@@ -54,17 +222,63 @@ class BaseStorage(): #TODO: add code to prevent instantiating several storages w
     def __str__(self):
         return str(dict(self.items()))
 
+class _WeakMethodListener():
+    """
+    Listener that calls a bound method through a weak reference. It is false once the object is collected, and
+    equal to the method, so remove_listener(method) removes it
+    """
+    __slots__ = ("_methodRef",)
+
+    def __init__(self, method):
+        self._methodRef = weakref.WeakMethod(method)
+
+    def __call__(self, event, k, v):
+        method = self._methodRef()
+        if method is not None:
+            method(event, k, v)
+
+    def __bool__(self):
+        return self._methodRef() is not None
+
+    def __eq__(self, other):
+        if isinstance(other, _WeakMethodListener):
+            return self._methodRef == other._methodRef
+        return self._methodRef() == other
+
+    def __hash__(self):
+        return hash(self._methodRef)
+
+
+def _run_deferring_events(func, *args):
+    """
+    Runs func, returning the events that the storages would have notified instead of notifying them, and the
+    exception raised by func, if any
+    """
+    _DEFERRED_EVENTS.events = events = []
+    try:
+        func(*args)
+    except Exception as e:
+        return events, e
+    finally:
+        _DEFERRED_EVENTS.events = None
+    return events, None
+
+
 class SimpleStorage(BaseStorage):
-    pass
+    __slots__ = ()
 
 class EnvVarsStorage(SimpleStorage):
+    __slots__ = ("envNamePrefix", "prefix_sep", "codec", "_cache")
 
-    def __init__(self, name, envNamePrefix=None, prefix_sep=PREFIX_ENV_SEP):
-
-        super().__init__(name)
+    def __init__(self, name, envNamePrefix=None, prefix_sep=PREFIX_ENV_SEP, codec=None):
+        """
+        :param codec: The JsonCodec (or its name) used to encode the values. None for the default one
+        """
         super().__init__(name)
         self.envNamePrefix = name if envNamePrefix is None else envNamePrefix
         self.prefix_sep = prefix_sep
+        self.codec = get_codec(codec)
+        self._cache = {}  # env_name -> (raw env value, decoded value). Prevents decoding the same value twice
 
     def param_to_env_name(self, paramname):
         return param_to_env_name(self.envNamePrefix, self.prefix_sep, paramname)
@@ -73,47 +287,248 @@ class EnvVarsStorage(SimpleStorage):
         return env_to_param_name(envparamname, self.prefix_sep)
 
     def keys(self):
-        for k,v in self.items():
-            yield k
+        envPrefix = self.envNamePrefix + self.prefix_sep
+        for k in list(os.environ.keys()):
+            if k.startswith(envPrefix):
+                yield self.env_to_param_name(k)
 
     def put(self, k, v):
-        k = self.param_to_env_name(k)
-        os.environ[k] = json.dumps(v)
+        if self._coercers:
+            v = self._coerce(k, v)
+        envName = self.param_to_env_name(k)
+        raw = self.codec.dumps(v)
+        os.environ[envName] = raw
+        self._cache[envName] = (raw, _copy_value(v))
+        if self._listeners:
+            self._notify("put", k, v)
+
+    def put_many(self, items):
+        if self._coercers:
+            items = {k: self._coerce(k, v) for k, v in items.items()}
+        env_items = {}
+        for k, v in items.items():
+            envName = self.param_to_env_name(k)
+            raw = self.codec.dumps(v)
+            env_items[envName] = raw
+            self._cache[envName] = (raw, _copy_value(v))
+        os.environ.update(env_items)
+        if self._listeners:
+            for k, v in items.items():
+                self._notify("put", k, v)
 
     def get(self, k):
+        return _copy_value(self.peek(k))
+
+    def peek(self, k):
         k = self.param_to_env_name(k)
-        return json.loads(os.environ[k])
+        raw = os.environ[k]
+        cached = self._cache.get(k)
+        if cached is not None and cached[0] == raw:  # The env var could have been modified externally
+            return cached[1]
+        v = self.codec.loads(raw)
+        if self._coercers:  # e.g. typed arrays, that are decoded in their exported form
+            v = self._coerce(self.env_to_param_name(k), v)
+        self._cache[k] = (raw, v)
+        return v
 
     def __contains__(self, k):
         k = self.param_to_env_name(k)
         return k in os.environ
 
     def delete(self, k):
-        k = self.param_to_env_name(k)
-        del os.environ[k]
+        envName = self.param_to_env_name(k)
+        self._cache.pop(envName, None)
+        del os.environ[envName]
+        if self._listeners:
+            self._notify("delete", k)
 
     def items(self):
-        for k in os.environ.keys():
-            if k.startswith(self.envNamePrefix):
-                k = self.env_to_param_name(k)
-                yield k, self.get(k)
+        for k in self.keys():
+            yield k, self.get(k)
 
     def __str__(self):
         return self.name + ":" + str(dict(self.items()))
 
-AVAILABLE_SIMPLE_STORAGES={"EnvVarsStorage":EnvVarsStorage}
+
+
+class DictStorage(SimpleStorage):
+    """
+    In-memory storage that never touches os.environ. It accepts the same arguments as EnvVarsStorage so that it
+    can be used as a drop-in fallbackStorage of MultiStorage
+    """
+    __slots__ = ("envNamePrefix", "prefix_sep", "codec", "_data")
+
+    def __init__(self, name, envNamePrefix=None, prefix_sep=PREFIX_ENV_SEP, codec=None):
+        super().__init__(name)
+        self.envNamePrefix = name if envNamePrefix is None else envNamePrefix
+        self.prefix_sep = prefix_sep
+        self.codec = get_codec(codec)  # Only used to export the values (e.g. ConfigBase.subprocess_env)
+        self._data = {}
+
+    def keys(self):
+        return iter(list(self._data.keys()))
+
+    def put(self, k, v):
+        if self._coercers:
+            v = self._coerce(k, v)
+        self._data[k] = _copy_value(v)
+        if self._listeners:
+            self._notify("put", k, v)
+
+    def put_many(self, items):
+        if self._coercers:
+            items = {k: self._coerce(k, v) for k, v in items.items()}
+        self._data.update({k: _copy_value(v) for k, v in items.items()})
+        if self._listeners:
+            for k, v in items.items():
+                self._notify("put", k, v)
+
+    def get(self, k):
+        return _copy_value(self._data[k])
+
+    def peek(self, k):
+        return self._data[k]
+
+    def __contains__(self, k):
+        return k in self._data
+
+    def delete(self, k):
+        del self._data[k]
+        if self._listeners:
+            self._notify("delete", k)
+
+    def items(self):
+        for k, v in list(self._data.items()):
+            yield k, _copy_value(v)
+
+    def __str__(self):
+        return self.name + ":" + str(dict(self.items()))
+
+class OverlayStorage(BaseStorage):
+    """
+    Copy-on-write view over another storage. Reads fall through to baseStorage unless the key has been overridden,
+    and writes only go to a private dictionary of overrides, so baseStorage is never modified nor copied.
+    Deleting an overridden key reverts it to the value of baseStorage
+    """
+    __slots__ = ("baseStorage", "_overrides")
+
+    def __init__(self, name, baseStorage:BaseStorage, overrides:Optional[Dict]=None):
+        super().__init__(name)
+        self.baseStorage = baseStorage
+        self._overrides = DictStorage(name)
+        if overrides:
+            self._overrides.put_many({k: baseStorage.coerce(k, v) for k, v in overrides.items()})
+        self._forward_events_from(self._overrides)
+        self._forward_events_from(baseStorage)
+
+    def _on_nested_event(self, storage, prefix, event, k, v):
+        if storage is self.baseStorage and k in self._overrides:
+            return  # The change is hidden by the override
+        super()._on_nested_event(storage, prefix, event, k, v)
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._forward_events_from(self._overrides)
+        self._forward_events_from(self.baseStorage)
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def overrides(self):
+        return dict(self._overrides.items())
+
+    def is_overridden(self, k):
+        return k in self._overrides
+
+    def put(self, k, v):
+        self._overrides.put(k, self.baseStorage.coerce(k, v))
+
+    def put_many(self, items):
+        self._overrides.put_many({k: self.baseStorage.coerce(k, v) for k, v in items.items()})
+
+    def coerce(self, k, v):
+        return self.baseStorage.coerce(k, v)
+
+    def get(self, k):
+        if k in self._overrides:
+            return self._overrides.get(k)
+        return self.baseStorage.get(k)
+
+    def peek(self, k):
+        if k in self._overrides:
+            return self._overrides.peek(k)
+        return self.baseStorage.peek(k)
+
+    def __contains__(self, k):
+        return k in self._overrides or k in self.baseStorage
+
+    def delete(self, k):
+        self._overrides.delete(k)
+
+    async def aget(self, k):
+        if k in self._overrides:
+            return self._overrides.get(k)
+        return await self.baseStorage.aget(k)
+
+    async def acontains(self, k):
+        return k in self._overrides or await self.baseStorage.acontains(k)
+
+    async def aitems(self):
+        items = dict(await self.baseStorage.aitems())
+        items.update(self._overrides.items())
+        return list(items.items())
+
+    def keys(self):
+        for k in self.baseStorage.keys():
+            yield k
+        for k in self._overrides.keys():
+            if k not in self.baseStorage:
+                yield k
+
+    def items(self):
+        for k, v in self.baseStorage.items():
+            if k in self._overrides:
+                v = self._overrides.get(k)
+            yield k, v
+        for k, v in self._overrides.items():
+            if k not in self.baseStorage:
+                yield k, v
+
+AVAILABLE_SIMPLE_STORAGES={"EnvVarsStorage":EnvVarsStorage, "DictStorage":DictStorage}
+# Storages defined in modules that need this one (and the socket stack), imported on first use
+_LAZY_SIMPLE_STORAGES = {"RemoteKVStorage": "configfile.kvstorage", "SocketStorage": "configfile.daemon"}
+
+
+def _simple_storage_class(name):
+    if name not in AVAILABLE_SIMPLE_STORAGES and name in _LAZY_SIMPLE_STORAGES:
+        AVAILABLE_SIMPLE_STORAGES[name] = getattr(importlib.import_module(_LAZY_SIMPLE_STORAGES[name]), name)
+    return AVAILABLE_SIMPLE_STORAGES[name]
+
+
+def __getattr__(name):
+    if name in _LAZY_SIMPLE_STORAGES:
+        return _simple_storage_class(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class MultiStorage(BaseStorage):
+    __slots__ = ("fallbackStorageClassName", "fallbackStorageKwargs", "fallbackStorage", "storages", "_forwarders")
+
     def __init__(self, name:str,
                  fallbackStorageClassName:str= DEFAULT_SIMPLE_STORAGENAME, fallbackStorageKwargs={},
                  extraStorages:Optional[List[BaseStorage]]=None):
 
         super().__init__(name)
 
-        self.fallbackStorage = AVAILABLE_SIMPLE_STORAGES[fallbackStorageClassName](name=name, **fallbackStorageKwargs)
+        self.fallbackStorageClassName = fallbackStorageClassName
+        self.fallbackStorageKwargs = fallbackStorageKwargs
+        self.fallbackStorage = _simple_storage_class(fallbackStorageClassName)(name=name, **fallbackStorageKwargs)
 
         self.storages = {}
+        self._forwarders = {}
+        self._forward_events_from(self.fallbackStorage)
         if extraStorages:
             for storage in extraStorages:
                 self.addStorage(storage)
@@ -130,11 +545,51 @@ class MultiStorage(BaseStorage):
 
     def addStorage(self, storage):
         #TODO: assert recursevely that the same config object is not present twice or more
+        if storage.name in self._forwarders:
+            self.storages[storage.name].remove_listener(self._forwarders.pop(storage.name))
         self.storages[storage.name] = storage
+        self._forwarders[storage.name] = self._forward_events_from(storage, storage.name + NESTED_SEPARATOR)
 
     def removeStorage(self, storageName):
+        self.storages[storageName].remove_listener(self._forwarders.pop(storageName))
         del self.storages[storageName]
 
+    def __getstate__(self):
+        state = super().__getstate__()
+        del state["_forwarders"]
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._forwarders = {}
+        self._forward_events_from(self.fallbackStorage)
+        for storage in self.storages.values():
+            self._forwarders[storage.name] = self._forward_events_from(storage, storage.name + NESTED_SEPARATOR)
+
+    def isolated_copy(self, fallbackStorageClassName:str="DictStorage"):
+        """
+        Returns a snapshot of this MultiStorage (and of all its nested storages) in which every simple storage has
+        been replaced by a fallbackStorageClassName one, so writes to the copy never reach the original storages
+        (e.g. os.environ for EnvVarsStorage)
+        """
+        fallbackStorageKwargs = dict(self.fallbackStorageKwargs)
+        newStorage = MultiStorage(self.name, fallbackStorageClassName=fallbackStorageClassName,
+                                  fallbackStorageKwargs=fallbackStorageKwargs)
+        newStorage.fallbackStorage._coercers = dict(self.fallbackStorage._coercers)
+        for k, v in self.fallbackStorage.items():
+            newStorage.fallbackStorage.put(k, v)
+        for nestedStorage in self.storages.values():
+            if isinstance(nestedStorage, MultiStorage):
+                newStorage.addStorage(nestedStorage.isolated_copy(fallbackStorageClassName))
+            else:
+                simpleStorage = _simple_storage_class(fallbackStorageClassName)(
+                    name=nestedStorage.name, envNamePrefix=getattr(nestedStorage, "envNamePrefix", None))
+                simpleStorage._coercers = dict(nestedStorage._coercers)
+                for k, v in nestedStorage.items():
+                    simpleStorage.put(k, v)
+                newStorage.addStorage(simpleStorage)
+        return newStorage
+
     @property
     def name(self):
         return self._name
@@ -142,7 +597,7 @@ class MultiStorage(BaseStorage):
     def recursive_traversal(self, storage):
 
         if not isinstance(storage, MultiStorage):
-            return [("", storage)]
+            return [(storage.name+NESTED_SEPARATOR, storage)]
         else:
             storages = [(storage.name+NESTED_SEPARATOR, storage.fallbackStorage)]
             for nestedStorage in storage.storages.values():
@@ -152,8 +607,9 @@ class MultiStorage(BaseStorage):
             return storages
 
     def keys(self):
-        for k,v in self.items():
-            yield k
+        for prefix, storage in self._iter_prefix_storage():
+            for storageKey in storage.keys():
+                yield prefix + storageKey
 
     def _match_storage_by_varname(self, key):
 
@@ -162,6 +618,10 @@ class MultiStorage(BaseStorage):
         # raise AttributeError(f"Error, attribute {k} was not found in any storage")
         return storage, storageKey
 
+    def route(self, k):
+        storage, storageKey = self._match_storage_by_varname(k)
+        return storage.route(storageKey)
+
     def _getStorage(self, storageNames:List[str]):
 
         storageNames = list(reversed((storageNames)))
@@ -183,13 +643,72 @@ class MultiStorage(BaseStorage):
         storage, storageKey = self._match_storage_by_varname(k)
         return storage.get(storageKey)
 
+    def peek(self, k):
+        storage, storageKey = self._match_storage_by_varname(k)
+        return storage.peek(storageKey)
+
+    def put_many(self, items):
+        """
+        Stores several values at once, with a single put_many call per nested simple storage
+        """
+        storage_2_items = {}
+        for k, v in items.items():
+            storage, storageKey = self._match_storage_by_varname(k)
+            storage_2_items.setdefault(id(storage), (storage, {}))[1][storageKey] = v
+        for storage, storageItems in storage_2_items.values():
+            storage.put_many(storageItems)
+
     def __contains__(self, k):
-        return k in self.keys()
+        try:
+            storage, storageKey = self._match_storage_by_varname(k)
+        except KeyError:
+            return False
+        return storageKey in storage
 
     def delete(self, k):
         storage, storageKey = self._match_storage_by_varname(k)
         storage.delete(storageKey)
 
+    async def aget(self, k):
+        storage, storageKey = self._match_storage_by_varname(k)
+        return await storage.aget(storageKey)
+
+    async def aput(self, k, v):
+        storage, storageKey = self._match_storage_by_varname(k)
+        await storage.aput(storageKey, v)
+
+    async def aput_many(self, items):
+        """
+        Async put_many. The writes to the different nested simple storages are done concurrently
+        """
+        storage_2_items = {}
+        for k, v in items.items():
+            storage, storageKey = self._match_storage_by_varname(k)
+            storage_2_items.setdefault(id(storage), (storage, {}))[1][storageKey] = v
+        import asyncio
+        await asyncio.gather(*[storage.aput_many(storageItems) for storage, storageItems in storage_2_items.values()])
+
+    async def adelete(self, k):
+        storage, storageKey = self._match_storage_by_varname(k)
+        await storage.adelete(storageKey)
+
+    async def acontains(self, k):
+        try:
+            storage, storageKey = self._match_storage_by_varname(k)
+        except KeyError:
+            return False
+        return await storage.acontains(storageKey)
+
+    async def aitems(self):
+        """
+        Async items, that reads all the nested simple storages concurrently
+        """
+        import asyncio
+        prefix_storages = list(self._iter_prefix_storage())
+        results = await asyncio.gather(*[storage.aitems() for _, storage in prefix_storages])
+        return [(prefix + storageKey, v) for (prefix, _), storageItems in zip(prefix_storages, results)
+                for storageKey, v in storageItems]
+
     def _iter_prefix_storage(self):
         yield "", self.fallbackStorage
         for primaryStorage in self.storages.values():
@@ -202,12 +721,72 @@ class MultiStorage(BaseStorage):
         for prefix, storage in self._iter_prefix_storage():
             if not isinstance(storage, MultiStorage):
                 for storageKey, v in storage.items():
-                    v = storage.get(storageKey)
                     key = prefix + storageKey #self._storage2MultiVarname(storageKey, storage)
                     yield key, v
 
+    def tree(self):
+        """
+        Returns the parameters as nested dictionaries, one per nested storage
+        """
+        tree = dict(self.fallbackStorage.items())
+        for name, storage in self.storages.items():
+            tree[name] = storage.tree() if isinstance(storage, MultiStorage) else dict(storage.items())
+        return tree
+
     def __str__(self):
         rep = super().__str__()
         if hasattr(self, "_name"):
             rep = self.name + ":" + rep
-        return rep
\ No newline at end of file
+        return rep
+
+
+class DictTreeStorage(MultiStorage):
+    """
+    MultiStorage made of in-memory DictStorages only, i.e. a tree of dictionaries with one node per nested config,
+    that never touches os.environ. Keys (e.g. "model__encoder__lr") are resolved with an index from the flat stored
+    keys to the simple storage that holds them, instead of being split and looked up level by level on every access.
+    The index is rebuilt when storages are added to or removed from this one, so nested storages should not change
+    their own structure once they have been added
+    """
+    __slots__ = ("_index",)
+
+    def __init__(self, name:str, fallbackStorageKwargs={}, extraStorages:Optional[List[BaseStorage]]=None):
+        self._index = {}  # flat key -> (simple storage, key within it)
+        super().__init__(name, fallbackStorageClassName="DictStorage", fallbackStorageKwargs=fallbackStorageKwargs,
+                         extraStorages=extraStorages)
+
+    def addStorage(self, storage):
+        super().addStorage(storage)
+        self._index = {}
+
+    def removeStorage(self, storageName):
+        super().removeStorage(storageName)
+        self._index = {}
+
+    def build_index(self):
+        """
+        Indexes all the keys stored so far. Keys not indexed yet are indexed on their first access
+        """
+        for k in self.keys():
+            self._match_storage_by_varname(k)
+
+    def _match_storage_by_varname(self, key):
+        try:
+            return self._index[key]
+        except KeyError:
+            pass
+        storage, storageKey = super()._match_storage_by_varname(key)
+        if storage is not self.fallbackStorage:
+            storage, storageKey = storage.route(storageKey)
+        if storageKey in storage:  # Missing keys are not indexed, so that the index only grows with the stored keys
+            self._index[key] = (storage, storageKey)
+        return storage, storageKey
+
+    def _on_nested_event(self, storage, prefix, event, k, v):
+        if event == "delete":
+            self._index.pop(prefix + k, None)
+        super()._on_nested_event(storage, prefix, event, k, v)
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._index = {}
@@ -0,0 +1,96 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+
+from configfile.constants import TRACE_STARTUP_ENVVARNAME
+
+_ACTIVE_TRACE = contextvars.ContextVar("configfile_active_trace", default=None)
+
+
+def startup_tracing_from_env():
+    return os.environ.get(TRACE_STARTUP_ENVVARNAME, "").lower() not in ("", "0", "false", "no")
+
+
+class StartupTrace():
+    """
+    Records the wall time of the phases of the construction of a config. Configs built while another one is being
+    traced (e.g. nested configs built within set_parameters) are recorded as its children
+    """
+
+    def __init__(self, config_name):
+        self.config_name = config_name
+        self.start = None
+        self.duration = None
+        self.phases = []  # (phase_name, start, duration)
+        self.children = []
+        self.pid = os.getpid()
+        self.tid = threading.get_ident()
+        self._token = None
+
+    def __enter__(self):
+        parent = _ACTIVE_TRACE.get()
+        if parent is not None:
+            parent.children.append(self)
+        self._token = _ACTIVE_TRACE.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.duration = time.perf_counter() - self.start
+        _ACTIVE_TRACE.reset(self._token)
+        self._token = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, start, time.perf_counter() - start))
+
+    def as_dict(self):
+        """
+        :return: {"config": name, "total": seconds, "phases": {phase_name: seconds}, "children": [child_dicts]}
+        """
+        phases = {}
+        for name, _, duration in self.phases:
+            phases[name] = phases.get(name, 0.) + duration
+        return {"config": self.config_name, "total": self.duration, "phases": phases,
+                "children": [child.as_dict() for child in self.children]}
+
+    def _chrome_trace_events(self):
+        common = {"ph": "X", "pid": self.pid, "tid": self.tid}
+        events = [dict(name=self.config_name, cat="config", ts=self.start * 1e6, dur=self.duration * 1e6, **common)]
+        for name, start, duration in self.phases:
+            events.append(dict(name=name, cat="phase", ts=start * 1e6, dur=duration * 1e6,
+                               args={"config": self.config_name}, **common))
+        for child in self.children:
+            events += child._chrome_trace_events()
+        return events
+
+    def to_chrome_trace(self):
+        """
+        :return: The trace as a Chrome trace-event document, that can be opened with Perfetto or chrome://tracing
+        """
+        return {"traceEvents": self._chrome_trace_events(), "displayTimeUnit": "ms"}
+
+    def dump_chrome_trace(self, fname):
+        with open(fname, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+
+class NullTrace():
+    """
+    Drop-in replacement of StartupTrace used when tracing is disabled
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def phase(self, name):
+        return contextlib.nullcontext()
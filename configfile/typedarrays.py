@@ -0,0 +1,52 @@
+"""
+Support for List[int] and List[float] parameters stored as array.array (see ConfigBase.TYPED_ARRAYS). Arrays
+expose the buffer protocol, so they can be consumed without copies (e.g. numpy.frombuffer(conf.param_buffer(k))),
+and they are exported as {"__array__": typecode, "b64": base64 of the little-endian items}, which is much more
+compact than a json list of numbers. Decoding does not turn these mappings back into arrays by itself (any dict
+could have an "__array__" key): the storages convert them with the coercers of the typed parameters.
+"""
+import array
+import base64
+import sys
+
+ARRAY_TYPECODES = {int: "q", float: "d"}
+ARRAY_MARKER = "__array__"
+
+
+def array_to_json(a):
+    if sys.byteorder != "little":
+        a = a[:]
+        a.byteswap()
+    return {ARRAY_MARKER: a.typecode, "b64": base64.b64encode(a.tobytes()).decode("ascii")}
+
+
+def json_to_array(d):
+    a = array.array(d[ARRAY_MARKER])
+    a.frombytes(base64.b64decode(d["b64"]))
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a
+
+
+def json_default(v):
+    """
+    default hook of the json encoders
+    """
+    if isinstance(v, array.array):
+        return array_to_json(v)
+    raise TypeError(f"Object of type {type(v).__name__} is not JSON serializable")
+
+
+def to_typed_array(v, typecode):
+    """
+    Converts v, a sequence of numbers (or its exported form), into a new array.array of the given typecode, in bulk
+    """
+    if v is None:
+        return None
+    if isinstance(v, dict) and ARRAY_MARKER in v:
+        v = json_to_array(v)
+        if v.typecode == typecode:
+            return v
+    if isinstance(v, array.array) and v.typecode == typecode:
+        return v[:]
+    return array.array(typecode, v)
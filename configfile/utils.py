@@ -1,20 +1,31 @@
 import argparse
+import array
 import collections
+import contextvars
 import functools
-import json
 import re
+import sys
 from abc import ABCMeta
 import inspect
 import ast
+import bisect
+import linecache
 
 from configfile.constants import ALLOWED_TYPES, ALLOWED_TYPE_NAMES, VALID_ANNOTATION_LIST_REGEX_PATT
+from configfile.envVarUtils import get_default_codec
+from configfile.registry import ConfigRegistry
+from configfile.typedarrays import ARRAY_TYPECODES
 
-def flatDict(d, parent_key='', sep='__'):
+def flatDict(d, parent_key='', sep='__', leaf_keys=None):
+    """
+    Flattens a nested dictionary joining the keys with sep. Dictionaries stored under any of the (flattened) keys
+    in leaf_keys are kept as values instead of being flattened
+    """
     items = []
     for k, v in d.items():
         new_key = parent_key + sep + k if parent_key else k
-        if isinstance(v, collections.abc.MutableMapping):
-            items.extend(flatDict(v, new_key, sep=sep).items())
+        if isinstance(v, collections.abc.MutableMapping) and (leaf_keys is None or new_key not in leaf_keys):
+            items.extend(flatDict(v, new_key, sep=sep, leaf_keys=leaf_keys).items())
         else:
             items.append((new_key, v))
     return dict(items)
@@ -39,6 +50,10 @@ class Singleton(type):
             cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
         return cls._instances[cls]
 
+# True while an isolated config runs its set_parameters, so that the configs built within it are isolated too
+ISOLATED_BUILD = contextvars.ContextVar("configfile_isolated_build", default=False)
+
+
 class AbstractSingleton(ABCMeta):
     """
     Metaclass to prevent several instances of the class Config
@@ -46,10 +61,32 @@ class AbstractSingleton(ABCMeta):
     _instances = {}
 
     def __call__(cls, *args, **kwargs):
+        if ISOLATED_BUILD.get():  # Nested configs of an isolated config never become (or reuse) the singleton
+            return cls._create_unregistered(*args, **kwargs)
         if cls not in cls._instances:
             cls._instances[cls] = super(AbstractSingleton, cls).__call__(*args, **kwargs)
         return cls._instances[cls]
 
+    def _create_unregistered(cls, *args, **kwargs):
+        """
+        Builds a new instance of the class without registering it (or returning the registered one) in _instances
+        """
+        return super(AbstractSingleton, cls).__call__(*args, **kwargs)
+
+    def release(cls):
+        """
+        Unregisters the singleton instance of the class, if any, so it can be garbage collected once it is not
+        used anymore. The next call to the class builds a new one
+        """
+        return cls._instances.pop(cls, None)
+
+    def registry(cls, max_instances=None, ttl=None, factory=None):
+        """
+        Returns a new ConfigRegistry of (non singleton) instances of the class, bounded to max_instances and/or
+        to instances accessed within the last ttl seconds. See ConfigRegistry
+        """
+        return ConfigRegistry(cls, max_instances=max_instances, ttl=ttl, factory=factory)
+
 
 class AnnotationsCollector(ast.NodeVisitor):
     """Collects AnnAssign nodes for 'simple' annotation assignments"""
@@ -123,16 +160,98 @@ class AnnotationsCollector(ast.NodeVisitor):
             self.annotations[node.target.attr] = self.get_anno(node.annotation)
 
 
-def get_annotations_from_function(func):
+class AnnotationTable(collections.abc.Mapping):
+    """
+    Read-only, columnar version of a {param_name: {"dtype", "isList", "isDict"} or None} mapping of annotations.
+    The (interned) names are kept sorted, so the id of a name is found by bisection, and the rest of the columns are
+    arrays of one byte per parameter indexed by that id. The dictionaries are built when they are accessed
+    """
+    __slots__ = ("_names", "_dtypes", "_flags")
+    _IS_LIST, _IS_DICT = 1, 2
+
+    def __init__(self, annotations):
+        self._names = tuple(sorted(sys.intern(name) for name in annotations))
+        self._dtypes = array.array("b")  # index of the dtype in ALLOWED_TYPES, -1 for params without annotation
+        self._flags = array.array("B")
+        for name in self._names:
+            annotation = annotations[name]
+            if annotation is None:
+                self._dtypes.append(-1)
+                self._flags.append(0)
+            else:
+                self._dtypes.append(ALLOWED_TYPES.index(annotation["dtype"]))
+                self._flags.append(self._IS_LIST * bool(annotation["isList"]) +
+                                   self._IS_DICT * bool(annotation.get("isDict")))
+
+    def _id(self, name):
+        i = bisect.bisect_left(self._names, name)
+        if i == len(self._names) or self._names[i] != name:
+            raise KeyError(name)
+        return i
+
+    def __getitem__(self, name):
+        i = self._id(name)
+        dtype = self._dtypes[i]
+        if dtype < 0:
+            return None
+        flags = self._flags[i]
+        return {"dtype": ALLOWED_TYPES[dtype], "isList": bool(flags & self._IS_LIST),
+                "isDict": bool(flags & self._IS_DICT)}
+
+    def __contains__(self, name):
+        try:
+            self._id(name)
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __getstate__(self):
+        return self._names, self._dtypes, self._flags
+
+    def __setstate__(self, state):
+        self._names, self._dtypes, self._flags = state
+
+
+_annotations_cache = {}
+_annotation_tables_cache = {}
+
+def get_annotations_from_function(func, compact=False):
     """Return a mapping of name to string annotations for function locals
 
     Python does not retain PEP 526 "variable: annotation" variable annotations
     within a function body, as local variables do not have a lifetime beyond
     the local namespace. This function extracts the mapping from functions that
-    have source code available.
+    have source code available. Results are cached per code object.
 
+    If compact, the shared (read-only) AnnotationTable of the annotations is returned instead.
+    """
+    code = getattr(func, "__code__", None)
+    cache = _annotation_tables_cache if compact else _annotations_cache
+    if code is not None and code in cache:
+        return cache[code] if compact else dict(cache[code])
+    annota = _get_annotations_from_source(func, keep_source_lines=not compact)
+    if compact:
+        annota = AnnotationTable(annota)
+    if code is not None:
+        cache[code] = annota
+    return annota if compact else dict(annota)
+
+def _get_annotations_from_source(func, keep_source_lines=True):
+    """
+    :param keep_source_lines: If False, the lines of the source file are not left in linecache (where
+                              inspect.getsource puts them), unless they were already there
     """
+    filename = None if keep_source_lines else inspect.getsourcefile(func)
+    cached = filename in linecache.cache
     source = inspect.getsource(func)
+    if filename is not None and not cached:
+        linecache.cache.pop(filename, None)
     sourceLines = source.split("\n")
     n_spaces = len(sourceLines[0]) - len(sourceLines[0].lstrip())
     sourceLines = [x[n_spaces:] for x in sourceLines]
@@ -163,23 +282,41 @@ def get_annotations_from_value(value): #TODO: Add homogeneus dictionary compabil
 
     return {"dtype": content, "isList": isList}
 
+_BOOL_STRINGS = {"true": True, "false": False, "1": True, "0": False}
+
+def parse_bool(token):
+    """
+    Converts "true"/"false" (in any case) or "1"/"0" to bool. bool(token) would be True for any non-empty string
+    """
+    try:
+        return _BOOL_STRINGS[token.lower()]
+    except KeyError:
+        raise ValueError(f"Error, invalid bool value {token!r}. Use true or false")
+
 @functools.lru_cache
-def typeBuilder(dtype, isList, isInputStr=True):
+def typeBuilder(dtype, isList, isInputStr=True, typedArray=False):
+    """
+    Returns a function that converts an input (a string if isInputStr) to dtype or, if isList, to a list of dtype.
+    Lists are converted in bulk, and built as array.array if typedArray and dtype is int or float
+    """
     if not isList:
         return dtype
     else:
         if isInputStr:
-            prepro = lambda x: ast.literal_eval(x)
+            prepro = ast.literal_eval
         else:
             prepro = lambda x: x
-        return lambda val: [typeBuilder(dtype, isList=False)(x) for x in prepro(val)] if val is not None else None
+        if typedArray and dtype in ARRAY_TYPECODES:
+            typecode = ARRAY_TYPECODES[dtype]
+            return lambda val: array.array(typecode, map(dtype, prepro(val))) if val is not None else None
+        return lambda val: list(map(dtype, prepro(val))) if val is not None else None
 
 
 
 class ParseJsonAction(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
         try:
-            setattr(namespace, self.dest, json.loads(values))
+            setattr(namespace, self.dest, get_default_codec().loads(values))
         except ValueError as e:
             raise argparse.ArgumentError(self, f"Invalid JSON string: {e}")
 
@@ -0,0 +1,84 @@
+import collections.abc
+
+from configfile.exceptions import ConfigErrorParamNotDefined, ConfigErrorParamTypeMismatch
+from configfile.storages import OverlayStorage
+
+
+class ConfigSubtree(collections.abc.Mapping):
+    """
+    Live view over the parameters of a nested config (a namespace such as "model" or "model__encoder"), with keys
+    relative to it. Reads and writes are routed directly to the storage of the namespace, so the rest of the config
+    is never decoded. Obtain it with ConfigBase.subtree
+    """
+
+    def __init__(self, config, namespace: str):
+        sep = config.NESTED_SEPARATOR
+        root = config._storage
+        base = root
+        while isinstance(base, OverlayStorage):
+            base = base.baseStorage
+        try:
+            nested = base._getStorage(namespace.split(sep) if namespace else [])
+        except KeyError:
+            raise ConfigErrorParamNotDefined(f"Error, {namespace} is not a nested config of {config.name}")
+        object.__setattr__(self, "_config", config)
+        object.__setattr__(self, "_namespace", namespace)
+        object.__setattr__(self, "_prefix", namespace + sep if namespace else "")
+        object.__setattr__(self, "_nested", nested)
+        # Derived configs keep their overrides in an OverlayStorage, so their reads need to go through it
+        object.__setattr__(self, "_root", root if root is not base else None)
+
+    @property
+    def namespace(self):
+        return self._namespace
+
+    def __getitem__(self, k):
+        try:
+            if self._root is None:
+                return self._nested.get(k)
+            return self._root.get(self._prefix + k)
+        except KeyError:
+            raise ConfigErrorParamNotDefined(f"Error, argument {k} was not defined in {self._namespace}")
+
+    def __getattr__(self, k):
+        if k.startswith("_"):
+            raise AttributeError(k)
+        return self[k]
+
+    def __setitem__(self, k, v):
+        self.update({k: v})
+
+    def __setattr__(self, k, v):
+        self.update({k: v})
+
+    def __iter__(self):
+        return iter(self._nested.keys())
+
+    def __len__(self):
+        return sum(1 for _ in self._nested.keys())
+
+    def __contains__(self, k):
+        return k in self._nested
+
+    def items(self):
+        if self._root is None:
+            return self._nested.items()
+        return ((k, self[k]) for k in self._nested.keys())
+
+    def update(self, params_dict):
+        """
+        Writes several parameters of the namespace at once, with keys relative to it
+        """
+        for k in params_dict:
+            if k not in self._nested:
+                raise ConfigErrorParamTypeMismatch(f"Error, {k} parameter is not defined in {self._namespace}")
+        if self._root is None:
+            self._nested.put_many(params_dict)
+        else:
+            self._root.put_many({self._prefix + k: v for k, v in params_dict.items()})
+
+    def subtree(self, namespace: str) -> "ConfigSubtree":
+        return ConfigSubtree(self._config, self._prefix + namespace)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self._namespace!r}, {dict(self.items())})"
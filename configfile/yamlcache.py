@@ -0,0 +1,83 @@
+import collections
+import os
+import pickle
+import threading
+
+import yaml
+
+try:
+    _YamlLoader = yaml.CSafeLoader
+except AttributeError:  # PyYAML built without libyaml
+    _YamlLoader = yaml.SafeLoader
+
+_DISK_CACHE_VERSION = 1
+MAX_CACHED_YAMLS = 128  # The least recently used documents are dropped beyond it
+_PARSED_YAMLS = collections.OrderedDict()  # absolute path -> ((mtime_ns, size), parsed document), by last use
+_PARSED_YAMLS_LOCK = threading.Lock()
+
+
+def _disk_cache_path(path):
+    dirname, basename = os.path.split(path)
+    return os.path.join(dirname, "." + basename + ".configfile.pickle")
+
+
+def _read_disk_cache(path, stamp):
+    try:
+        with open(_disk_cache_path(path), "rb") as f:
+            version, cached_stamp, data = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+        return None
+    if version != _DISK_CACHE_VERSION or cached_stamp != stamp:
+        return None
+    return data
+
+
+def _write_disk_cache(path, stamp, data):
+    cache_path = _disk_cache_path(path)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump((_DISK_CACHE_VERSION, stamp, data), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)  # Atomic, so concurrent readers never see a partial file
+    except OSError:  # e.g. read-only directories. The cache is only an optimization
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def load_yaml(path, disk_cache=False):
+    """
+    Returns the parsed contents of the yaml file path. The last MAX_CACHED_YAMLS documents used are cached in memory,
+    keyed on the path and its modification time and size, so loading an unchanged file again skips the parsing. The
+    returned document is shared between callers and must not be modified.
+
+    :param disk_cache: If True, the parsed document is also pickled next to the file (as .<name>.configfile.pickle),
+                       so other processes can skip the parsing too. Only enable it for directories whose writers are
+                       trusted, since the pickle is loaded as is
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    with _PARSED_YAMLS_LOCK:
+        cached = _PARSED_YAMLS.get(path)
+        if cached is not None and cached[0] == stamp:
+            _PARSED_YAMLS.move_to_end(path)
+            return cached[1]
+    data = _read_disk_cache(path, stamp) if disk_cache else None
+    if data is None:
+        with open(path, "r") as f:
+            data = yaml.load(f, Loader=_YamlLoader)
+        if disk_cache:
+            _write_disk_cache(path, stamp, data)
+    with _PARSED_YAMLS_LOCK:
+        _PARSED_YAMLS[path] = (stamp, data)
+        _PARSED_YAMLS.move_to_end(path)
+        while len(_PARSED_YAMLS) > MAX_CACHED_YAMLS:
+            _PARSED_YAMLS.popitem(last=False)
+    return data
+
+
+def clear_yaml_cache():
+    with _PARSED_YAMLS_LOCK:
+        _PARSED_YAMLS.clear()
@@ -34,6 +34,7 @@ setup(name='configfile',
       license='MIT',
       packages=setuptools.find_packages(),
       install_requires=install_requires,
+      python_requires=">=3.9",  # asyncio.to_thread
       dependency_links=[],
       include_package_data=True,
       zip_safe=False)
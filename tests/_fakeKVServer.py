@@ -0,0 +1,145 @@
+import re
+import socketserver
+import threading
+
+
+def _glob_to_regex(pattern):
+    out, i = [], 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\" and i + 1 < len(pattern):
+            i += 1
+            out.append(re.escape(pattern[i]))
+        elif c == "*":
+            out.append(".*")
+        elif c == "?":
+            out.append(".")
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return re.compile("".join(out) + r"\Z", re.DOTALL)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        assert line[:1] == b"*", line
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2].decode("utf-8"))
+        return args
+
+    @staticmethod
+    def _encode(reply):
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, int):
+            return b":%d\r\n" % reply
+        if isinstance(reply, list):
+            return b"*%d\r\n" % len(reply) + b"".join(_Handler._encode(x) for x in reply)
+        data = reply.encode("utf-8")
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    def handle(self):
+        server = self.server
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            command, args = args[0].upper(), args[1:]
+            with server.lock:
+                server.commands.append(command)
+                method = getattr(self, "cmd_" + command, None)
+                if method is None:
+                    out = b"-ERR unknown command '%s'\r\n" % command.encode()
+                else:
+                    out = method(server.data, *args)
+                    out = out if isinstance(out, bytes) else self._encode(out)
+            self.wfile.write(out)
+
+    def cmd_PING(self, data):
+        return b"+PONG\r\n"
+
+    def cmd_SELECT(self, data, db):
+        return b"+OK\r\n"
+
+    def cmd_GET(self, data, k):
+        return data.get(k)
+
+    def cmd_SET(self, data, k, v):
+        data[k] = v
+        return b"+OK\r\n"
+
+    def cmd_MSET(self, data, *args):
+        for k, v in zip(args[::2], args[1::2]):
+            data[k] = v
+        return b"+OK\r\n"
+
+    def cmd_MGET(self, data, *keys):
+        return [data.get(k) for k in keys]
+
+    def cmd_EXISTS(self, data, *keys):
+        return sum(k in data for k in keys)
+
+    def cmd_DEL(self, data, *keys):
+        return sum(data.pop(k, None) is not None for k in keys)
+
+    def cmd_SCAN(self, data, cursor, *options):
+        options = dict(zip(options[::2], options[1::2]))
+        regex = _glob_to_regex(options.get("MATCH", "*"))
+        count = int(options.get("COUNT", 10))
+        keys = sorted(k for k in data if regex.match(k))
+        start = int(cursor)
+        # As real servers may do, scan_duplicates makes pages repeat the last key of the previous one
+        page = keys[max(0, start - self.server.scan_duplicates):start + count]
+        next_cursor = start + count if start + count < len(keys) else 0
+        return [str(next_cursor), page]
+
+    def cmd_SUBSCRIBE(self, data, channel):
+        self.server.subscribers.setdefault(channel, []).append(self.wfile)
+        return ["subscribe", channel, 1]
+
+    def cmd_PUBLISH(self, data, channel, message):
+        receivers = 0
+        for wfile in list(self.server.subscribers.get(channel, [])):
+            try:
+                wfile.write(self._encode(["message", channel, message]))
+                receivers += 1
+            except OSError:
+                self.server.subscribers[channel].remove(wfile)
+        return receivers
+
+
+class FakeKVServer(socketserver.ThreadingTCPServer):
+    """
+    In-process server that implements the subset of the Redis protocol used by RemoteKVStorage (including
+    SUBSCRIBE/PUBLISH). The commands it receives are recorded in commands
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.data = {}
+        self.commands = []
+        self.subscribers = {}  # channel -> wfiles of the subscribed connections
+        self.scan_duplicates = 0
+        self.lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f"redis://{host}:{port}/0"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,112 @@
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import List
+from unittest import TestCase
+
+from configfile.changelog import ChangeLog, change_source, iter_records, replay
+from configfile.configbase import ConfigBase
+from configfile.storages import DictStorage
+
+
+class ChangeLogConfig(ConfigBase):
+    def set_parameters(self):
+        self.batchSize: int = 8
+        self.layers: List[int] = [1, 2]
+
+
+def _wait_for(condition, timeout=5.):
+    start = time.time()
+    while not condition():
+        if time.time() - start > timeout:
+            raise AssertionError("Timeout waiting for the change log")
+        time.sleep(0.01)
+
+
+_EXIT_SCRIPT = """
+import sys
+from configfile.changelog import ChangeLog
+from configfile.storages import DictStorage
+storage = DictStorage("changelogExit")
+ChangeLog(sys.argv[1], flush_interval=3600).attach(storage)  # Neither kept nor closed
+storage.put("a", 1)
+"""
+
+
+class TestChangeLog(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "run.cfglog")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_record_and_replay(self):
+        conf = ChangeLogConfig.new_instance("test_changelog")
+        log = conf.record_changes(self.path, flush_interval=3600)
+        conf.batchSize = 16
+        layers = [3]
+        conf.layers = layers
+        layers.append(4)  # Values are copied when they are recorded
+        self.assertEqual(len(list(iter_records(self.path))), 2)  # Only the snapshot has been written yet
+        log.flush()
+        middle = time.time()
+        conf.parse_cli(["--batchSize", "32"])
+        conf.override_with_env_vars({conf.param_to_env_name("batchSize"): "64"})
+        with change_source("sweep"):
+            conf.update({"layers": [5]})
+        log.close()
+        conf.batchSize = 1  # Not recorded anymore
+
+        records = list(iter_records(self.path))
+        self.assertEqual([(r.event, r.key, r.value, r.source) for r in records],
+                         [("put", "batchSize", 8, "snapshot"), ("put", "layers", [1, 2], "snapshot"),
+                          ("put", "batchSize", 16, "update"), ("put", "layers", [3], "update"),
+                          ("put", "batchSize", 32, "cli"), ("put", "batchSize", 64, "env"),
+                          ("put", "layers", [5], "sweep")])
+        self.assertEqual(replay(self.path), {"batchSize": 64, "layers": [5]})
+        self.assertEqual(replay(self.path, until=middle), {"batchSize": 16, "layers": [3]})
+        self.assertEqual(replay(self.path, until=0), {})
+
+        with open(self.path, "ab") as f:  # A record truncated by a crash
+            f.write(b"\x00\x01\x02")
+        self.assertEqual(len(list(iter_records(self.path))), 7)
+
+    def test_compact(self):
+        storage = DictStorage("test_changelog_compact")
+        storage.put("a", 1)
+        with ChangeLog(self.path, flush_interval=0, fsync=False, compact_every=4).attach(storage):
+            for i in range(3):
+                storage.put("b", i)
+            _wait_for(lambda: len(list(iter_records(self.path))) == 4)
+            beforeCompaction = time.time()
+            storage.delete("a")  # Fourth change, the log gets compacted
+            _wait_for(lambda: [(r.event, r.key, r.value) for r in iter_records(self.path)] ==
+                      [("checkpoint", "", None), ("put", "b", 2)])
+            storage.put("c", [1])
+        self.assertEqual(replay(self.path), {"b": 2, "c": [1]})
+        with self.assertRaises(ValueError):  # That state was dropped by the compaction
+            replay(self.path, until=beforeCompaction)
+        # New logs append to the existing file
+        with ChangeLog(self.path).attach(DictStorage("test_changelog_compact2")):
+            pass
+        self.assertEqual(len(list(iter_records(self.path))), 3)
+
+    def test_background_flush(self):
+        storage = DictStorage("test_changelog_background")
+        log = ChangeLog(self.path, flush_bytes=1, flush_interval=3600).attach(storage)
+        writers = []
+        writeFile = log._file.write
+        log._file.write = lambda data: writers.append(threading.current_thread()) or writeFile(data)
+        storage.put("a", 1)  # Over flush_bytes, but written by the flusher thread
+        _wait_for(lambda: len(list(iter_records(self.path))) == 1)
+        self.assertEqual(writers, [log._flusher])
+        log.close()
+        self.assertFalse(log._flusher.is_alive())
+
+        subprocess.run([sys.executable, "-c", _EXIT_SCRIPT, self.path], check=True)
+        self.assertEqual(replay(self.path), {"a": 1})  # Pending records are written at exit
@@ -0,0 +1,89 @@
+import itertools
+import json
+import math
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+from configfile.envVarUtils import AVAILABLE_JSON_CODECS, get_codec, get_default_codec
+from configfile.storages import EnvVarsStorage
+
+# Values that the default codec must encode exactly as json.dumps (the format of the existing environments)
+EXACT_VALUES = [0, -1, 2**63 - 1, -2**63, 1.5, -0.25, 0.1, 123456.789, 1e16, 1e-5, True, False, None, "", "hola",
+                "ñandú ☃ \U0001F600", "quote\" back\\slash / tab\t new\nline \x01", [], [1, 2, 3], [1.0, 2.5],
+                ["a", "b"], {}, {"a": 1, "b": [1, 2], "c": {"d": None}}, {"é": 1e16}]
+# Values that every codec must read back identically, although the encodings may differ (e.g. 1e+16 vs 1e16)
+ROUNDTRIP_VALUES = EXACT_VALUES + [1.7976931348623157e308, 5e-324, 2**64, -2**70, {1: "a"}, float("inf"),
+                                   float("-inf"), {"ñandú": [1e-7, -2.5e300], "☃": "é"}]
+
+_CHILD_SCRIPT = """
+import os, sys
+from configfile.storages import EnvVarsStorage
+from configfile.envVarUtils import get_codec
+storage = EnvVarsStorage("codecChild", codec=sys.argv[1])
+n_values = int(sys.argv[2])
+if sys.argv[3] == "write":
+    values = get_codec("json").loads(sys.stdin.read())
+    for i, value in enumerate(values):
+        storage.put(str(i), value)
+    raws = [os.environ[storage.param_to_env_name(str(i))] for i in range(n_values)]
+    sys.stdout.write(get_codec("json").dumps(raws))
+else:
+    sys.stdout.write(get_codec("json").dumps([storage.get(str(i)) for i in range(n_values)]))
+"""
+
+
+def _same_value(a, b):
+    if type(a) != type(b):
+        return False
+    if isinstance(a, float) and math.isnan(a):
+        return math.isnan(b)
+    if isinstance(a, (list, tuple)):
+        return len(a) == len(b) and all(_same_value(x, y) for x, y in zip(a, b))
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_same_value(a[k], b[k]) for k in a)
+    return a == b
+
+
+class TestCodecs(TestCase):
+
+    def test_default_wire_format(self):
+        self.assertIs(type(get_default_codec()), type(get_codec("json")))
+        codec = get_codec("json")
+        for v in EXACT_VALUES:
+            self.assertEqual(codec.dumps(v), json.dumps(v), v)
+
+    def test_cross_decoding(self):
+        for name_a, name_b in itertools.product(AVAILABLE_JSON_CODECS, repeat=2):
+            codec_a, codec_b = get_codec(name_a), get_codec(name_b)
+            for v in ROUNDTRIP_VALUES:
+                expected = json.loads(json.dumps(v))  # e.g. non-string keys become strings
+                self.assertTrue(_same_value(codec_b.loads(codec_a.dumps(v)), expected), (name_a, name_b, v))
+
+    def test_nan(self):
+        for name_a, name_b in itertools.product(AVAILABLE_JSON_CODECS, repeat=2):
+            decoded = get_codec(name_b).loads(get_codec(name_a).dumps([float("nan")]))
+            self.assertTrue(math.isnan(decoded[0]), (name_a, name_b))
+
+    def test_cross_process(self):
+        values = [EXACT_VALUES[-2], "ñandú ☃", [1e-5, 2**64], {"é": 1e16}]
+        n_values = str(len(values))
+        for name_a, name_b in itertools.product(AVAILABLE_JSON_CODECS, repeat=2):
+            # A child process writes the values with codec_a and this process reads them with codec_b
+            raws = json.loads(subprocess.check_output([sys.executable, "-c", _CHILD_SCRIPT, name_a, n_values, "write"],
+                                                      input=json.dumps(values).encode("utf-8")))
+            reader = EnvVarsStorage("codecParent", codec=name_b)
+            for i, (raw, v) in enumerate(zip(raws, values)):
+                os.environ[reader.param_to_env_name(str(i))] = raw
+                self.assertTrue(_same_value(reader.get(str(i)), v), (name_a, name_b, v))
+                reader.delete(str(i))
+
+            # This process writes the values with codec_a and a child process reads them with codec_b
+            writer = EnvVarsStorage("codecChild", codec=name_a)
+            writer.put_many({str(i): v for i, v in enumerate(values)})
+            out = subprocess.check_output([sys.executable, "-c", _CHILD_SCRIPT, name_b, n_values, "read"])
+            for i in range(len(values)):
+                writer.delete(str(i))
+            for decoded, v in zip(json.loads(out), values):
+                self.assertTrue(_same_value(decoded, v), (name_a, name_b, v))
@@ -1,11 +1,13 @@
+import json
 import multiprocessing
 import os
 import subprocess
 import sys
+import time
 from typing import List, Optional, Dict
-from unittest import TestCase
+from unittest import TestCase, mock
 
-from configfile.exceptions import ConfigErrorParamNotDefined
+from configfile.exceptions import ConfigErrorFromEnv, ConfigErrorParamNotDefined, ConfigErrorParamTypeMismatch
 
 
 class TestConfig(TestCase):
@@ -503,6 +505,1075 @@ class TestConfig(TestCase):
         p.start()
         p.join()
 
+    def test_load_many(self):
+        from tests._configExample import MyConfig2
+        yaml_fname = os.path.join(os.path.dirname(__file__), "data/myconfig2.yaml")
+        env_before = dict(os.environ)
+        variants = MyConfig2.load_many([yaml_fname, None, yaml_fname],
+                                       overrides=[None, dict(conf2Int=-1), dict(conf2List=[5])], workers=2,
+                                       name="test_load_many")
+        self.assertEqual(len(variants), 3)
+        self.assertEqual(variants[0]["conf2Str"], "test_myconfig2")
+        self.assertEqual(variants[1], {"conf2Int": -1, "conf2Str": "tua", "conf2List": None})
+        self.assertEqual(variants[2]["conf2List"], [5])
+        with self.assertRaises(TypeError):
+            variants[0]["conf2Int"] = 3
+        self.assertEqual(dict(os.environ), env_before)
+
+        serial = MyConfig2.load_many(overrides=[dict(conf2Int=i) for i in range(3)], workers=1,
+                                     name="test_load_many")
+        self.assertEqual([v["conf2Int"] for v in serial], [0, 1, 2])
+        self.assertEqual(dict(os.environ), env_before)
+
+        from configfile.configbase import ConfigBase
+        class MyConfigLoadManyInner(ConfigBase):
+            def set_parameters(self):
+                self.depth: int = 2
+
+        class MyConfigLoadManyOuter(ConfigBase):
+            def set_parameters(self):
+                self.lr: float = 0.1
+                self._add_params_from_other_config(MyConfigLoadManyInner("test_load_many_inner"))
+
+        serial = MyConfigLoadManyOuter.load_many(overrides=[dict(test_load_many_inner__depth=i) for i in range(2)],
+                                                 workers=1, name="test_load_many_outer")
+        self.assertEqual([v["test_load_many_inner__depth"] for v in serial], [0, 1])
+        self.assertEqual(dict(os.environ), env_before)  # Nested configs are built isolated too
+        self.assertNotIn(MyConfigLoadManyInner, MyConfigLoadManyInner._instances)
+
+
+    def test_scoped(self):
+        import threading
+        from configfile.configbase import ConfigBase
+
+        class MyConfigScoped(ConfigBase):
+            def set_parameters(self):
+                self.confInt = 1
+                self.confList = [1, 2]
+
+        conf = MyConfigScoped("test_scoped")
+        env_before = dict(os.environ)
+        self.assertIs(MyConfigScoped.current(), conf)
+        results = {}
+
+        def worker(i):
+            with MyConfigScoped.scoped("test_scoped", confInt=i) as scoped_conf:
+                self.assertIsNot(scoped_conf, conf)
+                self.assertIs(MyConfigScoped.current(), scoped_conf)
+                scoped_conf.confList = [i]
+                results[i] = (MyConfigScoped.current().confInt, MyConfigScoped.current().confList)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, {i: (i, [i]) for i in range(4)})
+        self.assertIs(MyConfigScoped.current(), conf)
+        self.assertEqual(conf.confInt, 1)
+        self.assertEqual(dict(os.environ), env_before)
+
+        other = MyConfigScoped.new_instance("test_scoped", confInt=5)
+        self.assertEqual(other.confInt, 5)
+        self.assertEqual(conf.confInt, 1)
+
+
+    def test_diff(self):
+        from configfile.configbase import ConfigBase
+
+        class MyConfigDiffInner(ConfigBase):
+            def set_parameters(self):
+                self.innerInt = 1
+                self.innerDict = {"a": 1}
+
+        inner = MyConfigDiffInner("test_diff_inner")
+
+        class MyConfigDiff(ConfigBase):
+            def set_parameters(self):
+                self.confInt = 1
+                self.confFloat = 1.
+                self._add_params_from_other_config(inner)
+
+        conf = MyConfigDiff("test_diff")
+        changes = conf.diff({"confInt": 1, "confFloat": 1, "test_diff_inner": {"innerInt": 2, "innerDict": {"a": 1}}})
+        self.assertEqual(changes, {"confFloat": 1, "test_diff_inner__innerInt": 2})
+        conf.apply_diff(changes)
+        self.assertEqual(conf.test_diff_inner__innerInt, 2)
+        self.assertEqual(inner.innerInt, 2)
+        self.assertEqual(conf.diff(conf), {})
+        variant = MyConfigDiff.new_instance("test_diff", confInt=3)
+        self.assertEqual(conf.diff(variant), {"confInt": 3, "confFloat": 1.})
+        with self.assertRaises(ConfigErrorParamNotDefined):
+            conf.diff({"notDefined": 1})
+        with self.assertRaises(ConfigErrorParamNotDefined):
+            conf.apply_diff({"notDefined": 1})
+
+
+    def test_init_with_environ_bulk_decoding(self):
+        from unittest import mock
+        from configfile.configbase import ConfigBase
+        from configfile.envVarUtils import load_envvars_to_params, get_default_codec, AVAILABLE_JSON_CODECS
+        from configfile.exceptions import ConfigErrorFromEnv
+
+        class MyConfigBulkEnv(ConfigBase):
+            def set_parameters(self):
+                self.conf1Int = 1
+                self.conf1Str = "1"
+                self.conf1List = [1]
+
+        for k, v in dict(conf1Int="2", conf1Str='"2"', conf1List="[2, 3]").items():
+            os.environ["test_init_with_environ_bulk" + ConfigBase.PREFIX_ENV_SEP + k] = v
+        codec = get_default_codec()
+        with mock.patch.object(codec, "loads_many", wraps=codec.loads_many) as loads_many:
+            conf = MyConfigBulkEnv("test_init_with_environ_bulk")
+            self.assertEqual(conf.all_parameters_dict, {"conf1Int": 2, "conf1Str": "2", "conf1List": [2, 3]})
+            self.assertEqual(loads_many.call_count, 1)
+
+        self.assertEqual(load_envvars_to_params(["1", '"a"', "[1, 2]", " 3 "]), [1, "a", [1, 2], 3])
+        for codec_name in AVAILABLE_JSON_CODECS:
+            self.assertRaises(ValueError, load_envvars_to_params, ["1,2", "3"], codec_name)
+            # Malformed values whose pieces add up to valid json
+            self.assertRaises(ValueError, load_envvars_to_params, ["1,[2", "3]"], codec_name)
+            self.assertRaises(ValueError, load_envvars_to_params, ['"a', '"'], codec_name)
+
+        os.environ["test_init_with_environ_bulk" + ConfigBase.PREFIX_ENV_SEP + "conf1Int"] = "1,[2"
+        os.environ["test_init_with_environ_bulk" + ConfigBase.PREFIX_ENV_SEP + "conf1List"] = "3]"
+        with self.assertRaises(ConfigErrorFromEnv):
+            MyConfigBulkEnv.new_instance("test_init_with_environ_bulk").override_with_env_vars()
+        for k in ("conf1Int", "conf1Str", "conf1List"):
+            del os.environ["test_init_with_environ_bulk" + ConfigBase.PREFIX_ENV_SEP + k]
+
+
+    def test_startup_trace(self):
+        import json
+        import tempfile
+        from configfile.configbase import ConfigBase
+
+        class MyConfigTracedInner(ConfigBase):
+            TRACE_STARTUP = True
+            def set_parameters(self):
+                self.innerInt = 1
+
+        class MyConfigTraced(ConfigBase):
+            TRACE_STARTUP = True
+            def set_parameters(self):
+                self.confInt = 1
+                self._add_params_from_other_config(MyConfigTracedInner("test_startup_trace_inner"))
+
+        conf = MyConfigTraced("test_startup_trace")
+        trace = conf.startup_trace.as_dict()
+        self.assertEqual(trace["config"], "test_startup_trace")
+        self.assertEqual(set(trace["phases"]), {"copy_environ", "build_storage", "get_annotations", "set_parameters",
+                                                "bind_descriptors", "override_with_env_vars"})
+        self.assertGreaterEqual(trace["total"], sum(trace["phases"].values()))
+        self.assertEqual([child["config"] for child in trace["children"]], ["test_startup_trace_inner"])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, "trace.json")
+            conf.startup_trace.dump_chrome_trace(fname)
+            with open(fname) as f:
+                events = json.load(f)["traceEvents"]
+        self.assertEqual(len(events), 2 + len(conf.startup_trace.phases) +
+                         len(conf.startup_trace.children[0].phases))
+        self.assertTrue(all(event["ph"] == "X" for event in events))
+
+        class MyConfigNotTraced(ConfigBase):
+            def set_parameters(self):
+                self.confInt = 1
+        self.assertIsNone(MyConfigNotTraced("test_startup_trace_not_traced").startup_trace)
+
+
+    def test_param_descriptors(self):
+        import pickle
+        from configfile.configbase import ConfigBase
+
+        class MyConfigDescriptorsInner(ConfigBase):
+            def set_parameters(self):
+                self.innerInt = 1
+
+        inner = MyConfigDescriptorsInner("test_param_descriptors_inner")
+
+        class MyConfigDescriptors(ConfigBase):
+            def set_parameters(self):
+                self.confInt = 1
+                self.update = 2  # Parameters never shadow methods
+                self._add_params_from_other_config(inner)
+
+        conf = MyConfigDescriptors("test_param_descriptors")
+        self.assertIs(type(conf), MyConfigDescriptors)
+        self.assertIn("confInt", conf._param_routes)
+        self.assertIn("test_param_descriptors_inner__innerInt", conf._param_routes)
+        self.assertNotIn("update", conf._param_routes)
+        self.assertIs(conf._param_routes["test_param_descriptors_inner__innerInt"][0], inner._storage.fallbackStorage)
+        descriptor = MyConfigDescriptors.__dict__["confInt"]
+        conf.test_param_descriptors_inner__innerInt = 5
+        self.assertEqual(inner.innerInt, 5)
+        self.assertEqual(conf["test_param_descriptors_inner__innerInt"], 5)
+        conf.confInt = 3
+        self.assertEqual(conf.all_parameters_dict["confInt"], 3)
+        self.assertNotIn("confInt", conf.__dict__)
+        self.assertIs(MyConfigDescriptors("test_param_descriptors"), conf)
+        # Descriptors are installed once per class, and each instance reads its own storages
+        other = MyConfigDescriptors.new_instance("test_param_descriptors_other")
+        self.assertIs(type(other), MyConfigDescriptors)
+        self.assertIs(MyConfigDescriptors.__dict__["confInt"], descriptor)
+        other.confInt = 7
+        self.assertEqual((conf.confInt, other.confInt), (3, 7))
+        derived = conf.derive(confInt=8)
+        self.assertEqual((conf.confInt, derived.confInt), (3, 8))
+        derived.confInt = 9
+        self.assertEqual((conf.confInt, derived.confInt), (3, 9))
+
+        from tests._configExample import MyConfig2
+        conf2 = MyConfig2.new_instance("test_param_descriptors_pickle", conf2Int=3)
+        unpickled = pickle.loads(pickle.dumps(conf2))
+        self.assertEqual(unpickled.conf2Int, 3)
+        self.assertIs(type(unpickled), MyConfig2)
+        self.assertIn("conf2Int", unpickled._param_routes)
+        self.assertIsNot(unpickled._param_routes["conf2Int"][0], conf2._param_routes["conf2Int"][0])
+
+
+    def test_derive(self):
+        from configfile.configbase import ConfigBase
+
+        class MyConfigDeriveInner(ConfigBase):
+            def set_parameters(self):
+                self.innerInt = 1
+
+        inner = MyConfigDeriveInner("test_derive_inner")
+
+        class MyConfigDerive(ConfigBase):
+            def set_parameters(self):
+                self.confInt = 1
+                self.confList = [1, 2]
+                self._add_params_from_other_config(inner)
+
+        conf = MyConfigDerive("test_derive")
+        env_before = dict(os.environ)
+        derived = conf.derive(confInt=2, test_derive_inner__innerInt=3)
+        self.assertIsInstance(derived, MyConfigDerive)
+        self.assertEqual(derived.all_parameters_dict, {"confInt": 2, "confList": [1, 2],
+                                                       "test_derive_inner__innerInt": 3})
+        self.assertEqual(conf.confInt, 1)
+        self.assertEqual(inner.innerInt, 1)
+        conf.confList = [3]
+        self.assertEqual(derived.confList, [3])
+        derived.confList = [4]
+        self.assertEqual(conf.confList, [3])
+        self.assertEqual(derived._storage.overrides, {"confInt": 2, "confList": [4], "test_derive_inner__innerInt": 3})
+        derived2 = derived.derive(confInt=5)
+        self.assertEqual((derived2.confInt, derived2.confList), (5, [4]))
+        self.assertEqual(derived.confInt, 2)
+        conf.confList = [1, 2]
+        self.assertEqual({k: v for k, v in os.environ.items() if k not in env_before}, {})
+        with self.assertRaises(ConfigErrorParamNotDefined):
+            conf.derive(notDefined=1)
+
+
+    def test_computed(self):
+        from argparse import ArgumentParser
+        from configfile.configbase import ConfigBase
+        from configfile.computed import computed
+
+        n_calls = []
+
+        def _batch_size(conf):
+            n_calls.append(1)
+            return conf.dataset_size // conf.n_batches
+
+        class MyConfigComputed(ConfigBase):
+            def set_parameters(self):
+                self.dataset_size = 100
+                self.n_batches = 10
+                self.other = 1
+                self.batch_size: int = computed(_batch_size)
+                self.half_batch_size: int = computed(lambda conf: conf.batch_size // 2)
+
+        conf = MyConfigComputed("test_computed")
+        self.assertEqual(conf.batch_size, 10)
+        self.assertEqual(conf["half_batch_size"], 5)
+        self.assertEqual(len(n_calls), 1)
+        conf.other = 2
+        self.assertEqual(conf.batch_size, 10)
+        self.assertEqual(len(n_calls), 1)
+        conf.dataset_size = 200
+        self.assertEqual(len(n_calls), 1)
+        self.assertEqual(conf.half_batch_size, 10)
+        self.assertEqual(len(n_calls), 2)
+        self.assertEqual(conf.all_parameters_dict, {"dataset_size": 200, "n_batches": 10, "other": 2,
+                                                    "batch_size": 20, "half_batch_size": 10})
+
+        derived = conf.derive(n_batches=20)
+        self.assertEqual((derived.batch_size, conf.batch_size), (10, 20))
+        self.assertEqual(conf.diff(derived), {"n_batches": 20, "batch_size": 10, "half_batch_size": 5})
+        self.assertEqual(conf.diff({"batch_size": 20}), {})
+        derived = conf.derive(batch_size=7)
+        self.assertEqual((derived.batch_size, derived.half_batch_size, conf.half_batch_size), (7, 3, 10))
+
+        parser = ArgumentParser()
+        conf.add_args_to_argparse(parser)
+        conf.update(vars(parser.parse_args(["--dataset_size", "400"])))
+        self.assertEqual(conf.batch_size, 40)
+
+        conf.update(dict(batch_size=3))  # The computation is replaced by the explicit value
+        self.assertEqual(conf.half_batch_size, 1)
+        conf.dataset_size = 1000
+        self.assertEqual((conf.batch_size, conf.half_batch_size), (3, 1))
+
+    def test_nested_computed(self):
+        import tempfile
+        from configfile.configbase import ConfigBase
+        from configfile.computed import computed
+
+        class MyConfigNestedComputedInner(ConfigBase):
+            def set_parameters(self):
+                self.size = 10
+                self.double: int = computed(lambda conf: 2 * conf.size)
+
+        class MyConfigNestedComputed(ConfigBase):
+            def set_parameters(self):
+                self.other = 1
+                self._add_params_from_other_config(MyConfigNestedComputedInner.new_instance("inner"))
+
+        conf = MyConfigNestedComputed.new_instance("test_nested_computed")
+        self.assertEqual(conf.inner__double, 20)
+        self.assertEqual(conf.all_parameters_dict, {"other": 1, "inner__size": 10, "inner__double": 20})
+        conf.inner__size = 4
+        self.assertEqual(conf["inner__double"], 8)
+        self.assertEqual(conf.diff({"inner": {"double": 8, "size": 4}}), {})
+
+        with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as f:
+            f.write("inner:\n  double: 3\n")
+        try:
+            conf = MyConfigNestedComputed.new_instance("test_nested_computed", config_file=f.name)
+        finally:
+            os.remove(f.name)
+        self.assertEqual(conf.inner__double, 3)  # The computation is replaced by the value of the yaml file
+        conf.inner__size = 4
+        self.assertEqual(conf.inner__double, 3)
+
+    def test_fingerprint(self):
+        from configfile.configbase import ConfigBase
+
+        class MyConfigFingerprintInner(ConfigBase):
+            def set_parameters(self):
+                self.innerInt = 1
+                self.innerDict = {"b": 1, "a": 2}
+
+        inner = MyConfigFingerprintInner("test_fingerprint_inner")
+
+        class MyConfigFingerprint(ConfigBase):
+            def set_parameters(self):
+                self.confInt = 1
+                self.confList = [1, 2]
+                self._add_params_from_other_config(inner)
+
+        conf = MyConfigFingerprint("test_fingerprint")
+        initial = conf.fingerprint()
+        initial_inner = conf.fingerprint(inner)
+        self.assertEqual(initial_inner, inner.fingerprint())
+        conf.confInt = 2
+        self.assertNotEqual(conf.fingerprint(), initial)
+        self.assertEqual(conf.fingerprint("test_fingerprint_inner"), initial_inner)
+        inner.innerInt = 5
+        self.assertNotEqual(conf.fingerprint(inner), initial_inner)
+        self.assertEqual(conf.fingerprint(inner), inner.fingerprint())
+        inner.innerInt = 1
+        conf.confInt = 1
+        self.assertEqual(conf.fingerprint(), initial)
+        conf.update(dict(confList=[1, 2], test_fingerprint_inner__innerDict={"a": 2, "b": 1}))
+        self.assertEqual(conf.fingerprint(), initial)
+
+        variant = MyConfigFingerprint.new_instance("test_fingerprint")
+        self.assertEqual(variant.fingerprint(), initial)
+        self.assertNotEqual(conf.derive(confInt=3).fingerprint(), initial)
+
+    def test_aload(self):
+        import asyncio
+        import tempfile
+        from configfile.configbase import ConfigBase
+        from configfile.computed import computed
+
+        class MyConfigALoad(ConfigBase):
+            def set_parameters(self):
+                self.confInt = 1
+                self.confStr = "a"
+                self.confDouble: int = computed(lambda conf: 2 * conf.confInt)
+
+        conf = MyConfigALoad.new_instance("test_aload")
+        with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as f:
+            f.write("section:\n  confInt: 5\n  confStr: b\n")
+        try:
+            async def run():
+                await conf.aload(f.name, env_vars={conf.param_to_env_name("confStr"): '"c"'})
+                return await conf.aget("confInt"), await conf.aget("confDouble"), await conf.aall_parameters_dict()
+            confInt, confDouble, params = asyncio.run(run())
+        finally:
+            os.remove(f.name)
+        self.assertEqual((confInt, confDouble), (5, 10))
+        self.assertEqual(params, {"confInt": 5, "confStr": "c", "confDouble": 10})
+        with self.assertRaises(ConfigErrorParamNotDefined):
+            asyncio.run(conf.aget("missing"))
+
+    def test_lazy_imports(self):
+        # The async API and the socket based storages are only loaded when used
+        code = "import sys, configfile; print([m for m in ('asyncio', 'socketserver', 'configfile.kvstorage') " \
+               "if m in sys.modules])"
+        out = subprocess.check_output([sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(__file__)))
+        self.assertEqual(out.decode().strip(), "[]")
+        from configfile import storages
+        from configfile.kvstorage import RemoteKVStorage
+        self.assertIs(storages.RemoteKVStorage, RemoteKVStorage)
+
+    def test_yaml_layers(self):
+        import tempfile
+        from configfile.configbase import ConfigBase
+        from configfile import yamlcache
+
+        class MyConfigYamlLayers(ConfigBase):
+            YAML_DISK_CACHE = True
+            def set_parameters(self):
+                self.confInt = 1
+                self.confStr = "a"
+                self.confList = [1]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            base, experiment = os.path.join(tmpdir, "base.yaml"), os.path.join(tmpdir, "experiment.yaml")
+            with open(base, "w") as f:
+                f.write("section:\n  confInt: 5\n  confStr: b\n")
+            with open(experiment, "w") as f:
+                f.write("section:\n  confInt: 7\nother:\n  confList: [2, 3]\n")
+
+            conf = MyConfigYamlLayers.new_instance("test_yaml_layers", config_file=[base, experiment])
+            self.assertEqual(conf.all_parameters_dict, {"confInt": 7, "confStr": "b", "confList": [2, 3]})
+            self.assertTrue(os.path.isfile(os.path.join(tmpdir, ".base.yaml.configfile.pickle")))
+
+            yamlcache.clear_yaml_cache()
+            with mock.patch.object(yamlcache.yaml, "load", side_effect=AssertionError("parsed again")):
+                conf = MyConfigYamlLayers.new_instance("test_yaml_layers", config_file=[base, experiment])
+                self.assertEqual(conf.confInt, 7)  # Read from the pickles
+            MyConfigYamlLayers.YAML_DISK_CACHE = False
+            with mock.patch.object(yamlcache.yaml, "load", side_effect=AssertionError("parsed again")):
+                conf = MyConfigYamlLayers.new_instance("test_yaml_layers", config_file=base)
+                self.assertEqual(conf.confInt, 5)  # Read from the in-memory cache
+
+            with open(experiment, "w") as f:
+                f.write("section:\n  confInt: 8\n  notAParam: 1\n")
+            conf = MyConfigYamlLayers.new_instance("test_yaml_layers")
+            with self.assertRaises(ConfigErrorParamNotDefined):
+                conf.override_with_yaml([base, experiment])
+            self.assertEqual(conf.confInt, 1)  # Nothing is applied if any file is invalid
+
+            class MyConfigYamlLayersEnv(MyConfigYamlLayers):
+                pass
+            conf = MyConfigYamlLayersEnv.new_instance("test_yaml_layers_env")
+            conf._isolated = False
+            with mock.patch.dict(os.environ, {conf.DEFAULT_YML_LIST_ENVVARNAME: json.dumps([experiment, base])}):
+                with self.assertRaises(ConfigErrorParamNotDefined):
+                    conf.override_with_yaml(None)
+                with open(experiment, "w") as f:
+                    f.write("section:\n  confInt: 8\n")
+                conf.override_with_yaml(None)
+            self.assertEqual(conf.confInt, 5)
+            with mock.patch.dict(os.environ, {conf.DEFAULT_YML_ENVVARNAME: experiment,
+                                              conf.DEFAULT_YML_LIST_ENVVARNAME: json.dumps([base])}):
+                self.assertEqual(conf._yaml_files(None), [experiment, base])
+            with mock.patch.dict(os.environ, {conf.DEFAULT_YML_LIST_ENVVARNAME: experiment}):
+                with self.assertRaises(ConfigErrorFromEnv):
+                    conf.override_with_yaml(None)
+
+            # A single path is never split, even if it contains os.pathsep
+            colon_dir = os.path.join(tmpdir, "a:b;c")
+            os.mkdir(colon_dir)
+            colon_yaml = os.path.join(colon_dir, "conf.yaml")
+            with open(colon_yaml, "w") as f:
+                f.write("section:\n  confInt: 9\n")
+            with mock.patch.dict(os.environ, {conf.DEFAULT_YML_ENVVARNAME: colon_yaml}):
+                conf.override_with_yaml(None)
+            self.assertEqual(conf.confInt, 9)
+
+            with mock.patch.object(yamlcache, "MAX_CACHED_YAMLS", 2):
+                yamlcache.clear_yaml_cache()
+                for path in (base, experiment, colon_yaml, base):
+                    yamlcache.load_yaml(path)
+                self.assertEqual(list(yamlcache._PARSED_YAMLS), [os.path.abspath(colon_yaml), os.path.abspath(base)])
+
+    def test_yaml_sections(self):
+        import tempfile
+        from configfile.configbase import ConfigBase
+
+        class MyConfigYamlSectionsDeep(ConfigBase):
+            def set_parameters(self):
+                self.depth = 1
+
+        class MyConfigYamlSectionsInner(ConfigBase):
+            def set_parameters(self):
+                self.lr = 0.1
+                self.innerDict = {"a": 1}
+                self._add_params_from_other_config(MyConfigYamlSectionsDeep.new_instance("encoder"))
+
+        class MyConfigYamlSections(ConfigBase):
+            def set_parameters(self):
+                self.confInt = 1
+                self._add_params_from_other_config(MyConfigYamlSectionsInner.new_instance("model"))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            nested, flat = os.path.join(tmpdir, "nested.yaml"), os.path.join(tmpdir, "flat.yaml")
+            with open(nested, "w") as f:
+                f.write("model:\n  lr: 0.5\n  innerDict: {b: 2}\n  encoder:\n    depth: 3\n"
+                        "parameters:\n  confInt: 2\n")
+            with open(flat, "w") as f:
+                f.write("model:\n  model__lr: 0.7\n  confInt: 3\n")
+
+            conf = MyConfigYamlSections.new_instance("test_yaml_sections")
+            leaf = conf._storage.storages["model"].fallbackStorage
+            with mock.patch.object(type(leaf), "put", side_effect=AssertionError("per key write")):
+                conf.override_with_yaml(nested)
+            self.assertEqual(conf.all_parameters_dict, {"confInt": 2, "model__lr": 0.5, "model__innerDict": {"b": 2},
+                                                        "model__encoder__depth": 3})
+            conf.override_with_yaml(flat)  # Flattened keys in a section named as a nested config still work
+            self.assertEqual((conf.confInt, conf.model__lr), (3, 0.7))
+
+            derived = conf.derive()
+            derived.override_with_yaml(nested)
+            self.assertEqual((derived.model__lr, conf.model__lr), (0.5, 0.7))
+
+            with open(nested, "w") as f:
+                f.write("model:\n  encoder:\n    width: 3\n")
+            with self.assertRaises(ConfigErrorParamNotDefined):
+                conf.override_with_yaml(nested)
+
+    def test_registry(self):
+        import gc
+        from configfile.configbase import ConfigBase
+
+        class MyConfigRegistry(ConfigBase):
+            def set_parameters(self):
+                self.confInt = 1
+
+        registry = MyConfigRegistry.registry(max_instances=2)
+        tenantA = registry.get("tenantA", confInt=2)
+        self.assertEqual((tenantA.name, tenantA.confInt), ("tenantA", 2))
+        self.assertIs(registry["tenantA"], tenantA)
+        registry.get("tenantB")
+        registry.get("tenantA")
+        registry.get("tenantC")  # tenantB is the least recently used one
+        self.assertEqual(registry.keys(), ["tenantA", "tenantC"])
+        gc.collect()
+        self.assertNotIn("tenantB", registry)
+
+        registry.release("tenantA")
+        self.assertEqual(len(registry), 1)
+        self.assertIs(registry.get("tenantA"), tenantA)  # Still referenced, so it is not rebuilt
+        registry.release("tenantA")
+        del tenantA
+        gc.collect()
+        self.assertNotIn("tenantA", registry)
+        self.assertEqual(registry.get("tenantA").confInt, 1)
+
+        registry = MyConfigRegistry.registry(ttl=0.05)
+        registry.get("tenantA")
+        time.sleep(0.1)
+        self.assertEqual(len(registry), 0)
+
+        conf = MyConfigRegistry("test_registry")
+        self.assertIs(MyConfigRegistry(), conf)
+        self.assertIs(MyConfigRegistry.release(), conf)
+        self.assertIsNot(MyConfigRegistry("test_registry"), conf)
+
+    def test_release_without_gc(self):
+        import gc
+        import weakref
+        from configfile.computed import computed
+        from configfile.configbase import ConfigBase
+
+        class MyConfigReleaseInner(ConfigBase):
+            def set_parameters(self):
+                self.lr: float = 0.1
+
+        class MyConfigRelease(ConfigBase):
+            def set_parameters(self):
+                self.confInt: int = 1
+                self.doubleInt: int = computed(lambda conf: 2 * conf.confInt)
+                self._add_params_from_other_config(MyConfigReleaseInner.new_instance("inner"))
+
+        gc.collect()
+        gc.disable()  # The configs must be freed as soon as they are not referenced, not by the cyclic collector
+        try:
+            conf = MyConfigRelease("test_release_without_gc")
+            conf.fingerprint()
+            self.assertEqual(conf.doubleInt, 2)
+            self.assertIs(type(conf).release(), conf)
+            confRef, storageRef = weakref.ref(conf), weakref.ref(conf._storage)
+            del conf
+            self.assertIsNone(confRef())
+            self.assertIsNone(storageRef())
+
+            registry = MyConfigRelease.registry(max_instances=1)
+            conf = registry.get("tenantA")
+            derived = conf.derive(confInt=2)
+            self.assertEqual(derived.doubleInt, 4)
+            confRef, derivedRef = weakref.ref(conf), weakref.ref(derived)
+            del conf, derived
+            registry.get("tenantB")  # Evicts tenantA
+            self.assertIsNone(confRef())
+            self.assertIsNone(derivedRef())
+        finally:
+            gc.enable()
+
+    def test_typed_arrays(self):
+        import array
+        import pickle
+        from argparse import ArgumentParser
+        from configfile.configbase import ConfigBase
+        from configfile.utils import typeBuilder
+
+        class MyConfigTypedArrays(ConfigBase):
+            TYPED_ARRAYS = True
+            def set_parameters(self):
+                self.weights: List[float] = [0.5, 1.5]
+                self.ids: List[int] = [1, 2, 3]
+                self.names: List[str] = ["a"]
+
+        conf = MyConfigTypedArrays("test_typed_arrays")
+        self.assertEqual(conf.weights, array.array("d", [0.5, 1.5]))
+        self.assertEqual(conf.ids, array.array("q", [1, 2, 3]))
+        self.assertEqual(conf.names, ["a"])
+        raw = os.environ[conf.param_to_env_name("weights")]
+        self.assertTrue(raw.startswith('{"__array__": "d"'), raw)
+
+        conf.weights = [1, 2, 3]
+        self.assertEqual(conf.weights, array.array("d", [1., 2., 3.]))
+        view = conf.param_buffer("weights")
+        self.assertTrue(view.readonly)
+        self.assertEqual(view.format, "d")
+        self.assertEqual(view.tolist(), [1., 2., 3.])
+        self.assertIs(view.obj, conf.param_buffer("weights").obj)  # No copies
+        with self.assertRaises(ConfigErrorParamTypeMismatch):
+            conf.param_buffer("names")
+        with self.assertRaises(TypeError):
+            conf.ids = [1.5]
+
+        os.environ[conf.param_to_env_name("ids")] = "[4, 5]"
+        self.assertEqual(list(conf.ids), [4, 5])
+        conf.update({"ids": [6]})
+        self.assertEqual(conf.ids, array.array("q", [6]))
+
+        parser = ArgumentParser()
+        conf.add_args_to_argparse(parser)
+        conf.update(vars(parser.parse_args(["--weights", "0.1", "0.2"])))
+        self.assertEqual(conf.weights, array.array("d", [0.1, 0.2]))
+
+        variant = MyConfigTypedArrays.new_instance("test_typed_arrays", weights=[7])
+        self.assertEqual(variant.weights, array.array("d", [7.]))
+        self.assertEqual(variant.derive(ids=[8]).ids, array.array("q", [8]))
+        storage = pickle.loads(pickle.dumps(variant._storage))
+        storage.put("weights", [8])
+        self.assertEqual(storage.get("weights"), array.array("d", [8.]))
+        self.assertEqual(len(variant.fingerprint()), 16)
+        env = variant.subprocess_env()
+        self.assertIn('"__array__"', env[variant.param_to_env_name("weights")])
+
+        self.assertEqual(typeBuilder(float, True)("[1, 2]"), [1., 2.])
+        self.assertEqual(typeBuilder(int, True, typedArray=True)("[1, 2]"), array.array("q", [1, 2]))
+
+        self.assertEqual(conf.diff({"weights": [0.1, 0.2], "ids": array.array("q", [6])}), {})
+        self.assertEqual(conf.diff({"ids": [6, 7]}), {"ids": [6, 7]})
+        with mock.patch("configfile.cli.typeBuilder", wraps=typeBuilder) as builder:
+            conf.parse_cli(["--ids", "4", "5", "--names", "b", "c"])
+        self.assertEqual((conf.ids, conf.names), (array.array("q", [4, 5]), ["b", "c"]))
+        self.assertEqual(builder.call_args_list, [mock.call(int, True, isInputStr=False, typedArray=True),
+                                                  mock.call(str, True, isInputStr=False, typedArray=False)])
+        with self.assertRaises(ConfigErrorParamTypeMismatch):
+            conf.parse_cli(["--ids", "4", "x"])
+
+        # Only the typed parameters are converted back from the exported form, any other dict is left as is
+        class MyConfigArrayMarker(ConfigBase):
+            def set_parameters(self):
+                self.options: Dict[str, str] = {"__array__": "x"}
+                self.ids: List[int] = [1]
+
+        os.environ["test_array_marker___options"] = '{"__array__": "x", "b64": ""}'
+        markerConf = MyConfigArrayMarker("test_array_marker")  # Decoded from the env var
+        self.assertEqual(markerConf.options, {"__array__": "x", "b64": ""})
+        self.assertEqual(markerConf.ids, [1])
+        parser = ArgumentParser()
+        markerConf.add_args_to_argparse(parser)
+        self.assertEqual(parser.parse_args(["--options", '{"__array__": "x"}']).options, {"__array__": "x"})
+        del os.environ[markerConf.param_to_env_name("options")]
+
+    def test_dict_config(self):
+        import pickle
+        import tempfile
+        from argparse import ArgumentParser
+        from configfile.configbase import ConfigBase
+        from configfile.configbase_experimental import ConfigBaseDict
+
+        class MyDictConfigInner(ConfigBaseDict):
+            def set_parameters(self):
+                self.lr: float = 0.1
+                self.layers: List[int] = [1, 2]
+
+        class MyEnvConfigInner(ConfigBase):
+            def set_parameters(self):
+                self.dropout: float = 0.5
+
+        class MyDictConfig(ConfigBaseDict):
+            def set_parameters(self):
+                self.batchSize: int = 8
+                self.useGpu: bool = True
+                self._add_params_from_other_config(MyDictConfigInner("test_dict_config_model"))
+                self._add_params_from_other_config(MyEnvConfigInner("test_dict_config_env"))
+
+        with mock.patch.dict(os.environ, {}):
+            conf = MyDictConfig("test_dict_config")
+            env_name = conf.param_to_env_name("batchSize")
+            self.assertNotIn(env_name, os.environ)
+            conf.batchSize = 16
+            conf.test_dict_config_model__lr = 0.2
+            conf.update({"test_dict_config_env__dropout": 0.1})
+            self.assertNotIn(env_name, os.environ)
+            self.assertEqual(MyEnvConfigInner("test_dict_config_env").dropout, 0.5)  # Nested ConfigBase are copied
+            self.assertEqual(MyDictConfigInner("test_dict_config_model").lr, 0.2)  # Nested ConfigBaseDict are shared
+            self.assertEqual(conf.parameters_tree, {"batchSize": 16, "useGpu": True,
+                                                    "test_dict_config_model": {"lr": 0.2, "layers": [1, 2]},
+                                                    "test_dict_config_env": {"dropout": 0.1}})
+            self.assertEqual(conf["test_dict_config_model__layers"], [1, 2])
+
+            parser = ArgumentParser()
+            conf.add_args_to_argparse(parser)
+            args = parser.parse_args(["--NOT_useGpu", "--test_dict_config_model__layers", "3", "4"])
+            conf.update(vars(args))
+            self.assertEqual((conf.useGpu, conf.test_dict_config_model__layers), (False, [3, 4]))
+
+            with tempfile.NamedTemporaryFile("w", suffix=".yaml") as f:
+                f.write("test_dict_config:\n  batchSize: 4\ntest_dict_config_model:\n  lr: 0.3\n")
+                f.flush()
+                conf.override_with_yaml(f.name)
+            self.assertEqual((conf.batchSize, conf.test_dict_config_model__lr), (4, 0.3))
+            conf.override_with_env_vars({env_name: "32"})
+            self.assertEqual(conf.batchSize, 32)
+
+            storage = pickle.loads(pickle.dumps(conf._storage))
+            storage.put("batchSize", 1)
+            storage.put("test_dict_config_model__lr", 0.4)
+            self.assertEqual((conf.batchSize, conf.test_dict_config_model__lr), (32, 0.3))
+            self.assertEqual(storage.tree()["test_dict_config_model"]["lr"], 0.4)
+
+        with mock.patch.dict(os.environ, {env_name: "64"}):
+            MyDictConfig.release()
+            self.assertEqual(MyDictConfig("test_dict_config").batchSize, 64)
+            self.assertEqual(MyDictConfig.new_instance("test_dict_config_isolated").batchSize, 8)
+
+    def test_parse_cli(self):
+        import contextlib
+        import io
+        from configfile.configbase import ConfigBase
+        from configfile.utils import AnnotationTable
+
+        class MyConfigCliInner(ConfigBase):
+            def set_parameters(self):
+                self.lr: float = 0.1
+
+        class MyConfigCli(ConfigBase):
+            def set_parameters(self):
+                self.batchSize: int = 8
+                self.tags: List[str] = ["a"]
+                self.weights: Optional[List[float]] = None
+                self.extra: Dict[str, int] = {"a": 1}
+                self.useGpu: bool = True
+                self.debug: bool = False
+                self._add_params_from_other_config(MyConfigCliInner.new_instance("model"))
+
+        conf = MyConfigCli.new_instance("test_parse_cli")
+        params = conf.parse_cli(["--batchSize", "16", "--tags", "b", "c", "--weights=-1.5", "--extra", '{"b": 2}',
+                                 "--NOT_useGpu", "--debug", "--model__lr", "0.5"])
+        self.assertEqual(params, {"batchSize": 16, "tags": ["b", "c"], "weights": [-1.5], "extra": {"b": 2},
+                                  "useGpu": False, "debug": True, "model__lr": 0.5})
+        self.assertEqual((conf.batchSize, conf.tags, conf.useGpu, conf.debug, conf.model__lr),
+                         (16, ["b", "c"], False, True, 0.5))
+        self.assertEqual(conf.parse_cli([]), {})
+        self.assertEqual(conf.parse_cli(["--weights", "-1", "2"]), {"weights": [-1., 2.]})
+
+        with self.assertRaises(ConfigErrorParamNotDefined):
+            conf.parse_cli(["--notAParam", "1"])
+        with self.assertRaises(ConfigErrorParamNotDefined):
+            conf.parse_cli(["--NOT_batchSize"])
+        with self.assertRaises(ConfigErrorParamTypeMismatch):
+            conf.parse_cli(["--batchSize", "a"])
+        with self.assertRaises(ConfigErrorParamTypeMismatch):
+            conf.parse_cli(["--batchSize", "1", "2"])
+        with self.assertRaises(ConfigErrorParamTypeMismatch):
+            conf.parse_cli(["--extra", "{"])
+        self.assertEqual(conf.batchSize, 16)
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out), self.assertRaises(SystemExit):
+            conf.parse_cli(["--batchSize", "1", "--help"])
+        self.assertIn("--model__lr MODEL__LR  float. Default=0.5", out.getvalue())
+        self.assertIn("--NOT_debug  bool. Default=True", conf.cli_help())
+
+        class MyConfigCliBoolList(ConfigBase):
+            COMPACT = True
+            def set_parameters(self):
+                self.flags: List[bool] = [True]
+
+        conf = MyConfigCliBoolList.new_instance("test_parse_cli_bools")
+        with mock.patch.object(ConfigBase, "_get_annotations_from_function", side_effect=AssertionError):
+            self.assertEqual(conf.parse_cli(["--flags", "False", "true", "0", "1"]),
+                             {"flags": [False, True, False, True]})
+        with self.assertRaises(ConfigErrorParamTypeMismatch):
+            conf.parse_cli(["--flags", "yes"])
+        self.assertIsInstance(conf.config_classname_2_annotations_prefix["test_parse_cli_bools"][0], AnnotationTable)
+        self.assertIs(MyConfigCliBoolList.new_instance()._get_cli_spec(), conf._get_cli_spec())  # One per class
+        self.assertIsNot(MyConfigCli._get_cli_spec(), conf._get_cli_spec())
+
+    def test_provenance(self):
+        import pickle
+        import tempfile
+        from configfile.changelog import change_source
+        from configfile.configbase import ConfigBase
+
+        class MyConfigProvenance(ConfigBase):
+            TRACK_PROVENANCE = True
+
+            def set_parameters(self):
+                self.batchSize: int = 8
+                self.lr: float = 0.1
+                self.layers: List[int] = [1]
+
+        with tempfile.NamedTemporaryFile("w", suffix=".yaml") as f:
+            f.write("test_provenance:\n  batchSize: 16\n  lr: 0.2\n")
+            f.flush()
+            os.environ["test_provenance___batchSize"] = "32"
+            conf = MyConfigProvenance("test_provenance", config_file=f.name)
+        conf.parse_cli(["--layers", "2", "3"])
+        with change_source("sweep"):
+            conf.lr = 0.3
+
+        self.assertEqual(conf.provenance("batchSize"),
+                         ("env", 32, {"defaults": 8, "yaml": 16, "env": 32}))
+        self.assertEqual(conf.provenance("lr").layers, {"defaults": 0.1, "yaml": 0.2, "sweep": 0.3})
+        self.assertEqual(conf.provenance("layers").source, "cli")
+        conf.batchSize = 8
+        self.assertEqual(conf.provenance("batchSize"), ("update", 8, {"defaults": 8, "yaml": 16, "env": 32,
+                                                                      "update": 8}))
+        conf.update({"batchSize": 64})
+        with change_source("env"):
+            conf.batchSize = 128  # Sources are ordered by their last write
+        self.assertEqual(list(conf.provenance("batchSize").layers), ["defaults", "yaml", "update", "env"])
+
+        without_env = conf.without_layer("env")
+        self.assertEqual((without_env.batchSize, without_env.lr), (64, 0.3))
+        self.assertEqual(conf.batchSize, 128)
+        self.assertEqual(without_env.provenance("batchSize").source, "derive")
+        self.assertEqual(conf.without_layer("sweep").lr, 0.2)
+        self.assertEqual(conf.without_layer("defaults").batchSize, 128)
+
+        copy = pickle.loads(pickle.dumps(conf._provenance))
+        self.assertEqual(copy.provenance("lr").source, "sweep")
+        with self.assertRaises(ConfigErrorParamNotDefined):
+            conf.provenance("notAParam")
+
+        class MyConfigNoProvenance(ConfigBase):
+            def set_parameters(self):
+                self.batchSize: int = 8
+
+        with self.assertRaises(ConfigErrorParamNotDefined):
+            MyConfigNoProvenance.new_instance().provenance("batchSize")
+
+        class MyConfigProvenanceInner(ConfigBase):
+            def set_parameters(self):
+                self.lr: float = 0.1
+                self.depth: int = 1
+
+        class MyConfigProvenanceOuter(ConfigBase):
+            TRACK_PROVENANCE = True
+
+            def set_parameters(self):
+                self.batchSize: int = 8
+                self._add_params_from_other_config(MyConfigProvenanceInner("innerQ"))
+
+        with mock.patch.dict(os.environ, {"innerQ___lr": "0.5", "outerQ___innerQ__depth": "3"}):
+            try:
+                conf = MyConfigProvenanceOuter("outerQ")
+                self.assertEqual(conf.provenance("innerQ__lr"), ("env", 0.5, {"defaults": 0.1, "env": 0.5}))
+                self.assertEqual(conf.provenance("innerQ__depth"), ("env", 3, {"defaults": 1, "env": 3}))
+                self.assertEqual(conf.provenance("batchSize"), ("defaults", 8, {"defaults": 8}))
+                self.assertEqual(conf.without_layer("env").innerQ__lr, 0.1)
+            finally:
+                MyConfigProvenanceOuter.release()
+                MyConfigProvenanceInner.release()
+
+    def test_compact(self):
+        import array
+        import pickle
+        import sys
+        from argparse import ArgumentParser
+        from configfile.configbase import ConfigBase
+        from configfile.utils import AnnotationTable
+
+        class MyConfigCompact(ConfigBase):
+            COMPACT = True
+            TYPED_ARRAYS = True
+
+            def set_parameters(self):
+                self.batchSize: int = 8
+                self.weights: List[float] = [1.]
+                self.extra: Optional[Dict[str, int]] = None
+                self.untyped = "a"
+                for i in range(3):
+                    setattr(self, "layer%d_lr" % i, 0.1)
+
+        conf = MyConfigCompact.new_instance("test_compact")
+        annotations = conf.config_classname_2_annotations_prefix["test_compact"][0]
+        self.assertIsInstance(annotations, AnnotationTable)
+        self.assertIs(annotations, MyConfigCompact.new_instance().config_classname_2_annotations_prefix[
+            "MyConfigCompact"][0])  # Shared by all the instances
+        self.assertEqual(dict(annotations), {"batchSize": {"dtype": int, "isList": False, "isDict": False},
+                                             "weights": {"dtype": float, "isList": True, "isDict": False},
+                                             "extra": {"dtype": int, "isList": False, "isDict": True},
+                                             "untyped": None})
+        self.assertNotIn("notAParam", annotations)
+        self.assertEqual(pickle.loads(pickle.dumps(annotations)), annotations)
+
+        self.assertEqual(conf.weights, array.array("d", [1.]))
+        parser = ArgumentParser()
+        with mock.patch.object(AnnotationTable, "__iter__", side_effect=AssertionError("Table materialized")):
+            conf.add_args_to_argparse(parser)
+            conf.parse_cli(["--weights", "2", "3", "--layer2_lr", "0.5"])
+        self.assertEqual(parser.parse_args(["--extra", '{"a": 1}']).extra, {"a": 1})
+        self.assertEqual((conf.weights, conf.layer2_lr), (array.array("d", [2., 3.]), 0.5))
+        with self.assertRaises(ConfigErrorParamTypeMismatch):
+            conf.update({"notAParam": 1})
+        self.assertFalse(hasattr(conf._storage, "__dict__"))
+        self.assertEqual(pickle.loads(pickle.dumps(conf._storage)).get("batchSize"), 8)
+
+    def test_subtree(self):
+        from configfile.configbase import ConfigBase
+
+        class MyConfigSubtreeInner(ConfigBase):
+            def set_parameters(self):
+                self.innerInt = 1
+                self.innerDict = {"a": 1}
+
+        inner = MyConfigSubtreeInner("test_subtree_inner")
+
+        class MyConfigSubtree(ConfigBase):
+            def set_parameters(self):
+                self.confInt = 1
+                self._add_params_from_other_config(inner)
+
+        conf = MyConfigSubtree("test_subtree")
+        view = conf.subtree("test_subtree_inner")
+        self.assertEqual(set(view), {"innerInt", "innerDict"})
+        self.assertEqual(len(view), 2)
+        self.assertIn("innerInt", view)
+        self.assertNotIn("confInt", view)
+        self.assertEqual(view["innerInt"], 1)
+        self.assertEqual(view.innerDict, {"a": 1})
+        self.assertEqual(dict(view), {"innerInt": 1, "innerDict": {"a": 1}})
+
+        view.update({"innerInt": 2})
+        self.assertEqual(conf.test_subtree_inner__innerInt, 2)
+        self.assertEqual(inner.innerInt, 2)
+        view.innerInt = 3
+        self.assertEqual(conf.subtree(inner)["innerInt"], 3)
+        with self.assertRaises(ConfigErrorParamTypeMismatch):
+            view.update({"confInt": 2})
+        with self.assertRaises(ConfigErrorParamNotDefined):
+            view["confInt"]
+        with self.assertRaises(ConfigErrorParamNotDefined):
+            conf.subtree("missing")
+
+        derived = conf.derive(test_subtree_inner__innerInt=10)
+        derived_view = derived.subtree("test_subtree_inner")
+        self.assertEqual(derived_view["innerInt"], 10)
+        derived_view.update({"innerDict": {"b": 2}})
+        self.assertEqual(derived.test_subtree_inner__innerDict, {"b": 2})
+        self.assertEqual(view["innerDict"], {"a": 1})
+
+
+    def test_subprocess_env(self):
+        import json
+        from configfile.configbase import ConfigBase
+
+        class MyConfigSubprocessEnvInner(ConfigBase):
+            def set_parameters(self):
+                self.innerInt = 1
+                self.innerList = [1, 2]
+
+        inner = MyConfigSubprocessEnvInner("test_subprocess_env_inner")
+
+        class MyConfigSubprocessEnv(ConfigBase):
+            def set_parameters(self):
+                self.confInt = 1
+                self._add_params_from_other_config(inner)
+
+        conf = MyConfigSubprocessEnv("test_subprocess_env")
+        conf.confInt = 2
+        env = conf.subprocess_env(include=["test_subprocess_env_inner"])
+        self.assertEqual(env["PATH"], os.environ["PATH"])
+        self.assertNotIn(conf.param_to_env_name("confInt"), env)
+        self.assertEqual(json.loads(env[inner.param_to_env_name("innerList")]), [1, 2])
+
+        env = conf.subprocess_env(exclude=["test_subprocess_env_inner"], base={})
+        self.assertEqual(env, {conf.param_to_env_name("confInt"): "2"})
+
+        derived = conf.derive(test_subprocess_env_inner__innerInt=3)
+        env = derived.subprocess_env(include=["test_subprocess_env_inner"], base={})
+        self.assertEqual(set(env), {inner.param_to_env_name("innerInt"), inner.param_to_env_name("innerList")})
+        self.assertEqual(env[inner.param_to_env_name("innerInt")], "3")
+
+        out = subprocess.check_output([sys.executable, "-c", "import os; print(os.environ['%s'])" %
+                                       inner.param_to_env_name("innerInt")], env=derived.subprocess_env())
+        self.assertEqual(out.decode().strip(), "3")
+
+
+    def test_compiled_schema(self):
+        import importlib
+        import tempfile
+        from unittest import mock
+        from tests._configExample import MyConfig2
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            subprocess.check_call([sys.executable, "-m", "configfile.compile", "tests._configExample.MyConfig2",
+                                   "-o", os.path.join(tmpdir, "_myconfig2_schema_test.py")])
+            sys.path.insert(0, tmpdir)
+            try:
+                schema = importlib.import_module("_myconfig2_schema_test").SCHEMA
+                self.assertEqual(sorted(schema["annotations"]), ["conf2Int", "conf2List", "conf2Str"])
+                self.assertEqual(schema["annotations"]["conf2List"], {"dtype": "int", "isList": True, "isDict": False})
+
+                class MyConfig2Compiled(MyConfig2):
+                    COMPILED_SCHEMA = "_myconfig2_schema_test"
+
+                with mock.patch("configfile.utils._get_annotations_from_source",
+                                side_effect=OSError("could not get source code")):
+                    conf = MyConfig2Compiled.new_instance("test_compiled_schema")
+                annotations = conf._get_annotations_from_function()
+                self.assertEqual(annotations["conf2List"], {"dtype": int, "isList": True, "isDict": False})
+                self.assertEqual(annotations["conf2Int"], {"dtype": int, "isList": False, "isDict": False})
+
+                class MyConfig2CompiledOther(MyConfig2Compiled):  # The schema does not apply to other set_parameters
+                    def set_parameters(self):
+                        self.otherInt: int = 1
+
+                conf = MyConfig2CompiledOther.new_instance("test_compiled_schema_other")
+                self.assertEqual(list(conf._get_annotations_from_function()), ["otherInt"])
+
+                # A schema compiled from another version of set_parameters is ignored, with a warning
+                from configfile.compile import render_schema_module, load_compiled_annotations
+                for i, stale in enumerate([dict(schema, code_hash="0" * 64), dict(schema, source_hash="0" * 64)]):
+                    with open(os.path.join(tmpdir, f"_myconfig2_schema_stale{i}.py"), "w") as f:
+                        f.write(render_schema_module(stale))
+                    with self.assertWarns(UserWarning):
+                        self.assertIsNone(load_compiled_annotations(f"_myconfig2_schema_stale{i}",
+                                                                    MyConfig2.set_parameters))
+                self.assertIsNotNone(load_compiled_annotations("_myconfig2_schema_test", MyConfig2.set_parameters))
+            finally:
+                sys.path.remove(tmpdir)
+
+
 def _func():
     from tests._configExample_test_mlp3 import conf
 
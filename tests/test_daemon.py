@@ -0,0 +1,152 @@
+import array
+import multiprocessing
+import os
+import pickle
+import socket
+import stat
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from typing import Dict, List
+from unittest import TestCase
+
+from configfile.computed import computed
+from configfile.configbase import ConfigBase
+from configfile.daemon import _ConfigRequestHandler
+from configfile.exceptions import ConfigErrorParamTypeMismatch
+
+
+class DaemonInnerConfig(ConfigBase):
+    def set_parameters(self):
+        self.lr: float = 0.1
+        self.layers: List[int] = [1, 2]
+
+
+class DaemonConfig(ConfigBase):
+    def set_parameters(self):
+        self.batchSize: int = 8
+        self.name_: str = "a"
+        self.doubleBatch: int = computed(lambda conf: 2 * conf.batchSize)
+        self._add_params_from_other_config(DaemonInnerConfig.new_instance("model"))
+
+
+def _wait_for(condition, timeout=5.):
+    start = time.time()
+    while not condition():
+        if time.time() - start > timeout:
+            raise AssertionError("Timeout waiting for the daemon")
+        time.sleep(0.01)
+
+
+def _read_from_worker(path, queue):
+    conf = DaemonConfig.from_daemon(path)
+    queue.put(conf.all_parameters_dict)
+
+
+class TestDaemon(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "config.sock")
+        self.conf = DaemonConfig.new_instance("test_daemon", model__lr=0.5)
+        self.server = self.conf.serve(self.path)
+
+    def tearDown(self):
+        self.server.close()
+        self.tmpdir.cleanup()
+
+    def test_snapshot(self):
+        client = DaemonConfig.from_daemon(self.path)
+        self.assertEqual(client.all_parameters_dict, self.conf.all_parameters_dict)
+        self.assertEqual(client.model__lr, 0.5)
+        self.assertEqual(client.doubleBatch, 16)
+        self.assertEqual(client.subtree("model")["layers"], [1, 2])
+        parser = ArgumentParser()
+        client.add_args_to_argparse(parser)
+        self.assertEqual(parser.parse_args(["--model__layers", "3", "4"]).model__layers, [3, 4])
+
+    def test_pushes(self):
+        client, other = DaemonConfig.from_daemon(self.path), DaemonConfig.from_daemon(self.path)
+        self.conf.model__lr = 0.7
+        _wait_for(lambda: client.model__lr == 0.7)
+        self.conf.batchSize = 10
+        _wait_for(lambda: client.doubleBatch == 20)
+
+        client.update({"batchSize": 3, "model__layers": [5]})
+        self.assertEqual((client.batchSize, self.conf.batchSize, self.conf.model__layers), (3, 3, [5]))
+        _wait_for(lambda: other.model__layers == [5] and other.doubleBatch == 6)
+        self.assertEqual(client.doubleBatch, 6)
+        with self.assertRaises(ConfigErrorParamTypeMismatch):
+            client._storage.fallbackStorage.put("notAParam", 1)
+
+        detached = pickle.loads(pickle.dumps(client))
+        detached.batchSize = 100
+        self.assertEqual(self.conf.batchSize, 3)
+
+    def test_other_process(self):
+        ctx = multiprocessing.get_context("fork")
+        queue = ctx.Queue()
+        process = ctx.Process(target=_read_from_worker, args=(self.path, queue))
+        process.start()
+        params = queue.get(timeout=10)
+        process.join()
+        self.assertEqual(params, self.conf.all_parameters_dict)
+
+    def test_socket_permissions(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+        self.assertEqual(os.listdir(self.tmpdir.name), ["config.sock"])
+        with self.assertRaises(OSError):
+            self.conf.serve(self.path)
+
+    def test_slow_subscriber(self):
+        client = DaemonConfig.from_daemon(self.path)
+        _ConfigRequestHandler.MAX_PENDING_MESSAGES, default = 10, _ConfigRequestHandler.MAX_PENDING_MESSAGES
+        stuck = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)  # Subscribes but never reads
+        try:
+            stuck.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+            stuck.connect(self.path)
+            stuck.sendall(b'{"id": 0, "op": "subscribe"}\n')
+            _wait_for(lambda: len(self.server._subscribers) == 2)
+
+            def write():
+                for i in range(200):
+                    self.conf.name_ = str(i) * 10000
+            writer = threading.Thread(target=write)
+            writer.start()
+            writer.join(10)
+            self.assertFalse(writer.is_alive())  # The changes are not blocked by the client that does not read
+            _wait_for(lambda: len(self.server._subscribers) == 1)
+            _wait_for(lambda: client.name_ == "199" * 10000)
+        finally:
+            _ConfigRequestHandler.MAX_PENDING_MESSAGES = default
+            stuck.close()
+
+    def test_client_attributes(self):
+        class DaemonConfigProvenance(DaemonConfig):
+            TRACK_PROVENANCE = True
+
+        client = DaemonConfigProvenance.from_daemon(self.path)
+        local = DaemonConfigProvenance.new_instance("test_daemon")
+        self.assertEqual(set(local.__dict__) - set(client.__dict__), set())
+        self.assertEqual(client.provenance("model__lr").source, "daemon")
+        client.batchSize = 4
+        self.assertEqual(client.provenance("batchSize").layers, {"daemon": 8, "update": 4})
+
+    def test_typed_arrays(self):
+        class DaemonTypedConfig(ConfigBase):
+            TYPED_ARRAYS = True
+            def set_parameters(self):
+                self.weights: List[float] = [0.5]
+                self.options: Dict[str, str] = {"__array__": "x"}
+
+        conf = DaemonTypedConfig.new_instance("test_daemon_typed")
+        path = os.path.join(self.tmpdir.name, "typed.sock")
+        with conf.serve(path):
+            client = DaemonTypedConfig.from_daemon(path)
+            self.assertEqual(client.weights, array.array("d", [0.5]))
+            self.assertEqual(client.options, {"__array__": "x"})
+            conf.weights = [1, 2]
+            _wait_for(lambda: client.weights == array.array("d", [1., 2.]))
+            client.weights = [3]
+            self.assertEqual(conf.weights, array.array("d", [3.]))
@@ -0,0 +1,182 @@
+import pickle
+import time
+from unittest import TestCase
+
+from configfile.kvstorage import RemoteKVStorage, KVStorageError, get_pool
+from configfile.storages import MultiStorage, DictStorage
+from tests._fakeKVServer import FakeKVServer
+
+
+class TestRemoteKVStorage(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeKVServer().__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        get_pool(cls.server.url).close()
+        cls.server.__exit__()
+
+    def setUp(self):
+        self.server.data.clear()
+        self.server.scan_duplicates = 0
+
+    def test_put_get(self):
+        storage = RemoteKVStorage("kvPutGet", url=self.server.url)
+        storage.put("intVar", 1)
+        storage.put("dictVar", {"a": [1, 2]})
+        self.assertEqual(self.server.data["kvPutGet___intVar"], "1")
+        self.assertEqual(storage.get("dictVar"), {"a": [1, 2]})
+        self.assertIn("intVar", storage)
+        self.assertNotIn("missing", storage)
+        with self.assertRaises(KeyError):
+            storage.get("missing")
+        self.assertEqual(sorted(storage.keys()), ["dictVar", "intVar"])
+        storage.delete("intVar")
+        self.assertNotIn("intVar", storage)
+        with self.assertRaises(KeyError):
+            storage.delete("intVar")
+
+    def test_cache(self):
+        storage = RemoteKVStorage("kvCache", url=self.server.url, cache_ttl=60)
+        other = RemoteKVStorage("kvCache", url=self.server.url, cache_ttl=0.05)
+        storage.put("intVar", 1)
+        self.assertEqual(other.get("intVar"), 1)
+        del self.server.commands[:]
+        self.assertEqual(storage.get("intVar"), 1)
+        self.assertEqual(self.server.commands, [])  # Served from the local cache
+
+        other.put("intVar", 2)
+        self.assertEqual(storage.get("intVar"), 1)  # Stale until the entry expires or is invalidated
+        storage.invalidate("intVar")
+        self.assertEqual(storage.get("intVar"), 2)
+        storage.put("intVar", 3)
+        time.sleep(0.1)
+        self.assertEqual(other.get("intVar"), 3)
+
+    def test_invalidation_channel(self):
+        storage = RemoteKVStorage("kvInvalidation", url=self.server.url, cache_ttl=60,
+                                  invalidation_channel="kvInvalidationChannel")
+        other = RemoteKVStorage("kvInvalidation", url=self.server.url, cache_ttl=60,
+                                invalidation_channel="kvInvalidationChannel")
+        unrelated = RemoteKVStorage("kvInvalidationOther", url=self.server.url, cache_ttl=60,
+                                    invalidation_channel="kvInvalidationChannel")
+        storage.put("intVar", 1)
+        unrelated.put("intVar", 10)
+        self.assertEqual(other.get("intVar"), 1)
+        other.put_many({"intVar": 2, "strVar": "a"})
+
+        def wait_for(condition):
+            deadline = time.monotonic() + 5
+            while not condition() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertTrue(condition())
+
+        wait_for(lambda: "intVar" not in storage._cache)
+        self.assertEqual(storage.get("intVar"), 2)
+        self.assertIn("intVar", unrelated._cache)  # Only the keys of the same storage are invalidated
+        other.delete("intVar")
+        wait_for(lambda: "intVar" not in storage._cache)
+        self.assertNotIn("intVar", storage)
+
+    def test_scan_duplicates(self):
+        storage = RemoteKVStorage("kvScan", url=self.server.url, cache_ttl=0, scan_count=2)
+        items = {f"var{i}": i for i in range(5)}
+        storage.put_many(items)
+        self.server.scan_duplicates = 1
+        self.assertEqual(sorted(storage.keys()), sorted(items))
+        self.assertEqual(dict(storage.items()), items)
+
+    def test_bulk_operations(self):
+        storage = RemoteKVStorage("kvBulk", url=self.server.url, cache_ttl=0, scan_count=2)
+        items = {f"var{i}": i for i in range(5)}
+        del self.server.commands[:]
+        storage.put_many(items)
+        self.assertEqual(self.server.commands, ["MSET"])
+        self.assertEqual(storage.get_many(["var1", "var3", "missing"]), {"var1": 1, "var3": 3})
+        self.assertEqual(dict(storage.items()), items)
+        self.assertNotIn("GET", self.server.commands)
+
+    def test_connection_pool(self):
+        storage = RemoteKVStorage("kvPool", url=self.server.url)
+        pool = get_pool(self.server.url)
+        pool.close()
+        storage.put("intVar", 1)
+        storage.put("intVar", 2)
+        self.assertEqual(len(pool._idle), 1)
+        with self.assertRaises(KVStorageError):
+            storage._execute("NOTACOMMAND")
+        storage.put("intVar", 3)
+        self.assertEqual(len(pool._idle), 1)
+
+    def test_multiStorage(self):
+        remote = RemoteKVStorage("kvNested", url=self.server.url)
+        multiStorage = MultiStorage("kvMulti", fallbackStorageClassName="DictStorage")
+        multiStorage.addStorage(remote)
+        multiStorage.put_many({"localVar": 1, "kvNested__remoteVar": 2})
+        self.assertEqual(self.server.data, {"kvNested___remoteVar": "2"})
+        self.assertEqual(dict(multiStorage.items()), {"localVar": 1, "kvNested__remoteVar": 2})
+        events = []
+        multiStorage.add_listener(lambda event, k, v: events.append((event, k, v)))
+        multiStorage.put("kvNested__remoteVar", 3)
+        self.assertEqual(events, [("put", "kvNested__remoteVar", 3)])
+
+        copied = pickle.loads(pickle.dumps(multiStorage))
+        self.assertEqual(copied.get("kvNested__remoteVar"), 3)
+        isolated = multiStorage.isolated_copy()
+        self.assertIsInstance(isolated.storages["kvNested"], DictStorage)
+        isolated.put("kvNested__remoteVar", 4)
+        self.assertEqual(multiStorage.get("kvNested__remoteVar"), 3)
+
+        fallbackRemote = MultiStorage("kvFallback", fallbackStorageClassName="RemoteKVStorage",
+                                      fallbackStorageKwargs={"url": self.server.url})
+        fallbackRemote.put("intVar", 1)
+        self.assertEqual(self.server.data["kvFallback___intVar"], "1")
+
+    def test_async(self):
+        import asyncio
+        from configfile.storages import OverlayStorage
+
+        multiStorage = MultiStorage("kvAsyncMulti", fallbackStorageClassName="DictStorage")
+        for i in range(3):
+            multiStorage.addStorage(RemoteKVStorage(f"kvAsync{i}", url=self.server.url, cache_ttl=0))
+
+        async def run():
+            await multiStorage.aput_many({"localVar": 0, **{f"kvAsync{i}__var": i for i in range(3)}})
+            self.assertEqual(await multiStorage.aget("kvAsync1__var"), 1)
+            self.assertTrue(await multiStorage.acontains("kvAsync2__var"))
+            self.assertFalse(await multiStorage.acontains("kvMissing__var"))
+            items = dict(await multiStorage.aitems())
+            self.assertEqual(items, dict(multiStorage.items()))
+            overlay = OverlayStorage("kvAsyncOverlay", multiStorage, {"kvAsync0__var": 10})
+            self.assertEqual(dict(await overlay.aitems())["kvAsync0__var"], 10)
+            self.assertEqual(await overlay.aget("kvAsync1__var"), 1)
+            await multiStorage.adelete("kvAsync1__var")
+            with self.assertRaises(KeyError):
+                await multiStorage.aget("kvAsync1__var")
+
+        asyncio.run(run())
+        self.assertEqual(self.server.data["kvAsync0___var"], "0")
+
+    def test_async_listeners_thread(self):
+        import asyncio
+        import threading
+
+        multiStorage = MultiStorage("kvAsyncThread", fallbackStorageClassName="DictStorage")
+        multiStorage.addStorage(RemoteKVStorage("kvAsyncThread0", url=self.server.url, cache_ttl=0))
+        threads = []
+        multiStorage.add_listener(lambda event, k, v: threads.append((event, k, threading.current_thread())))
+
+        async def run():
+            await multiStorage.aput("kvAsyncThread0__var", 1)
+            await multiStorage.aput_many({"kvAsyncThread0__var": 2, "kvAsyncThread0__other": 3})
+            await multiStorage.adelete("kvAsyncThread0__other")
+            with self.assertRaises(KeyError):
+                await multiStorage.adelete("kvAsyncThread0__other")
+
+        asyncio.run(run())
+        self.assertEqual([(event, k) for event, k, _ in threads],
+                         [("put", "kvAsyncThread0__var"), ("put", "kvAsyncThread0__var"),
+                          ("put", "kvAsyncThread0__other"), ("delete", "kvAsyncThread0__other")])
+        self.assertTrue(all(thread is threading.main_thread() for _, _, thread in threads))
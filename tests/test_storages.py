@@ -6,7 +6,7 @@ from typing import List, Optional, Dict
 from unittest import TestCase
 
 from configfile.exceptions import ConfigErrorParamNotDefined
-from configfile.storages import EnvVarsStorage, MultiStorage
+from configfile.storages import EnvVarsStorage, MultiStorage, DictStorage, DictTreeStorage
 
 
 class TestSotrages(TestCase):
@@ -117,4 +117,70 @@ class TestSotrages(TestCase):
         self.assertEqual(multiStorage2.get(storageVarname), 0)
 
         for fullname, v in multiStorage2.items():
-            self.assertEqual(multiStorage2.get(fullname), v)
\ No newline at end of file
+            self.assertEqual(multiStorage2.get(fullname), v)
+
+    def test_isolated_copy(self):
+        storage0 = EnvVarsStorage(name="envStorageIso0")
+        storage0.put("kk", [1, 2])
+        multiStorage = MultiStorage("mainStorageIso0")
+        multiStorage.put("intVar", 1)
+        multiStorage.addStorage(storage0)
+        copied = multiStorage.isolated_copy()
+        self.assertIsInstance(copied.fallbackStorage, DictStorage)
+        self.assertEqual(dict(copied.items()), dict(multiStorage.items()))
+        copied.put("intVar", 2)
+        copied.put(MultiStorage._storage2MultiVarname("kk", storage0), [3])
+        self.assertEqual(multiStorage.get("intVar"), 1)
+        self.assertEqual(storage0.get("kk"), [1, 2])
+        copied.get(MultiStorage._storage2MultiVarname("kk", storage0)).append(4)
+        self.assertEqual(copied.get(MultiStorage._storage2MultiVarname("kk", storage0)), [3])
+
+
+    def test_envStorageCache(self):
+        from unittest import mock
+        storage0 = EnvVarsStorage(name="envStorageCache0")
+        storage0.put("kk", [1, 2])
+        with mock.patch.object(storage0.codec, "loads", wraps=storage0.codec.loads) as loads:
+            self.assertEqual(storage0.get("kk"), [1, 2])
+            self.assertEqual(dict(storage0.items()), {"kk": [1, 2]})
+            self.assertEqual(loads.call_count, 0)
+            storage0.get("kk").append(3)
+            self.assertEqual(storage0.get("kk"), [1, 2])
+            os.environ[storage0.param_to_env_name("kk")] = "[3]"  # External modification
+            self.assertEqual(storage0.get("kk"), [3])
+            self.assertEqual(loads.call_count, 1)
+
+
+    def test_listeners(self):
+        events = []
+        storage0 = DictStorage(name="listeners0")
+        multiStorage = MultiStorage("listenersMain0", fallbackStorageClassName="DictStorage")
+        multiStorage.addStorage(storage0)
+        multiStorage.add_listener(lambda event, k, v: events.append((event, k, v)))
+        multiStorage.put("intVar", 1)
+        storage0.put_many({"kk": 2})
+        storage0.delete("kk")
+        self.assertEqual(events, [("put", "intVar", 1), ("put", "listeners0__kk", 2),
+                                  ("delete", "listeners0__kk", None)])
+        multiStorage.removeStorage("listeners0")
+        storage0.put("kk", 3)
+        self.assertEqual(len(events), 3)
+
+    def test_dictTreeIndex(self):
+        inner = DictTreeStorage("treeIndexInner")
+        inner.put("lr", 0.1)
+        tree = DictTreeStorage("treeIndexMain")
+        tree.addStorage(inner)
+        tree.put("epochs", 1)
+        tree.build_index()
+        self.assertEqual(set(tree._index), {"epochs", "treeIndexInner__lr"})  # Top-level keys are indexed too
+        for i in range(100):
+            self.assertNotIn(f"treeIndexInner__missing{i}", tree)
+            self.assertNotIn(f"missing{i}", tree)
+        self.assertEqual(len(tree._index), 2)  # Missing keys are not
+        inner.delete("lr")
+        tree.delete("epochs")
+        self.assertEqual(tree._index, {})
+        tree.put("treeIndexInner__lr", 0.2)
+        self.assertEqual(tree.get("treeIndexInner__lr"), 0.2)
+        self.assertIn("treeIndexInner__lr", tree._index)